@@ -0,0 +1,63 @@
+"""Measure cold start of the SWB API: import of the app and first /predict request.
+
+Each measurement runs in a fresh Python process, for each of the model loading modes
+of `sleepwellbaby.dashboard.app` (SWB_LOAD_MODEL=import or lazy).
+
+Usage:
+    python benchmarks/cold_start.py [--repeats 5] [--output cold_start.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+MEASURE = """
+import json, time
+t0 = time.perf_counter()
+from sleepwellbaby.dashboard.app import app
+t1 = time.perf_counter()
+from sleepwellbaby.data import get_example_payload
+payload = get_example_payload()
+payload["observation_date"] = payload["birth_date"]
+client = app.test_client()
+response = client.post("/predict", json=payload)
+assert response.status_code == 200
+t2 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "first_request": t2 - t1, "total": t2 - t0}))
+"""
+
+
+def measure(mode: str, repeats: int) -> dict:
+    """Time import and first request in `repeats` fresh processes, returns statistics in seconds."""
+    env = {**os.environ, "SWB_LOAD_MODEL": mode}
+    runs = []
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, "-c", MEASURE], env=env, check=True, capture_output=True, text=True
+        )
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        k: {"median": float(np.median([r[k] for r in runs])), "min": float(np.min([r[k] for r in runs]))}
+        for k in runs[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {mode: measure(mode, args.repeats) for mode in ["import", "lazy"]}
+    for mode, stats in results.items():
+        print(mode, ", ".join(f"{k}: {v['median']:.3f}s" for k, v in stats.items()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Benchmark the inference hot path per stage: preprocessing, eligibility, model and API round trip.
+
+Payloads are windows of synthetic data from `data.generate_mock_signalbase_data`. Stages of
+a single payload are timed per call, batch stages (e.g. `model.get_predictions` and
+`/predict_batch`) per batch for each batch size. Latencies are reported as p50/p95/p99
+in milliseconds, throughput in payloads per second.
+
+The DataFrame stages (dict_to_df, ref24h_correction, convert_to_features, reindex) are
+the steps of `preprocess.pipeline` with engine="tsfresh", the default native engine is
+timed as a whole (pipeline).
+
+Usage:
+    python benchmarks/inference.py [--repeats 200] [--batch-sizes 1 4 16 64 256 1024]
+                                   [--tsfresh] [--output inference.json] [--compare baseline.json]
+"""
+import argparse
+import datetime
+import json
+import platform
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import sklearn
+
+from sleepwellbaby import version
+from sleepwellbaby.data import (
+    compute_reference_values,
+    convert_to_payload,
+    generate_mock_signalbase_data,
+)
+from sleepwellbaby.eligibility import check_eligibility, check_eligibility_batch
+from sleepwellbaby.model import (
+    get_inference_model,
+    get_model,
+    get_prediction,
+    get_predictions,
+)
+from sleepwellbaby.preprocess import (
+    convert_to_features,
+    convert_to_features_native,
+    dict_to_df,
+    payloads_to_arrays,
+    pipeline,
+    pipeline_batch,
+    ref24h_correction,
+    vitals_freq,
+)
+
+default_batch_sizes = [1, 4, 16, 64, 256, 1024]
+birth_date = "1999-12-18"  # eligible on the dates of the mock data (2000-01-01)
+gestation_period = 210
+
+
+def make_payloads(n: int, seed: int = 0, missing: float = 0.05) -> List[dict]:
+    """Payloads of `n` windows of 192 samples of mock data, with a fraction of `missing` values."""
+    np.random.seed(seed)
+    df = generate_mock_signalbase_data(duration=3, freq="2s500ms").set_index("datetime")
+    df = compute_reference_values(df, freq=vitals_freq)
+    for c in ["HR", "RESP", "SpO2"]:
+        df.loc[np.random.rand(len(df)) < missing, c] = np.nan
+    # Windows ending after the 24h reference values are available
+    first = int(df["HR_24h_mean"].notna().to_numpy().argmax()) + 192
+    ends = np.random.randint(first, len(df) + 1, size=n)
+    return [convert_to_payload(df.iloc[end - 192:end], birth_date, gestation_period) for end in ends]
+
+
+def time_calls(fn: Callable, inputs: list) -> np.ndarray:
+    """Duration in seconds of `fn(x)` for each of `inputs`."""
+    times = np.empty(len(inputs))
+    for i, x in enumerate(inputs):
+        start = time.perf_counter()
+        fn(x)
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def summarize(times: np.ndarray, n_payloads: int = 1) -> Dict[str, float]:
+    """Latency percentiles in milliseconds and throughput in payloads per second."""
+    p50, p95, p99 = np.percentile(times, [50, 95, 99]) * 1e3
+    return {
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "throughput": float(n_payloads * len(times) / times.sum()),
+        "n": len(times),
+    }
+
+
+def benchmark_single(payloads: List[dict], tsfresh: bool = False) -> Dict[str, dict]:
+    """Time each stage for single payloads, inputs of a stage are prepared with the previous stages."""
+    from sleepwellbaby.dashboard.app import app
+
+    model, model_support_dict = get_model()
+    array_model = get_inference_model(model, "arrays")
+    columns = model_support_dict["Xcol"]
+    client = app.test_client()
+
+    dfs = [dict_to_df(payload) for payload in payloads]
+    corrected = [ref24h_correction(dict_to_df(payload), payload) for payload in payloads]
+    features = [convert_to_features_native(df) for df in corrected]
+    X = [pipeline(payload, model_support_dict) for payload in payloads]
+
+    stages = {
+        "dict_to_df": (dict_to_df, payloads),
+        "ref24h_correction": (lambda x: ref24h_correction(*x), list(zip(dfs, payloads))),
+        "convert_to_features_native": (convert_to_features_native, corrected),
+        "reindex": (lambda df: df.reindex(columns=columns), features),
+        "pipeline": (lambda payload: pipeline(payload, model_support_dict), payloads),
+        "check_eligibility": (check_eligibility, payloads),
+        "check_eligibility_short_circuit": (
+            lambda payload: check_eligibility(payload, short_circuit=True, cache_age=True), payloads
+        ),
+        "predict_proba": (model.predict_proba, X),
+        "predict_proba_arrays": (array_model.predict_proba, X),
+        "get_prediction": (lambda payload: get_prediction(payload, model, model_support_dict), payloads),
+        "api_predict": (lambda payload: client.post("/predict", json=payload), payloads),
+    }
+    if tsfresh:
+        # tsfresh renames the columns of its input, so it gets a copy (negligible compared to tsfresh)
+        stages["convert_to_features"] = (lambda df: convert_to_features(df.copy()), corrected[:20])
+
+    results = {}
+    for stage, (fn, inputs) in stages.items():
+        fn(inputs[0])  # warm up, e.g. caches and lazy imports
+        results[stage] = summarize(time_calls(fn, inputs))
+    return results
+
+
+def benchmark_batches(payloads: List[dict], batch_sizes: List[int], repeats: int) -> Dict[str, Dict[str, dict]]:
+    """Time batch stages per batch, for each batch size."""
+    from sleepwellbaby.dashboard.app import app
+
+    model, model_support_dict = get_model()
+    array_model = get_inference_model(model, "arrays")
+    client = app.test_client()
+    batch_payloads = [dict(payload, id=str(i)) for i, payload in enumerate(payloads)]
+
+    results = {}
+    for batch_size in batch_sizes:
+        # At least 5 batches, fewer repeats for large batches
+        n_batches = max(5, min(repeats, 4 * repeats // batch_size))
+        starts = np.random.randint(0, len(payloads) - batch_size + 1, size=n_batches)
+        batches = [payloads[s:s + batch_size] for s in starts]
+        X = [pipeline_batch(batch, model_support_dict) for batch in batches]
+        stages = {
+            "payloads_to_arrays": (payloads_to_arrays, batches),
+            "check_eligibility_batch": (
+                lambda arrays: check_eligibility_batch(**arrays), [payloads_to_arrays(b) for b in batches]
+            ),
+            "pipeline_batch": (lambda batch: pipeline_batch(batch, model_support_dict), batches),
+            "predict_proba": (model.predict_proba, X),
+            "predict_proba_arrays": (array_model.predict_proba, X),
+            "get_predictions": (lambda batch: get_predictions(batch, model, model_support_dict), batches),
+            "api_predict_batch": (
+                lambda batch: client.post("/predict_batch", json=batch),
+                [batch_payloads[s:s + batch_size] for s in starts],
+            ),
+        }
+        results[str(batch_size)] = {}
+        for stage, (fn, inputs) in stages.items():
+            fn(inputs[0])
+            results[str(batch_size)][stage] = summarize(time_calls(fn, inputs), batch_size)
+        print(f"batch size {batch_size} done")
+    return results
+
+
+def print_results(results: dict, baseline: dict = None):
+    """Print p50/p99 and throughput per stage, with the ratio of p50 to `baseline` if given."""
+    def rows(section: Dict[str, dict], prefix: str, base: Dict[str, dict]):
+        for stage, stats in section.items():
+            line = f"{prefix}{stage:<32} p50 {stats['p50']:9.3f} ms  p99 {stats['p99']:9.3f} ms  {stats['throughput']:10.1f}/s"
+            if base and stage in base:
+                line += f"  p50 x{stats['p50'] / base[stage]['p50']:.2f}"
+            print(line)
+
+    baseline = baseline or {}
+    rows(results["single"], "", baseline.get("single"))
+    for batch_size, section in results["batch"].items():
+        rows(section, f"[{batch_size:>4}] ", baseline.get("batch", {}).get(batch_size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=200, help="Number of payloads (or batches) per stage")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=default_batch_sizes)
+    parser.add_argument("--tsfresh", action="store_true", help="Also time convert_to_features (tsfresh, slow)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    payloads = make_payloads(max(args.repeats, max(args.batch_sizes)), seed=args.seed)
+    results = {
+        "meta": {
+            "version": version,
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "sklearn": sklearn.__version__,
+            "machine": platform.platform(),
+            "args": vars(args),
+        },
+        "single": benchmark_single(payloads[:args.repeats], args.tsfresh),
+        "batch": benchmark_batches(payloads, args.batch_sizes, args.repeats),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from sleepwellbaby.metrics import registry
+
+
+class Overloaded(Exception):
+    """Raised by `MicroBatcher.submit` if the queue is full."""
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent threads into batches, processed one batch at a time.
+
+    A dispatcher thread takes items from the queue until the batch reaches `max_batch_size`,
+    or `max_wait` seconds have passed since the first item of the batch was taken, and calls
+    `process_batch` with the items of the batch. The future returned by `submit` is resolved
+    with the result of its item.
+
+    The size of a batch is the number of items, or the sum of `item_size` of its items
+    (e.g. rows), a batch is closed as soon as it reaches `max_batch_size`. An item that does
+    not fit in the batch starts the next batch, an item larger than `max_batch_size` is
+    processed in a batch of its own.
+
+    If `process_batch` raises for a batch of multiple items, the items are processed one
+    at a time, so only the futures of the failing items get the exception.
+
+    Parameters
+    ----------
+    process_batch : callable
+        Called with a list of items, should return a list with a result per item.
+    max_batch_size : int
+        Maximum size of a batch.
+    max_wait : float
+        Maximum time in seconds to wait for more items to add to a batch.
+    max_queue_size : int, optional
+        Maximum number of items waiting in the queue, `submit` raises `Overloaded` if the
+        queue is full. Default is 0 (unbounded).
+    item_size : callable, optional
+        Size of an item, by default each item has size 1.
+    name : str, optional
+        Name of the dispatcher thread.
+    """
+
+    def __init__(
+        self,
+        process_batch: Optional[Callable[[list], list]],
+        max_batch_size: int,
+        max_wait: float,
+        max_queue_size: int = 0,
+        item_size: Optional[Callable] = None,
+        name: str = "swb-batcher",
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.item_size = item_size
+        self.name = name
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._lock = threading.Lock()
+        self._dispatcher = None
+        # Entry taken from the queue that did not fit in the previous batch
+        self._next_entry = None
+        self.reset_metrics()
+
+    def submit(self, item) -> Future:
+        """
+        Submit an item to be processed in a batch.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of the result of the item.
+
+        Raises
+        ------
+        Overloaded
+            If the queue is full.
+        """
+        if self._closed:
+            raise RuntimeError(f"{type(self).__name__} is closed")
+        self._start()
+        future = Future()
+        try:
+            self.queue.put_nowait((item, future, time.perf_counter()))
+        except queue.Full:
+            raise Overloaded(f"Queue is full ({self.queue.maxsize} items)") from None
+        return future
+
+    def _start(self):
+        """Start the dispatcher thread if it is not running, e.g. on first use or after a fork."""
+        if self._dispatcher is not None and self._dispatcher.is_alive():
+            return
+        with self._lock:
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch, name=self.name, daemon=True)
+                self._dispatcher.start()
+
+    def _entry_size(self, entry: tuple) -> Optional[int]:
+        """Size of the item of an entry, None if `item_size` raises (its future gets the exception)."""
+        if self.item_size is None:
+            return 1
+        try:
+            return self.item_size(entry[0])
+        except Exception as e:
+            if entry[1].set_running_or_notify_cancel():
+                entry[1].set_exception(e)
+            return None
+
+    def _next_batch(self) -> list:
+        """Take a batch of (item, future, submit time) from the queue, empty if closed."""
+        entry, self._next_entry = self._next_entry, None
+        if entry is None:
+            entry = self.queue.get()
+        batch, size = [], 0
+        deadline = time.perf_counter() + self.max_wait
+        while entry is not None:
+            entry_size = self._entry_size(entry)
+            if entry_size is not None:
+                if batch and size + entry_size > self.max_batch_size:
+                    self._next_entry = entry
+                    break
+                # Cancelled futures (e.g. after a timeout) are dropped
+                if entry[1].set_running_or_notify_cancel():
+                    batch.append(entry)
+                    size += entry_size
+            if size >= self.max_batch_size:
+                break
+            try:
+                entry = self.queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+        if entry is None:
+            self.queue.put(None)  # stop after this batch
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._closed:
+                    return
+                continue
+            start = time.perf_counter()
+            waits = [start - submitted for _, _, submitted in batch]
+            with self._lock:
+                self.n_batches += 1
+                self.n_items += len(batch)
+                self.max_batch_items = max(self.max_batch_items, len(batch))
+                self.total_wait += sum(waits)
+                self.max_item_wait = max(self.max_item_wait, max(waits))
+            if registry.enabled:
+                registry.observe("swb_batch_size", len(batch), batcher=self.name)
+                for wait in waits:
+                    registry.observe("swb_batch_wait_seconds", wait, batcher=self.name)
+            self.run_batch([item for item, _, _ in batch], [future for _, future, _ in batch])
+
+    def run_batch(self, items: list, futures: List[Future]):
+        """Process a batch with `process_batch` and resolve the futures of its items."""
+        try:
+            results = self.process_batch(items)
+        except Exception as e:
+            if len(items) == 1:
+                futures[0].set_exception(e)
+                return
+            # Process the items one at a time, so an invalid item does not fail the others
+            for item, future in zip(items, futures):
+                try:
+                    future.set_result(self.process_batch([item])[0])
+                except Exception as e_item:
+                    future.set_exception(e_item)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    def reset_metrics(self):
+        """Reset the counters of `metrics`."""
+        with self._lock:
+            self.n_batches = 0
+            self.n_items = 0
+            self.max_batch_items = 0
+            self.total_wait = 0.0
+            self.max_item_wait = 0.0
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        Batch size and wait time metrics since creation or `reset_metrics`.
+
+        Returns
+        -------
+        dict
+            batches: number of batches, items: number of items,
+            mean_batch_size and max_batch_size: number of items per batch,
+            mean_wait and max_wait: seconds from `submit` until processing of the batch started,
+            queue_size: number of items currently waiting.
+        """
+        with self._lock:
+            return {
+                "batches": self.n_batches,
+                "items": self.n_items,
+                "mean_batch_size": self.n_items / self.n_batches if self.n_batches else 0.0,
+                "max_batch_size": self.max_batch_items,
+                "mean_wait": self.total_wait / self.n_items if self.n_items else 0.0,
+                "max_wait": self.max_item_wait,
+                "queue_size": self.queue.qsize(),
+            }
+
+    def close(self):
+        """Process the items in the queue and stop the dispatcher."""
+        self._closed = True
+        if self._dispatcher is not None and self._dispatcher.is_alive():
+            self.queue.put(None)
+            self._dispatcher.join()
+
+
+class BatchedModel:
+    """
+    Model wrapper combining `predict_proba` calls of concurrent threads into a single call.
+
+    Each call to `predict_proba` (e.g. a row of features of a request, see
+    `model.get_prediction`) waits for the probabilities of its rows, which are predicted
+    together with the rows of other threads in batches of at most `max_batch_size` rows,
+    collected for at most `max_wait` seconds (see `MicroBatcher`). With a single thread,
+    each call waits `max_wait` seconds longer.
+
+    Parameters
+    ----------
+    model : BaseEstimator or ArrayModel
+        Model with `predict_proba` and `classes_`.
+    max_batch_size : int, optional
+        Maximum number of rows per `predict_proba` call of the model. Default is 64.
+    max_wait : float, optional
+        Maximum time in seconds to wait for more rows. Default is 0.002.
+    timeout : float, optional
+        Maximum time in seconds `predict_proba` waits for its probabilities, after which it
+        raises `concurrent.futures.TimeoutError`. Default is 30.
+    """
+
+    def __init__(self, model, max_batch_size: int = 64, max_wait: float = 0.002, timeout: float = 30):
+        self.model = model
+        self.timeout = timeout
+        self.classes_ = model.classes_
+        self.batcher = MicroBatcher(
+            self._predict_batch, max_batch_size, max_wait, item_size=len, name="swb-predict-proba"
+        )
+
+    def _predict_batch(self, inputs: list) -> List[np.ndarray]:
+        if all(isinstance(X, pd.DataFrame) for X in inputs):
+            X = pd.DataFrame(np.concatenate([X.to_numpy() for X in inputs]), columns=inputs[0].columns)
+        else:
+            X = np.concatenate([np.asarray(X) for X in inputs])
+        proba = self.model.predict_proba(X)
+        return np.split(proba, np.cumsum([len(X) for X in inputs])[:-1])
+
+    def predict_proba(self, X) -> np.ndarray:
+        """
+        Probabilities per class of the rows of `X`, predicted in a batch with rows of other threads.
+
+        Raises
+        ------
+        concurrent.futures.TimeoutError
+            If the probabilities are not predicted within `timeout` seconds.
+        """
+        if len(X) == 0:
+            return self.model.predict_proba(X)
+        future = self.batcher.submit(X)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def metrics(self) -> Dict[str, float]:
+        """Batch size (in calls) and wait time metrics, see `MicroBatcher.metrics`."""
+        return self.batcher.metrics()
+
+
+@lru_cache(maxsize=None)
+def get_batched_model(model, max_batch_size: int = 64, max_wait: float = 0.002, timeout: float = 30) -> BatchedModel:
+    """`BatchedModel` of `model`, created once per process and model."""
+    return BatchedModel(model, max_batch_size, max_wait, timeout)
+
@@ -0,0 +1,126 @@
+import hashlib
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+from sleepwellbaby.preprocess import pipeline, reference_keys
+
+_references = struct.Struct(f"<{len(reference_keys)}d")
+
+
+def payload_key(payload: dict) -> bytes:
+    """
+    Hash of the content of a payload that determines its features and prediction.
+
+    The hash covers the values and reference values of each parameter, the birth date,
+    gestation period and observation date. If the observation date is not provided,
+    the date of today is used (as in `eligibility.age_eligibility`), so the key changes daily.
+
+    Parameters
+    ----------
+    payload : dict
+        Payload as accepted by `model.get_prediction`.
+
+    Returns
+    -------
+    bytes
+        16-byte BLAKE2b digest.
+    """
+    observation_date = payload.get("observation_date")
+    if observation_date is None:
+        observation_date = pd.Timestamp.today().strftime("%Y-%m-%d")
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{payload['birth_date']}|{payload['gestation_period']}|{observation_date}".encode())
+    for k in sorted(k for k in payload if k.startswith("param_")):
+        h.update(k.encode())
+        h.update(_references.pack(*(payload[k][r] for r in reference_keys)))
+        values = payload[k]["values"]
+        # Values as little-endian float64, packing a list is faster than converting it to an array
+        if isinstance(values, np.ndarray):
+            h.update(values.astype("<f8", copy=False).tobytes())
+        else:
+            h.update(struct.pack(f"<{len(values)}d", *values))
+    return h.digest()
+
+
+class PayloadCache:
+    """
+    Thread-safe LRU cache with time-to-live, e.g. of features or predictions keyed by `payload_key`.
+
+    Entries are evicted when they are older than `ttl` seconds, or when the cache holds
+    `maxsize` entries and a new entry is added (least recently used first).
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of entries. Default is 4096.
+    ttl : float, optional
+        Time to live of an entry in seconds, None to keep entries until evicted by size.
+        Default is 60.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: Optional[float] = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None) -> Any:
+        """Value of `key`, or `default` if not in the cache or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or now - entry[0] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value):
+        """Add or replace the value of `key`, evicting the least recently used entry if full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def metrics(self) -> Dict[str, float]:
+        """Hits, misses, hit rate and number of entries."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
+
+
+def cached_pipeline(payload: dict, model_support_dict: dict, cache: PayloadCache) -> pd.DataFrame:
+    """`preprocess.pipeline` with the features cached by `payload_key` (a copy is returned)."""
+    key = payload_key(payload)
+    df = cache.get(key)
+    if df is None:
+        df = pipeline(payload, model_support_dict)
+        cache.put(key, df)
+    return df.copy()
@@ -1,26 +1,207 @@
-import datetime
-import json
+import atexit
+import hmac
+import os
+import time
+from concurrent.futures import TimeoutError
 
-from flask import Flask, request
-from flask_restx import Api, Resource
-from flask_restx.fields import Nested
-from jsonschema import FormatChecker
-from werkzeug.exceptions import MethodNotAllowed
+from flask import Flask, Response, g, request
+from flask_restx import Api, Resource, abort, representations
+from flask_restx.fields import List, Nested
+from jsonschema import Draft4Validator, FormatChecker, RefResolver
+from werkzeug.exceptions import (
+    BadRequest,
+    MethodNotAllowed,
+    NotFound,
+    ServiceUnavailable,
+    Unauthorized,
+)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 from sleepwellbaby import version
+from sleepwellbaby.batching import Overloaded, get_batched_model
+from sleepwellbaby.cache import PayloadCache, payload_key
+from sleepwellbaby.dashboard.binary_payload import (
+    add_values,
+    binary_mimetype,
+    decode_payload,
+)
 from sleepwellbaby.dashboard.data_structures import (
+    args_batch_item,
     args_patient_characteristics,
+    args_session_references,
+    args_session_sample,
     args_vitals,
     response_pred,
+    response_pred_batch_item,
 )
-from sleepwellbaby.model import get_prediction, load_model
+from sleepwellbaby.dashboard.serving import get_pool
+from sleepwellbaby.dashboard.validation import (
+    PayloadValidator,
+    is_date,
+    non_finite_sample_errors,
+)
+from sleepwellbaby.eligibility import age_eligibility
+from sleepwellbaby.metrics import registry
+from sleepwellbaby.model import (
+    get_inference_model,
+    get_model,
+    get_prediction,
+    get_predictions,
+)
+from sleepwellbaby.profiling import RequestProfiler
+from sleepwellbaby.session import SessionStore
+
+# Set SWB_INFERENCE=arrays to predict with `model_arrays.ArrayModel` instead of sklearn
+inference = os.environ.get("SWB_INFERENCE", "sklearn")
+# Set SWB_PREDICT_BATCH_SIZE to combine `predict_proba` calls of concurrent requests, see `batching.BatchedModel`
+predict_batch_size = int(os.environ.get("SWB_PREDICT_BATCH_SIZE", 0))
+predict_batch_wait = float(os.environ.get("SWB_PREDICT_BATCH_WAIT_MS", 2)) / 1e3
+# Maximum time in seconds a request waits for its prediction in the pool (see `serving.get_pool`)
+# or `batching.BatchedModel`, after which it gets a 503
+pool_timeout = float(os.environ.get("SWB_POOL_TIMEOUT", 30))
+
+
+def get_serving_model():
+    """Model and model meta information used by the endpoints, see `model.get_inference_model`."""
+    model, model_support_dict = get_model()
+    model = get_inference_model(model, inference)
+    if predict_batch_size > 0:
+        model = get_batched_model(model, predict_batch_size, predict_batch_wait, pool_timeout)
+        registry.collect("swb_predict_proba_batcher", model.metrics, counters=["batches", "items"])
+    return model, model_support_dict
+
+
+def preload():
+    """Load the model and heavy imports, e.g. in a server hook before forking workers."""
+    get_serving_model()
+
+
+# Set SWB_CACHE_SIZE to cache predictions of /predict by payload content, e.g. of retried requests
+cache_size = int(os.environ.get("SWB_CACHE_SIZE", 0))
+prediction_cache = PayloadCache(cache_size, float(os.environ.get("SWB_CACHE_TTL", 60))) if cache_size > 0 else None
+if prediction_cache is not None:
+    registry.collect("swb_prediction_cache", prediction_cache.metrics, counters=["hits", "misses"])
 
-model, model_support_dict = load_model()
+# Set SWB_PROFILE_RATE to profile a fraction of /predict and /predict_batch requests, SWB_PROFILE_DIR
+# to write the profiles there on exit, and SWB_ADMIN_TOKEN to enable /admin/profile with this token
+profile_rate = float(os.environ.get("SWB_PROFILE_RATE", 0))
+profile_dir = os.environ.get("SWB_PROFILE_DIR")
+admin_token = os.environ.get("SWB_ADMIN_TOKEN")
+profiler = RequestProfiler(profile_rate) if profile_rate > 0 else None
+if profiler is not None and profile_dir:
+    atexit.register(profiler.dump, profile_dir)
+
+
+def predict_payload(data: dict):
+    """
+    Prediction of a validated payload, see `model.get_prediction`.
+
+    Taken from `prediction_cache` if enabled and the same payload was predicted before.
+    Otherwise predicted in the prediction pool if configured (see `serving.get_pool`),
+    or in the current thread. Responds with 503 if the pool is overloaded.
+    """
+    key = None
+    if prediction_cache is not None:
+        key = payload_key(data)
+        cached = prediction_cache.get(key)
+        if cached is not None:
+            return cached[0], dict(cached[1])
+    prediction, pred_proba = _predict_payload(data)
+    if key is not None:
+        prediction_cache.put(key, (prediction, dict(pred_proba)))
+    return prediction, pred_proba
+
+
+def _predict_payload(data: dict):
+    pool = get_pool(inference)
+    try:
+        if pool is None:
+            model, model_support_dict = get_serving_model()
+            return get_prediction(data, model, model_support_dict)
+        # Fail early on invalid dates, other errors of a payload are returned by its worker (see `serving.predict_payloads`)
+        age_eligibility(data)
+        return pool.predict(data, timeout=pool_timeout)
+    except ValueError as e:
+        raise BadRequest(str(e)) from e
+    except (Overloaded, TimeoutError) as e:
+        raise ServiceUnavailable(str(e) or "Prediction timed out", retry_after=1) from e
+
+
+# Set SWB_LOAD_MODEL=lazy to load the model on the first request instead of on import
+if os.environ.get("SWB_LOAD_MODEL", "import") != "lazy":
+    preload()
 
 
 app = Flask(__name__)
 
 
+@app.before_request
+def start_request():
+    if registry.enabled:
+        g.start = time.perf_counter()
+    if profiler is not None:
+        g.profile = profiler.start(request.endpoint)
+
+
+@app.teardown_request
+def stop_profile(exception=None):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profiler.stop(request.endpoint, profile)
+
+
+@app.after_request
+def record_request(response):
+    """Count requests and their duration per endpoint in `metrics.registry`, if enabled."""
+    if registry.enabled and "start" in g:
+        endpoint = request.endpoint or "unknown"
+        registry.count("swb_requests_total", endpoint=endpoint, status=response.status_code)
+        registry.observe("swb_request_seconds", time.perf_counter() - g.start, endpoint=endpoint)
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    """Counters and histograms of `metrics.registry` in the Prometheus text format."""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/admin/profile", methods=["GET", "POST", "DELETE"])
+def admin_profile():
+    """
+    Profiles of sampled requests, if SWB_PROFILE_RATE is set (see `profiling.RequestProfiler`).
+
+    Only available if SWB_ADMIN_TOKEN is set, requests should have the header
+    `Authorization: Bearer <SWB_ADMIN_TOKEN>`. GET returns a text report, or with
+    `?endpoint=<name>` the profile of an endpoint in the pstats format. POST writes the
+    profiles to SWB_PROFILE_DIR, DELETE removes them.
+    """
+    if not admin_token:
+        raise NotFound()
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {admin_token}".encode()):
+        raise Unauthorized("Invalid or missing admin token")
+    if profiler is None:
+        raise NotFound("Profiling is not enabled, set SWB_PROFILE_RATE")
+    if request.method == "DELETE":
+        profiler.reset()
+        return "", 204
+    if request.method == "POST":
+        if not profile_dir:
+            raise BadRequest("SWB_PROFILE_DIR is not set")
+        return {"files": profiler.dump(profile_dir)}
+    endpoint = request.args.get("endpoint")
+    if endpoint is None:
+        return Response(profiler.report(), mimetype="text/plain")
+    profile = profiler.dumps(endpoint)
+    if profile is None:
+        raise NotFound(f"No profiled requests of endpoint {endpoint}")
+    return Response(profile, mimetype="application/octet-stream")
+
+
 format_checker = FormatChecker()
 
 @format_checker.checks("date", ValueError)  # noqa: E302
@@ -29,8 +210,10 @@ def lenient_date_check(value):
 
     Allow dates not to strictly adhere to ISO8601
     https://github.com/noirbizarre/flask-restplus/issues/603#issuecomment-472367498
+    Other types than strings (e.g. null) are checked by type, not by format.
     """
-    datetime.datetime.strptime(value, "%Y-%m-%d")
+    if isinstance(value, str) and not is_date(value):
+        raise ValueError(f"{value} is not a date in format YYYY-MM-DD")
     return True
 
 api = Api(
@@ -52,23 +235,77 @@ args = {
 }
 model_in_pred = api.model("payload_predict", args)
 model_out_pred = api.model("response_predict", response_pred)
+# Header of binary payloads, i.e. payload_predict without values (see `binary_payload.decode_payload`)
+models_in_pred_binary_ref = {
+    k: api.model(f"payload_predict_binary_{k}", v) for k, v in args_session_references.items()
+}
+model_in_pred_binary_header = api.model(
+    "payload_predict_binary_header",
+    {
+        **args_patient_characteristics,
+        **{k: Nested(v, required=True) for k, v in models_in_pred_binary_ref.items()},
+    },
+)
+
+# Batch predict endpoint
+model_in_pred_batch_item = api.inherit("payload_predict_batch_item", model_in_pred, args_batch_item)
+model_out_pred_batch_item = api.model("response_predict_batch_item", response_pred_batch_item)
+model_out_pred_batch = api.model(
+    "response_predict_batch",
+    {
+        "predictions": List(Nested(model_out_pred_batch_item)),
+        "api_version": response_pred["api_version"],
+    },
+)
+
+# Validators are created once, with references resolved from the models defined above
+# (`api.refresolver` only knows the models used in the Swagger definitions)
+models_resolver = RefResolver.from_schema(
+    {"definitions": {name: model.__schema__ for name, model in api.models.items()}}
+)
+payload_validator = PayloadValidator(model_in_pred, models_resolver, format_checker)
+batch_item_validator = PayloadValidator(model_in_pred_batch_item, models_resolver, format_checker)
+binary_header_validator = Draft4Validator(
+    model_in_pred_binary_header.__schema__, resolver=models_resolver, format_checker=format_checker
+)
+
+
+def get_payload() -> dict:
+    """Validated payload of a /predict request, sent as JSON or as binary payload."""
+    if request.mimetype == binary_mimetype:
+        try:
+            header, values = decode_payload(request.get_data())
+        except ValueError as e:
+            raise BadRequest(str(e)) from e
+        errors = dict(model_in_pred_binary_header.format_error(e) for e in binary_header_validator.iter_errors(header))
+        if errors:
+            abort(400, message="Input payload validation failed", errors=errors)
+        return add_values(header, values)
+    data = request.get_json()
+    errors = payload_validator.errors(data)
+    if errors:
+        abort(400, message="Input payload validation failed", errors=errors)
+    return data
 
 
 @api.route(
     "/predict",
     doc={
         "description": "Will return a prediction from "
-        "the SleepWellBaby algorithm if baby is eligible"
+        "the SleepWellBaby algorithm if baby is eligible. The payload can also be sent "
+        f"with content type {binary_mimetype}, with the values as packed float32 or "
+        "float64 arrays (see sleepwellbaby.dashboard.binary_payload)"
     },
 )
 class DoPrediction(Resource):
-    @api.expect(model_in_pred, validate=True)
+    # Payload is validated in `get_payload`, as it is either JSON or binary
+    @api.expect(model_in_pred, validate=False)
     @api.marshal_with(model_out_pred, description="Data received successfully")
-    @api.doc(responses={400: "Input data not as expected"})
+    @api.doc(responses={400: "Input data not as expected", 503: "Prediction queue is full, retry later"})
     def post(self):
         """Request a prediction for query data"""
-        data = request.get_json()
-        prediction, pred_proba = get_prediction(data, model, model_support_dict)
+        data = get_payload()
+        prediction, pred_proba = predict_payload(data)
         result = {
             "prediction": prediction,
             "AS": pred_proba["AS"],
@@ -79,21 +316,146 @@ class DoPrediction(Resource):
         return result, 200
 
 
-@app.after_request
-def inject_api_version(response):
-    """Ensure api_version is appended to HTTP codes 400 and 500 of API endpoints"""
-    api_endpoints = [i for i in api.endpoints if i != "specs"]
-    api_urls = [
-        rule.rule for rule in app.url_map.iter_rules() if rule.endpoint in api_endpoints
-    ]
-    if request.path in api_urls:
-        data = response.get_json()
-        if "api_version" not in data:
-            data["api_version"] = version
-            response.set_data(json.dumps(data))
+# Session endpoint
+models_in_session_ref = {
+    k: api.model(f"session_references_{k}", v) for k, v in args_session_references.items()
+}
+model_in_session = api.model(
+    "payload_session",
+    {
+        **{k: args_patient_characteristics[k] for k in ["birth_date", "gestation_period"]},
+        **args_session_sample,
+        "references": Nested(
+            api.model(
+                "session_references",
+                {k: Nested(v, required=True) for k, v in models_in_session_ref.items()},
+            ),
+            required=False,
+            description="Reference values, computed from the samples of the session if not provided",
+        ),
+    },
+)
+
+# Streaming sessions per patient, kept in memory of the worker process until idle for SWB_SESSION_TTL seconds
+sessions = SessionStore(int(os.environ.get("SWB_MAX_SESSIONS", 1024)), float(os.environ.get("SWB_SESSION_TTL", 3600)))
+
+
+def validate_batch_item(item, validator: PayloadValidator) -> dict:
+    """Validate an item of a batch request, returns validation errors (empty if valid)"""
+    if not isinstance(item, dict):
+        return {"": "Item should be an object"}
+    errors = validator.errors(item)
+    if not errors:
+        try:
+            age_eligibility(item)
+        except ValueError as e:
+            errors["observation_date"] = str(e)
+    return errors
+
+
+@api.route(
+    "/predict_batch",
+    doc={
+        "description": "Will return a prediction from the SleepWellBaby algorithm "
+        "for each item in the list, if baby is eligible. Items are validated "
+        "separately, invalid items are reported with their errors"
+    },
+)
+class DoPredictionBatch(Resource):
+    @api.expect([model_in_pred_batch_item], validate=False)
+    @api.marshal_with(model_out_pred_batch, description="Data received successfully")
+    @api.doc(responses={400: "Input data not a list"})
+    def post(self):
+        """Request predictions for a list of query data"""
+        data = request.get_json()
+        if not isinstance(data, list):
+            raise BadRequest("Input payload should be a list of items")
+
+        errors = [validate_batch_item(item, batch_item_validator) for item in data]
+        valid = [i for i, e in enumerate(errors) if not e]
+        model, model_support_dict = get_serving_model()
+        predictions = get_predictions([data[i] for i in valid], model, model_support_dict)
+
+        results = [
+            {"id": item.get("id") if isinstance(item, dict) else None, "errors": e or None}
+            for item, e in zip(data, errors)
+        ]
+        for i, (prediction, pred_proba) in zip(valid, predictions):
+            results[i].update({"prediction": prediction, **pred_proba})
+
+        return {"predictions": results}, 200
+
+
+@api.route(
+    "/session/<string:patient_id>",
+    doc={
+        "description": "Will add the newest sample of each parameter to the session "
+        "of a patient, and return a prediction from the SleepWellBaby algorithm "
+        "if baby is eligible. Sessions are kept in memory of the worker process"
+    },
+)
+class DoSessionPrediction(Resource):
+    @api.expect(model_in_session, validate=True)
+    @api.marshal_with(model_out_pred, description="Data received successfully")
+    @api.doc(responses={400: "Input data not as expected"})
+    def post(self, patient_id):
+        """Add a sample to the session of a patient and request a prediction"""
+        data = request.get_json()
+        errors = non_finite_sample_errors(data)
+        if errors:
+            abort(400, message="Input payload validation failed", errors=errors)
+        model, model_support_dict = get_serving_model()
+        session = sessions.get(patient_id, data["birth_date"], data["gestation_period"], model, model_support_dict)
+        with session.lock:
+            try:
+                prediction, pred_proba = session.append_and_predict(
+                    data["timestamp"], data, data.get("references")
+                )
+            except ValueError as e:
+                raise BadRequest(str(e)) from e
+        result = {
+            "prediction": prediction,
+            "AS": pred_proba["AS"],
+            "QS": pred_proba["QS"],
+            "W": pred_proba["W"],
+        }
+        return result, 200
+
+    @api.doc(responses={204: "Session ended"})
+    def delete(self, patient_id):
+        """End the session of a patient"""
+        sessions.pop(patient_id)
+        return "", 204
+
+
+# Endpoints of which all JSON responses (including errors) contain api_version
+versioned_endpoints = frozenset(i for i in api.endpoints if i != "specs")
+
+
+@api.representation("application/json")
+def output_json(data, code, headers=None):
+    """
+    JSON response of the API endpoints, serialized with orjson if installed.
+
+    Successful responses contain api_version through the default of the marshalled
+    field, it is added here to other responses (e.g. HTTP codes 400 and 500).
+    """
+    if isinstance(data, dict) and "api_version" not in data and request.endpoint in versioned_endpoints:
+        data = {**data, "api_version": version}
+    if orjson is None or app.debug:
+        return representations.output_json(data, code, headers)
+    body = orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY)
+    response = app.make_response((body, code))
+    response.headers.extend(headers or {})
     return response
 
 
+@api.errorhandler(TimeoutError)
+def prediction_timeout(error):
+    """Respond with 503 if a prediction times out, e.g. in `batching.BatchedModel` of /predict_batch"""
+    return {"message": "Prediction timed out"}, 503, {"Retry-After": "1"}
+
+
 @api.errorhandler(MethodNotAllowed)
 def method_not_allowed(error):
     """Improve informativeness of MethodNotAllowed message response"""
@@ -101,6 +463,7 @@ def method_not_allowed(error):
         "message": error.description,
         "valid_methods": error.valid_methods,
         "requested_method": request.method,
+        "api_version": version,  # not routed to an endpoint, see `output_json`
     }, 405
 
 
@@ -0,0 +1,108 @@
+import json
+import struct
+from typing import Tuple
+
+import numpy as np
+
+binary_mimetype = "application/octet-stream"
+magic = b"SWB1"
+value_parameters = ["param_HR", "param_RR", "param_OS"]  # order of the value arrays
+n_values = 192
+value_dtypes = ["<f4", "<f8"]  # little-endian float32 or float64
+_prefix = struct.Struct("<4sI")  # magic and length of the header in bytes
+
+
+def encode_payload(payload: dict, dtype: str = "<f8") -> bytes:
+    """
+    Encode a `payload_predict` payload in the binary format of `decode_payload`.
+
+    Parameters
+    ----------
+    payload : dict
+        Payload as accepted by `/predict`.
+    dtype : str, optional
+        Type of the values, '<f4' (float32) or '<f8' (float64, default).
+
+    Returns
+    -------
+    bytes
+        Binary payload, to be sent with content type `binary_mimetype`.
+    """
+    if dtype not in value_dtypes:
+        raise ValueError(f"dtype must be one of {value_dtypes}, got {dtype}")
+    header = {k: v for k, v in payload.items() if k not in value_parameters}
+    header.update({k: {i: r for i, r in payload[k].items() if i != "values"} for k in value_parameters})
+    header["dtype"] = dtype
+    header = json.dumps(header).encode()
+    # Pad the header with whitespace, so the values are aligned to 8 bytes
+    header += b" " * (-(_prefix.size + len(header)) % 8)
+    values = np.array([payload[k]["values"] for k in value_parameters], dtype=dtype)
+    return _prefix.pack(magic, len(header)) + header + values.tobytes()
+
+
+def decode_payload(body: bytes) -> Tuple[dict, np.ndarray]:
+    """
+    Decode a binary payload to the header and values of a `payload_predict` payload.
+
+    The binary payload consists of:
+
+    - 4 bytes `magic` (b'SWB1')
+    - the length of the header in bytes, as little-endian uint32
+    - the header, a UTF-8 JSON object with the patient characteristics and reference
+      values as in `payload_predict` (without values), and 'dtype' of the values
+      ('<f4' or '<f8')
+    - 3 x 192 values of HR, RR and OS (in order of `value_parameters`), newest value last
+
+    The values are not copied, they are read-only views of `body` (see `np.frombuffer`).
+    The payload is obtained with `add_values(header, values)`, after validation of the header.
+
+    Parameters
+    ----------
+    body : bytes
+        Binary payload.
+
+    Returns
+    -------
+    tuple
+        header : dict
+            Payload without values (and without 'dtype').
+        values : np.ndarray
+            Values of shape (3, 192), in order of `value_parameters`.
+
+    Raises
+    ------
+    ValueError
+        If the binary payload is not as expected, or values are not finite or smaller than -1.
+    """
+    if len(body) < _prefix.size:
+        raise ValueError("Binary payload too short")
+    prefix, header_length = _prefix.unpack_from(body)
+    if prefix != magic:
+        raise ValueError(f"Binary payload should start with {magic!r}")
+    offset = _prefix.size + header_length
+    try:
+        header = json.loads(body[_prefix.size:offset])
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Header of binary payload is not valid JSON: {e}") from e
+    if not isinstance(header, dict):
+        raise ValueError("Header of binary payload should be a JSON object")
+    dtype = header.pop("dtype", None)
+    if dtype not in value_dtypes:
+        raise ValueError(f"dtype in header of binary payload must be one of {value_dtypes}, got {dtype}")
+
+    n_expected = len(value_parameters) * n_values
+    n_received = (len(body) - offset) / np.dtype(dtype).itemsize
+    if n_received != n_expected:
+        raise ValueError(f"Binary payload should contain {n_expected} values, got {n_received:g}")
+    values = np.frombuffer(body, dtype=dtype, offset=offset).reshape(len(value_parameters), n_values)
+    for k, v in zip(value_parameters, values):
+        if not np.isfinite(v).all():
+            raise ValueError(f"Values of {k} should be finite, missing values are coded as -1")
+        if (v < -1).any():
+            raise ValueError(f"Values of {k} should not be smaller than -1")
+    return header, values
+
+
+def add_values(header: dict, values: np.ndarray) -> dict:
+    """Payload from the header and values returned by `decode_payload`."""
+    return {**header, **{k: {**header[k], "values": v} for k, v in zip(value_parameters, values)}}
@@ -1,6 +1,6 @@
 from itertools import product
 
-from flask_restx.fields import Date, Float, Integer, List, String
+from flask_restx.fields import Date, DateTime, Float, Integer, List, Raw, String
 
 from sleepwellbaby import version
 from sleepwellbaby.data import get_example_payload
@@ -27,6 +27,15 @@ def make_required_and_add_example(d, exmpl_data):
     return d
 
 
+class NullableDate(Date):
+    """Date field that also accepts null, flask_restx does not render `nullable` in the schema"""
+
+    def schema(self):
+        schema = super().schema()
+        schema["type"] = ["string", "null"]
+        return schema
+
+
 possible_pred_values = ["active_sleep", "quiet_sleep", "wake", "ineligible"]
 
 coverage_req = {"description": "Should be based on max 50% missing values"}
@@ -49,7 +58,7 @@ args_vitals = make_required_and_add_example(args_vitals, example_payload)
 args_patient_characteristics = {
     "birth_date": Date(),
     "gestation_period": Integer(),
-    "observation_date": Date(nullable=True),
+    "observation_date": NullableDate(),
 }
 args_patient_characteristics = make_required_and_add_example(args_patient_characteristics, example_payload)
 
@@ -60,3 +69,42 @@ response_pred = {
     "W": Float(min=-1, max=1),
     "api_version": String(default=version),
 }
+
+args_batch_item = {
+    "id": String(
+        required=True,
+        description="Identifier of the item, returned with its prediction",
+        example="bed_1",
+    ),
+}
+
+response_pred_batch_item = {
+    "id": String,
+    "prediction": String(enum=possible_pred_values),
+    "AS": Float(min=-1, max=1),
+    "QS": Float(min=-1, max=1),
+    "W": Float(min=-1, max=1),
+    "errors": Raw(description="Validation errors of the item, prediction is omitted if present"),
+}
+
+args_session_sample = {
+    "timestamp": DateTime(
+        required=True,
+        description="Time of the sample, the date is used as observation date",
+        example="2025-01-01T12:00:00",
+    ),
+    **{
+        k: Float(
+            min=-1,
+            required=True,
+            description="Newest value of the parameter, missing coded as -1",
+            example=example_payload[k]["values"][-1],
+        )
+        for k in ["param_HR", "param_RR", "param_OS"]
+    },
+}
+
+args_session_references = {
+    k: {i: Float(**coverage_req) for i in v if i != "values"} for k, v in args_vitals.items()
+}
+args_session_references = make_required_and_add_example(args_session_references, example_payload)
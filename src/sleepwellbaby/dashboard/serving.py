@@ -0,0 +1,211 @@
+"""Concurrent serving of the SWB API.
+
+Predictions of concurrent `/predict` requests are coalesced into micro-batches, which
+are predicted with `model.get_predictions` in a bounded pool of worker processes, so
+request threads only wait for their result and the feature extraction of many
+requests runs in parallel.
+
+Usage:
+    python -m sleepwellbaby.dashboard.serving [--workers 4] [--port 5000]
+
+or with the pool configured by environment variables (see `get_pool`), e.g.:
+    SWB_POOL_WORKERS=4 gunicorn --workers 1 --threads 64 sleepwellbaby.dashboard.app:app
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from functools import partial
+from typing import Dict, List, Optional, Tuple, Union
+
+from sleepwellbaby.batching import MicroBatcher
+from sleepwellbaby.metrics import registry
+from sleepwellbaby.model import get_inference_model, get_model, get_predictions
+
+default_batch_size = 32
+default_batch_wait = 0.005  # seconds
+default_queue_size = 256
+
+
+def init_worker(inference: str):
+    """Load the model once per worker process of `PredictionPool`."""
+    model, _ = get_model()
+    get_inference_model(model, inference)
+
+
+def predict_payloads(payloads: List[dict], inference: str) -> List[Union[Tuple[str, Dict[str, float]], Exception]]:
+    """
+    Predict a micro-batch of payloads in a worker process, see `model.get_predictions`.
+
+    If the batch fails, the payloads are predicted one at a time, and the exception of a
+    failing payload is returned instead of its prediction, so it does not fail the others.
+    """
+    try:
+        return get_predictions(payloads, inference=inference)
+    except Exception:
+        if len(payloads) == 1:
+            raise
+    results = []
+    for payload in payloads:
+        try:
+            results.append(get_predictions([payload], inference=inference)[0])
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+class PredictionPool(MicroBatcher):
+    """
+    Pool of worker processes predicting micro-batches of payloads.
+
+    Payloads submitted with `submit` are put in a bounded queue, and collected into
+    batches by a `batching.MicroBatcher` (of at most `max_batch_size` payloads, waiting
+    at most `max_wait` seconds). Each batch is submitted to a worker process. At most
+    two batches per worker are in progress, so payloads wait in the queue while all
+    workers are busy (and form larger batches). If the queue is full, `submit` raises
+    `batching.Overloaded` instead of accepting more work than the pool can handle.
+
+    Workers are separate processes (started with 'spawn', as the pool is used from a
+    multithreaded server), each loading the model once with `model.get_model`.
+
+    Parameters
+    ----------
+    n_workers : int, optional
+        Number of worker processes, defaults to the number of CPUs.
+    max_batch_size : int, optional
+        Maximum number of payloads per batch. Default is 32.
+    max_wait : float, optional
+        Maximum time in seconds to wait for more payloads to add to a batch. Default is 0.005.
+    max_queue_size : int, optional
+        Maximum number of payloads waiting to be batched. Default is 256.
+    inference : str, optional
+        Inference engine of the workers, see `model.get_inference_model` (default is "sklearn").
+    """
+
+    def __init__(
+        self,
+        n_workers: Optional[int] = None,
+        max_batch_size: int = default_batch_size,
+        max_wait: float = default_batch_wait,
+        max_queue_size: int = default_queue_size,
+        inference: str = "sklearn",
+    ):
+        super().__init__(None, max_batch_size, max_wait, max_queue_size, name="swb-dispatcher")
+        self.n_workers = n_workers or os.cpu_count()
+        self.inference = inference
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(inference,),
+        )
+        self._slots = threading.BoundedSemaphore(2 * self.n_workers)
+
+    def predict(self, payload: dict, timeout: Optional[float] = None) -> Tuple[str, Dict[str, float]]:
+        """
+        Submit a validated payload (as accepted by `model.get_prediction`) and wait for its prediction.
+
+        Raises
+        ------
+        batching.Overloaded
+            If the queue is full.
+        concurrent.futures.TimeoutError
+            If the prediction takes more than `timeout` seconds.
+        """
+        future = self.submit(payload)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()  # not predicted if still in the queue
+            raise
+
+    def run_batch(self, payloads: List[dict], futures: List[Future]):
+        """Submit a batch to a worker process, futures are resolved when it is done."""
+        self._slots.acquire()
+        try:
+            result = self.executor.submit(predict_payloads, payloads, self.inference)
+        except Exception as e:  # e.g. a broken pool
+            self._slots.release()
+            for future in futures:
+                future.set_exception(e)
+            return
+        result.add_done_callback(partial(self._resolve, futures))
+
+    def _resolve(self, futures: List[Future], result: Future):
+        self._slots.release()
+        if result.exception() is not None:
+            for future in futures:
+                future.set_exception(result.exception())
+            return
+        for future, prediction in zip(futures, result.result()):
+            if isinstance(prediction, Exception):
+                future.set_exception(prediction)
+            else:
+                future.set_result(prediction)
+
+    def close(self):
+        """Predict the payloads in the queue and stop the dispatcher and workers."""
+        super().close()
+        self.executor.shutdown(wait=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(inference: str = "sklearn") -> Optional[PredictionPool]:
+    """
+    Prediction pool of the current process, created on the first call.
+
+    The pool is configured by environment variables: `SWB_POOL_WORKERS` (number of
+    worker processes, no pool is used if not set or 0), `SWB_BATCH_SIZE`,
+    `SWB_BATCH_WAIT_MS` and `SWB_QUEUE_SIZE` (see `PredictionPool`).
+
+    Returns
+    -------
+    PredictionPool or None
+        None if `SWB_POOL_WORKERS` is not set or 0.
+    """
+    global _pool
+    n_workers = int(os.environ.get("SWB_POOL_WORKERS", 0))
+    if _pool is None and n_workers > 0:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PredictionPool(
+                    n_workers,
+                    max_batch_size=int(os.environ.get("SWB_BATCH_SIZE", default_batch_size)),
+                    max_wait=float(os.environ.get("SWB_BATCH_WAIT_MS", default_batch_wait * 1e3)) / 1e3,
+                    max_queue_size=int(os.environ.get("SWB_QUEUE_SIZE", default_queue_size)),
+                    inference=inference,
+                )
+                # Stages are timed in the worker processes, only the batching is in this registry
+                registry.collect("swb_pool", _pool.metrics, counters=["batches", "items"])
+    return _pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--batch-size", type=int, default=default_batch_size)
+    parser.add_argument("--batch-wait-ms", type=float, default=default_batch_wait * 1e3)
+    parser.add_argument("--queue-size", type=int, default=default_queue_size)
+    args = parser.parse_args()
+
+    os.environ.update({
+        "SWB_POOL_WORKERS": str(args.workers),
+        "SWB_BATCH_SIZE": str(args.batch_size),
+        "SWB_BATCH_WAIT_MS": str(args.batch_wait_ms),
+        "SWB_QUEUE_SIZE": str(args.queue_size),
+        "SWB_LOAD_MODEL": "lazy",  # the model is loaded by the workers
+    })
+    from sleepwellbaby.dashboard.app import app, inference
+
+    get_pool(inference)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import datetime
+import math
+from functools import lru_cache
+from typing import Dict
+
+import numpy as np
+from flask_restx import Model
+from flask_restx.fields import String
+from jsonschema import Draft4Validator
+
+from sleepwellbaby.dashboard.data_structures import (
+    args_patient_characteristics,
+    args_vitals,
+    v_values,
+)
+
+date_cache_size = 1024
+
+
+@lru_cache(maxsize=date_cache_size)
+def is_date(value: str) -> bool:
+    """Check if a string is a date in format 'YYYY-MM-DD' (cached, payloads mostly contain the same dates)."""
+    try:
+        datetime.datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        return False
+    return True
+
+
+def _is_number(value) -> bool:
+    return type(value) in (int, float)
+
+
+def is_valid_payload(data) -> bool:
+    """
+    Fast check if `data` is a valid `payload_predict` payload.
+
+    Checks the same as the JSON schema of `payload_predict`, with values checked as NumPy
+    arrays. May return False for payloads that are valid according to the schema (e.g.
+    numbers of other types than int and float), so `PayloadValidator` falls back to
+    jsonschema if False.
+    """
+    if type(data) is not dict or not all(k in data for k in args_patient_characteristics):
+        return False
+    birth_date, gestation_period, observation_date = (
+        data["birth_date"], data["gestation_period"], data["observation_date"]
+    )
+    if type(birth_date) is not str or not is_date(birth_date):
+        return False
+    if observation_date is not None and (type(observation_date) is not str or not is_date(observation_date)):
+        return False
+    if type(gestation_period) is not int:
+        return False
+
+    return all(_is_valid_vitals(data.get(k), fields) for k, fields in args_vitals.items())
+
+
+def _is_valid_vitals(vitals, fields) -> bool:
+    """Fast check of the vitals of a single parameter (e.g. `payload['param_HR']`)."""
+    if type(vitals) is not dict or not all(i in vitals for i in fields):
+        return False
+    if not all(_is_number(vitals[i]) for i in fields if i != "values"):
+        return False
+    values = vitals["values"]
+    if type(values) is not list or not v_values["min_items"] <= len(values) <= v_values["max_items"]:
+        return False
+    if not set(map(type, values)) <= {int, float}:
+        return False
+    try:
+        values = np.array(values, dtype=float)
+    except OverflowError:
+        return False
+    return np.isfinite(values).all() and not (values < v_values["cls_or_instance"].minimum).any()
+
+
+def non_finite_errors(data) -> Dict[str, str]:
+    """
+    Errors of parameter values that are NaN or infinite, which the JSON schema accepts.
+
+    JSON parsers (e.g. of Python) accept NaN and Infinity, but the model cannot predict on them.
+    """
+    errors = {}
+    if type(data) is not dict:
+        return errors
+    for k in args_vitals:
+        values = data[k].get("values") if type(data.get(k)) is dict else None
+        if type(values) is list and not all(map(_is_finite, values)):
+            errors[f"{k}.values"] = "Values should be finite, missing values are coded as -1"
+    return errors
+
+
+def non_finite_sample_errors(data: dict) -> Dict[str, str]:
+    """Errors of the values of a `payload_session` sample that are NaN or infinite, see `non_finite_errors`."""
+    return {
+        k: "Value should be finite, missing values are coded as -1"
+        for k in args_vitals
+        if not _is_finite(data.get(k))
+    }
+
+
+def _is_finite(value) -> bool:
+    return type(value) is not float or math.isfinite(value)
+
+
+class PayloadValidator:
+    """
+    Validator of `payload_predict` payloads (or models inheriting from it).
+
+    Payloads are checked with `is_valid_payload` first, only if that fails they are
+    validated with jsonschema, so errors are the same as with flask_restx validation,
+    and checked for values that are not finite (see `non_finite_errors`).
+    The jsonschema validator is created once, instead of on every request.
+
+    Parameters
+    ----------
+    model : flask_restx.Model
+        Model of the payload, `payload_predict` or a model inheriting from it.
+    resolver : jsonschema.RefResolver
+        Resolver of the references to other models in the schema of `model`.
+    format_checker : jsonschema.FormatChecker
+        Format checker, e.g. for dates.
+    """
+
+    def __init__(self, model: Model, resolver, format_checker):
+        self.model = model
+        self.validator = Draft4Validator(model.__schema__, resolver=resolver, format_checker=format_checker)
+        # Fields added by inheriting models (e.g. 'id'), only string fields are checked fast
+        extra_fields = {
+            name: field for name, field in model.items()
+            if name not in args_patient_characteristics and name not in args_vitals
+        }
+        self.fast = all(type(field) is String for field in extra_fields.values())
+        self.string_fields = extra_fields
+
+    def _is_valid(self, data) -> bool:
+        return self.fast and is_valid_payload(data) and all(
+            (name in data or not field.required) and type(data.get(name, "")) is str
+            for name, field in self.string_fields.items()
+        )
+
+    def errors(self, data) -> Dict[str, str]:
+        """Validation errors keyed by path (e.g. 'param_HR.values'), as reported by flask_restx."""
+        if self._is_valid(data):
+            return {}
+        errors = dict(self.model.format_error(e) for e in self.validator.iter_errors(data))
+        for path, message in non_finite_errors(data).items():
+            errors.setdefault(path, message)
+        return errors
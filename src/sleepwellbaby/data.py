@@ -6,6 +6,8 @@ import importlib_resources
 import numpy as np
 import pandas as pd
 
+from sleepwellbaby.reference import ReferenceValues
+
 
 def replace_today_placeholder(d: dict) -> dict:
     """Fill out current date placeholder in a dictionary.
@@ -101,7 +103,8 @@ def compute_reference_values(
     df: pd.DataFrame,
     freq: int = 1,
     tolerance_2: float = 0.10,
-    tolerance_24: float = 0.05
+    tolerance_24: float = 0.05,
+    method: str = 'pandas'
 ) -> pd.DataFrame:
     """
     Computes rolling mean and standard deviation for heart rate (HR), respiration rate (RESP),
@@ -113,6 +116,8 @@ def compute_reference_values(
         freq (int, optional): Sampling frequency in Hz (default is 1).
         tolerance_2 (float, optional): Minimum fraction of expected samples required for 2-hour window (default is 0.10, similar to BedBase implementation).
         tolerance_24 (float, optional): Minimum fraction of expected samples required for 24-hour window (default is 0.05, similar to BedBase implementation).
+        method (str, optional): 'pandas' (default) for pandas' rolling windows, or 'streaming' for
+            `reference.ReferenceValues`, which computes all windows in a single pass.
 
     Returns
     -------
@@ -122,6 +127,10 @@ def compute_reference_values(
             - 'HR_24h_mean', 'RESP_24h_mean', 'SpO2_24h_mean'
             - 'HR_24h_std', 'RESP_24h_std', 'SpO2_24h_std'
     """
+    if method == 'streaming':
+        return ReferenceValues(freq, tolerance_2, tolerance_24).transform(df)
+    if method != 'pandas':
+        raise ValueError(f"method must be 'pandas' or 'streaming', got {method}.")
 
     # 2 hours
     df[['HR_2h_mean', 'RESP_2h_mean', 'SpO2_2h_mean']] = df[['HR', 'RESP', 'SpO2']].rolling(window=pd.Timedelta(2, 'h'), min_periods=int(freq*tolerance_2*2*60*60)).mean()
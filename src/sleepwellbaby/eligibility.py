@@ -1,8 +1,12 @@
+from functools import lru_cache
+from typing import Dict, List, Sequence
+
 import numpy as np
 import pandas as pd
 
 from sleepwellbaby import logger
-from sleepwellbaby.preprocess import lookback_windows, vitals_freq
+from sleepwellbaby.metrics import registry
+from sleepwellbaby.preprocess import lookback_windows, reference_keys, vitals_freq
 
 pma_range = [28, 34]  # weeks, lo <= PMA < hi
 reference_ranges = {
@@ -22,6 +26,15 @@ reference_ranges = {
     },
     "param_OS": {"mean": {"min": 85, "max": 100}, "std": {"min": 0, "max": 10}},
 }
+eligibility_rules = {
+    "age": "Patient does not meet PMA criteria",
+    "data": "Data completeness criteria not met",
+    "reference": "Reference values out of bounds",
+}  # rule names and messages logged when a rule is not met
+# Order of the rules when short-circuiting, cheapest first (age eligibility when cached).
+# Age is checked first, so invalid dates raise regardless of the other rules.
+short_circuit_order = ["age", "reference", "data"]
+age_cache_size = 4096
 
 
 def data_eligibility(payload: dict) -> bool:
@@ -40,14 +53,14 @@ def data_eligibility(payload: dict) -> bool:
         bool: True if data completeness is sufficient, False otherwise.
     """
 
-    def relative_n_nans(v: list) -> float:
-        return np.mean([(i <= 0) for i in v])
+    def relative_n_nans(missing: np.ndarray) -> float:
+        return np.count_nonzero(missing) / len(missing)
 
-    values = [v["values"] for k, v in payload.items() if "param_" in k]
+    missing = [np.asarray(v["values"]) <= 0 for k, v in payload.items() if "param_" in k]
     for past in lookback_windows:
         n_values = int(past * vitals_freq)
         # Assumes last value in value lists to be newest
-        data_elig = all(relative_n_nans(pr[-n_values:]) <= 0.5 for pr in values)
+        data_elig = all(relative_n_nans(pr[-n_values:]) <= 0.5 for pr in missing)
         if not data_elig:
             return False
     return True
@@ -71,8 +84,28 @@ def age_eligibility(payload: dict) -> bool:
     return (pma_range[0] <= pma) & (pma < pma_range[1])
 
 
+@lru_cache(maxsize=age_cache_size)
+def _cached_age_eligibility(birth_date, gestation_period: int, observation_date) -> bool:
+    return age_eligibility(
+        {"birth_date": birth_date, "gestation_period": gestation_period, "observation_date": observation_date}
+    )
+
+
+def cached_age_eligibility(payload: dict) -> bool:
+    """
+    `age_eligibility` cached per (birth_date, gestation_period, observation_date).
+
+    Age eligibility only changes daily, so it is computed once per patient and day.
+    If the observation date is not provided, the cache is keyed by the date of today.
+    """
+    observation_date = payload["observation_date"]
+    if observation_date is None:
+        observation_date = pd.Timestamp.today().strftime("%Y-%m-%d")
+    return _cached_age_eligibility(payload["birth_date"], payload["gestation_period"], observation_date)
+
+
 def reference_eligibility(payload: dict) -> bool:
-    """Eligibility check of reference values"""
+    """Eligibility check of reference values, missing (NaN) reference values are not eligible"""
 
     keys_mean = ["ref2h_mean", "ref24h_mean"]
     keys_std = ["ref2h_std", "ref24h_std"]
@@ -82,20 +115,175 @@ def reference_eligibility(payload: dict) -> bool:
         for stat, stat_range in reference_ranges[k].items():
             if stat == "std":
                 # lower bound not included, upper include
-                if any(v[i] <= stat_range["min"] for i in keys_std):
-                    return False
-                if any(v[i] > stat_range["max"] for i in keys_std):
+                if not all(stat_range["min"] < v[i] <= stat_range["max"] for i in keys_std):
                     return False
             elif stat == "mean":
                 # lower and upper bound included
-                if any(v[i] < stat_range["min"] for i in keys_mean):
-                    return False
-                if any(v[i] > stat_range["max"] for i in keys_mean):
+                if not all(stat_range["min"] <= v[i] <= stat_range["max"] for i in keys_mean):
                     return False
     return True
 
 
-def check_eligibility(payload: dict) -> bool:
+def data_eligibility_array(values: np.ndarray) -> np.ndarray:
+    """
+    Vectorized `data_eligibility` for arrays of parameter values.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Parameter values of shape (..., n_parameters, n_samples), missing values
+        coded as 0 or -1, assumes last value to be newest.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array of shape (...), True if data completeness is sufficient.
+    """
+    missing = np.asarray(values) <= 0
+    data_elig = np.ones(missing.shape[:-2], dtype=bool)
+    for past in lookback_windows:
+        n_values = int(past * vitals_freq)
+        # At most 50% missing, i.e. 2 * n_missing <= n_values
+        data_elig &= (2 * np.count_nonzero(missing[..., -n_values:], axis=-1) <= n_values).all(axis=-1)
+    return data_elig
+
+
+def age_eligibility_array(
+    birth_date: np.ndarray, gestation_period: np.ndarray, observation_date: np.ndarray
+) -> np.ndarray:
+    """
+    Vectorized `age_eligibility`.
+
+    Parameters
+    ----------
+    birth_date : np.ndarray
+        Birth dates, as (array of) datetime64 or 'YYYY-MM-DD' strings.
+    gestation_period : np.ndarray
+        Gestation periods in days.
+    observation_date : np.ndarray
+        Dates of observation, as (array of) datetime64 or 'YYYY-MM-DD' strings,
+        NaT or None for today.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array, True if postmenstrual age is within `pma_range`.
+    """
+    birth_date = np.asarray(birth_date, dtype="datetime64[D]")
+    observation_date = np.asarray(observation_date, dtype="datetime64[D]")
+    observation_date = np.where(np.isnat(observation_date), np.datetime64("today", "D"), observation_date)
+    days_since_birth = (observation_date - birth_date).astype(int)
+    if np.any(days_since_birth < 0):
+        raise ValueError("Observation date cannot be before birth date.")
+    pma = (days_since_birth + np.asarray(gestation_period)) / 7
+    return (pma_range[0] <= pma) & (pma < pma_range[1])
+
+
+def reference_eligibility_array(references: dict) -> np.ndarray:
+    """
+    Vectorized `reference_eligibility`.
+
+    Parameters
+    ----------
+    references : dict
+        Dictionary structured as the payload (e.g. references["param_HR"]["ref2h_mean"]),
+        with arrays of reference values instead of scalars.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array, True if all reference values are within `reference_ranges`.
+    """
+    ref_elig = True
+    for k, v in references.items():
+        if not k.startswith("param_"):
+            continue
+        for stat, stat_range in reference_ranges[k].items():
+            for i in [f"ref2h_{stat}", f"ref24h_{stat}"]:
+                ref = np.asarray(v[i])
+                if stat == "std":
+                    # lower bound not included, upper include
+                    ref_elig = ref_elig & (ref > stat_range["min"]) & (ref <= stat_range["max"])
+                elif stat == "mean":
+                    # lower and upper bound included
+                    ref_elig = ref_elig & (ref >= stat_range["min"]) & (ref <= stat_range["max"])
+    return ref_elig
+
+
+def reference_bounds(parameters: Sequence[str]) -> Dict[str, np.ndarray]:
+    """
+    Bounds of `reference_ranges` as arrays of shape (n_parameters, 4), in order of `preprocess.reference_keys`.
+
+    Returns a dict with 'lower', 'upper' and 'lower_included' (True for means, False for standard deviations).
+    """
+    stats = [key.split("_")[1] for key in reference_keys]
+    return {
+        "lower": np.array([[reference_ranges[f"param_{p}"][stat]["min"] for stat in stats] for p in parameters], dtype=float),
+        "upper": np.array([[reference_ranges[f"param_{p}"][stat]["max"] for stat in stats] for p in parameters], dtype=float),
+        "lower_included": np.array([[stat == "mean" for stat in stats] for _ in parameters]),
+    }
+
+
+def check_eligibility_batch(
+    values: np.ndarray,
+    references: np.ndarray,
+    birth_date: np.ndarray,
+    gestation_period: np.ndarray,
+    observation_date: np.ndarray,
+    parameters: Sequence[str] = ("HR", "RR", "OS"),
+) -> Dict[str, np.ndarray]:
+    """
+    Vectorized `check_eligibility` for multiple payloads, with the result of each rule.
+
+    Arrays of payloads are returned by `preprocess.payloads_to_arrays`. Unlike
+    `reference_eligibility`, missing (NaN) reference values are not eligible.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Parameter values of shape (n_payloads, n_parameters, n_samples), missing values
+        coded as 0 or -1, assumes last value to be newest.
+    references : np.ndarray
+        Reference values of shape (n_payloads, n_parameters, 4), in order of `preprocess.reference_keys`.
+    birth_date : np.ndarray
+        Birth dates as datetime64.
+    gestation_period : np.ndarray
+        Gestation periods in days.
+    observation_date : np.ndarray
+        Dates of observation as datetime64, NaT for today.
+    parameters : list of str, optional
+        Names of the parameters, in order of the second axis of `values` and `references`.
+
+    Returns
+    -------
+    dict of str to np.ndarray
+        Boolean arrays of shape (n_payloads,) per rule of `eligibility_rules`
+        ('age', 'data' and 'reference'), and 'eligible' if all rules are met.
+    """
+    references = np.asarray(references, dtype=float)
+    bounds = reference_bounds(parameters)
+    above_lower = np.where(
+        bounds["lower_included"], references >= bounds["lower"], references > bounds["lower"]
+    )
+    masks = {
+        "age": np.broadcast_to(
+            age_eligibility_array(birth_date, gestation_period, observation_date), references.shape[:1]
+        ),
+        "data": data_eligibility_array(values),
+        "reference": (above_lower & (references <= bounds["upper"])).all(axis=(-2, -1)),
+    }
+    masks["eligible"] = masks["age"] & masks["data"] & masks["reference"]
+    return masks
+
+
+def ineligibility_reasons(masks: Dict[str, np.ndarray]) -> List[List[str]]:
+    """Names of the rules that are not met per payload, from the result of `check_eligibility_batch`."""
+    failed = np.stack([~masks[rule] for rule in eligibility_rules], axis=-1)
+    rules = list(eligibility_rules)
+    return [[rules[j] for j in np.flatnonzero(row)] for row in failed]
+
+
+def check_eligibility(payload: dict, short_circuit: bool = False, cache_age: bool = False) -> bool:
     """
     Checks eligibility based on gestational age and data completeness.
 
@@ -103,20 +291,30 @@ def check_eligibility(payload: dict) -> bool:
     ----------
     payload : dict
         Dictionary containing parameter values.
+    short_circuit : bool, optional
+        Check the rules in `short_circuit_order` and stop at the first rule that is not met,
+        instead of checking (and logging) all rules (default is False). Either way, only the
+        first rule in `short_circuit_order` that is not met is counted in `metrics.registry`.
+    cache_age : bool, optional
+        Check age eligibility with `cached_age_eligibility` (default is False).
 
     Returns
     -------
     bool
         True if patient is eligible based on data received, False otherwise.
     """
-    age_elig = age_eligibility(payload)
-    if not age_elig:
-        logger.info("Patient does not meet PMA criteria")
-    data_elig = data_eligibility(payload)
-    if not data_elig:
-        logger.info("Data completeness criteria not met")
-    ref_elig = reference_eligibility(payload)
-    if not ref_elig:
-        logger.info("Reference values out of bounds")
-
-    return age_elig & data_elig & ref_elig
+    rules = {
+        "age": cached_age_eligibility if cache_age else age_eligibility,
+        "data": data_eligibility,
+        "reference": reference_eligibility,
+    }
+    failed = []
+    for rule in short_circuit_order if short_circuit else ["age", "data", "reference"]:
+        if not rules[rule](payload):
+            logger.info(eligibility_rules[rule])
+            failed.append(rule)
+            if short_circuit:
+                break
+    if failed:
+        registry.count("swb_ineligible_total", reason=min(failed, key=short_circuit_order.index))
+    return not failed
@@ -0,0 +1,188 @@
+"""
+Counters and histograms of the inference path, rendered in the Prometheus text format.
+
+Metrics are recorded in `registry` only if enabled, with SWB_METRICS=1 or by setting
+`registry.enabled`, e.g.:
+
+    with registry.timer("swb_stage_seconds", stage="pipeline"):
+        df = pipeline(payload, model_support_dict)
+    registry.count("swb_ineligible_total", reason="age")
+
+When disabled, `timer` returns a no-op context manager and `count` and `observe` return
+immediately, so the hooks cost well under a microsecond each.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Upper bounds of the histogram buckets, in seconds for durations
+default_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+batch_size_buckets = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+_disabled = nullcontext()
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets, as a Prometheus histogram.
+
+    Parameters
+    ----------
+    buckets : sequence of float
+        Increasing upper bounds of the buckets, a bucket for +Inf is added.
+    """
+
+    def __init__(self, buckets: Sequence[float] = default_buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Add `value` to the first bucket with an upper bound of at least `value`."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Timer:
+    """Context manager observing its duration in a histogram of a `Registry`."""
+
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry: "Registry", name: str, labels: dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    """
+    Thread-safe collection of counters and histograms identified by name and labels.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Record metrics, if False `count`, `observe` and `timer` do nothing (default is False).
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        self._histograms: Dict[Tuple[str, tuple], Histogram] = {}
+        self._descriptions: Dict[str, Tuple[str, str, Optional[Sequence[float]]]] = {}
+        self._collectors: Dict[str, Tuple[Callable[[], Dict[str, float]], frozenset]] = {}
+
+    def describe(self, name: str, kind: str, description: str, buckets: Optional[Sequence[float]] = None):
+        """Set the type ("counter" or "histogram"), help text and histogram buckets of a metric."""
+        self._descriptions[name] = (kind, description, buckets)
+
+    def collect(self, prefix: str, metrics: Callable[[], Dict[str, float]], counters: Sequence[str] = ()):
+        """
+        Add the result of `metrics()` to the output of `render`, as metrics named `<prefix>_<key>`.
+
+        E.g. `batching.MicroBatcher.metrics` or `cache.PayloadCache.metrics`. Keys in `counters`
+        only increase and are rendered as counters, other keys as gauges. Collectors are called
+        on `render`, also if the registry is disabled. A collector replaces an earlier collector
+        with the same prefix.
+        """
+        self._collectors[prefix] = (metrics, frozenset(counters))
+
+    def count(self, name: str, value: float = 1, **labels):
+        """Increase counter `name` with `labels` by `value`."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """Add `value` to histogram `name` with `labels`."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                buckets = self._descriptions.get(name, (None, None, None))[2]
+                histogram = self._histograms[key] = Histogram(buckets or default_buckets)
+            histogram.observe(value)
+
+    def timer(self, name: str, **labels):
+        """Context manager adding its duration in seconds to histogram `name` with `labels`."""
+        if not self.enabled:
+            return _disabled
+        return _Timer(self, name, labels)
+
+    def reset(self):
+        """Remove all recorded counters and histograms."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (h.buckets, list(h.counts), h.sum, h.count)) for key, h in self._histograms.items()
+            )
+        lines, described = [], set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._descriptions:
+                    lines.append(f"# HELP {name} {self._descriptions[name][1]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), (buckets, counts, total, n) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {n}")
+        for prefix, (metrics, counter_keys) in sorted(self._collectors.items()):
+            for key, value in metrics().items():
+                header(f"{prefix}_{key}", "counter" if key in counter_keys else "gauge")
+                lines.append(f"{prefix}_{key} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry(enabled=os.environ.get("SWB_METRICS", "0").lower() in ["1", "true", "yes"])
+registry.describe("swb_requests_total", "counter", "Requests per endpoint and HTTP status code.")
+registry.describe("swb_request_seconds", "histogram", "Duration of requests per endpoint in seconds.")
+registry.describe("swb_stage_seconds", "histogram", "Duration of inference stages in seconds.")
+registry.describe("swb_predictions_total", "counter", "Predictions per predicted class, or ineligible.")
+registry.describe("swb_ineligible_total", "counter", "Payloads not eligible per first failing eligibility rule (age, reference, data).")
+registry.describe("swb_batch_size", "histogram", "Number of payloads or items per batch.", batch_size_buckets)
+registry.describe("swb_batch_wait_seconds", "histogram", "Time in seconds items wait in a micro-batching queue.")
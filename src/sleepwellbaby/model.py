@@ -1,12 +1,32 @@
-from typing import Any, Dict, List, Tuple
+import os
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 
 import importlib_resources
 import joblib
 import numpy as np
 from sklearn.base import BaseEstimator
 
-from sleepwellbaby.eligibility import check_eligibility
-from sleepwellbaby.preprocess import pipeline
+from sleepwellbaby import logger
+from sleepwellbaby.cache import PayloadCache, payload_key
+from sleepwellbaby.eligibility import (
+    check_eligibility,
+    check_eligibility_batch,
+    eligibility_rules,
+    short_circuit_order,
+)
+from sleepwellbaby.metrics import registry
+from sleepwellbaby.model_arrays import ArrayModel, load_model_arrays
+from sleepwellbaby.preprocess import (
+    payloads_to_arrays,
+    pipeline,
+    pipeline_arrays,
+    reference_keys,
+)
+
+ineligible_proba = {"AS": -1, "QS": -1, "W": -1}
+inference_engines = ["sklearn", "arrays"]
 
 
 def load_model() -> Tuple[BaseEstimator, Dict[str, Any]]:
@@ -21,12 +41,62 @@ def load_model() -> Tuple[BaseEstimator, Dict[str, Any]]:
     # return model, model_support_dict
 
     resource_path_model = importlib_resources.files("sleepwellbaby").joinpath("modelfiles", "classifier.bz2")
-    resource_path_support = importlib_resources.files("sleepwellbaby").joinpath("modelfiles", "trained_support_obj.pkl")
     with resource_path_model.open("rb") as f:
         model: BaseEstimator = joblib.load(f)
+    return model, load_model_support_dict()
+
+
+def load_model_support_dict() -> Dict[str, Any]:
+    """Load model meta information."""
+    resource_path_support = importlib_resources.files("sleepwellbaby").joinpath("modelfiles", "trained_support_obj.pkl")
     with resource_path_support.open("rb") as f:
         model_support_dict: Dict[str, Any] = joblib.load(f)
-    return model, model_support_dict
+    return model_support_dict
+
+
+@lru_cache(maxsize=None)
+def get_model() -> Tuple[BaseEstimator, Dict[str, Any]]:
+    """
+    Load model files on first call, and return the same model on subsequent calls.
+
+    If the environment variable SWB_MODEL_ARRAYS is set to a directory written by
+    `model_arrays.export_model_arrays`, the model is memory-mapped from there instead,
+    so worker processes share the model in memory.
+    """
+    directory = os.environ.get("SWB_MODEL_ARRAYS")
+    if directory:
+        return load_model_arrays(directory), load_model_support_dict()
+    return load_model()
+
+
+@lru_cache(maxsize=None)
+def get_array_model(model: BaseEstimator) -> ArrayModel:
+    """Extract the arrays of a trained model on first call, and return the same arrays on subsequent calls."""
+    return ArrayModel.from_model(model)
+
+
+def get_inference_model(model, inference: str = "sklearn"):
+    """
+    Return the model to call `predict_proba` on.
+
+    Parameters
+    ----------
+    model : BaseEstimator or ArrayModel
+        Trained model.
+    inference : str, optional
+        "sklearn" to use the model as is, or "arrays" to evaluate it with `model_arrays.ArrayModel`,
+        which gives the same probabilities with a lower latency (default is "sklearn").
+        A model loaded from arrays (see `get_model`) is always evaluated with `ArrayModel`.
+
+    Returns
+    -------
+    BaseEstimator or ArrayModel
+    """
+    if inference not in inference_engines:
+        raise ValueError(f"inference must be one of {inference_engines}, got {inference}")
+    if inference == "arrays" and not isinstance(model, ArrayModel):
+        return get_array_model(model)
+    return model
 
 
 def process_prediction(
@@ -100,17 +170,129 @@ def return_y_pred(
     return y_pred
 
 
-def get_prediction(payload, model=None, model_support_dict=None):
+def get_prediction(
+    payload, model=None, model_support_dict=None, inference: str = "sklearn", cache: Optional[PayloadCache] = None
+):
+    """
+    Get the prediction for a payload.
+
+    Parameters
+    ----------
+    payload : dict
+        Payload with patient characteristics, and values and reference values per parameter.
+    model : BaseEstimator, optional
+        Trained model, loaded with `get_model` if not provided.
+    model_support_dict : dict, optional
+        Model meta information, loaded with `get_model` if not provided.
+    inference : str, optional
+        Inference engine, see `get_inference_model` (default is "sklearn").
+    cache : cache.PayloadCache, optional
+        Cache of predictions keyed by `cache.payload_key`, so identical payloads (e.g.
+        retried requests) are predicted once. A cache should only be used with one model.
+
+    Returns
+    -------
+    tuple
+        Prediction ("ineligible" if the payload is not eligible) and probability per class.
+    """
+    key = None
+    if cache is not None:
+        key = payload_key(payload)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached[0], dict(cached[1])
     if (model is None) | (model_support_dict is None):
-        model, model_support_dict = load_model()
+        model, model_support_dict = get_model()
+    model = get_inference_model(model, inference)
 
-    eligible = check_eligibility(payload)
+    with registry.timer("swb_stage_seconds", stage="eligibility"):
+        eligible = check_eligibility(payload, short_circuit=True, cache_age=True)
 
     if eligible:
-        df = pipeline(payload, model_support_dict)
-        pred_proba = model.predict_proba(df)
+        with registry.timer("swb_stage_seconds", stage="pipeline"):
+            df = pipeline(payload, model_support_dict)
+        with registry.timer("swb_stage_seconds", stage="predict_proba"):
+            pred_proba = model.predict_proba(df)
         pred, proba_dict = process_prediction(pred_proba, model.classes_)
     else:
         pred = "ineligible"
-        proba_dict = {"AS": -1, "QS": -1, "W": -1}
+        proba_dict = dict(ineligible_proba)
+    registry.count("swb_predictions_total", prediction=pred)
+    if key is not None:
+        cache.put(key, (pred, dict(proba_dict)))
     return pred, proba_dict
+
+
+def _log_ineligible(masks: Dict[str, np.ndarray]):
+    """Log the payloads failing each eligibility rule, and count them by their first failing rule as `check_eligibility`."""
+    n_payloads = len(masks["eligible"])
+    for rule, message in eligibility_rules.items():
+        if not masks[rule].all():
+            logger.info(f"{message} ({np.count_nonzero(~masks[rule])} of {n_payloads} payloads)")
+    counted = np.zeros(n_payloads, dtype=bool)
+    for rule in short_circuit_order:
+        n_ineligible = np.count_nonzero(~masks[rule] & ~counted)
+        if n_ineligible:
+            registry.count("swb_ineligible_total", n_ineligible, reason=rule)
+        counted |= ~masks[rule]
+
+
+def get_predictions(
+    payloads: List[dict], model=None, model_support_dict=None, inference: str = "sklearn"
+) -> List[Tuple[str, Dict[str, float]]]:
+    """
+    Get predictions for multiple payloads with a single call to the model.
+
+    Eligibility of all payloads is checked at once with `eligibility.check_eligibility_batch`.
+
+    Parameters
+    ----------
+    payloads : list of dict
+        Payloads as accepted by `get_prediction`.
+    model : BaseEstimator, optional
+        Trained model, loaded with `get_model` if not provided.
+    model_support_dict : dict, optional
+        Model meta information, loaded with `get_model` if not provided.
+    inference : str, optional
+        Inference engine, see `get_inference_model` (default is "sklearn").
+
+    Returns
+    -------
+    list of tuple
+        (prediction, proba_dict) per payload, in order of `payloads`, as returned
+        by `get_prediction`. Ineligible payloads get prediction "ineligible" and
+        probabilities of -1.
+    """
+    if (model is None) | (model_support_dict is None):
+        model, model_support_dict = get_model()
+    model = get_inference_model(model, inference)
+
+    results = [("ineligible", dict(ineligible_proba)) for _ in payloads]
+    if not payloads:
+        return results
+    registry.observe("swb_batch_size", len(payloads), batcher="get_predictions")
+    with registry.timer("swb_stage_seconds", stage="payloads_to_arrays"):
+        arrays = payloads_to_arrays(payloads)
+    with registry.timer("swb_stage_seconds", stage="eligibility"):
+        masks = check_eligibility_batch(**arrays)
+    _log_ineligible(masks)
+    eligible = np.flatnonzero(masks["eligible"])
+    if len(eligible):
+        references = arrays["references"][eligible]
+        with registry.timer("swb_stage_seconds", stage="pipeline"):
+            df = pipeline_arrays(
+                arrays["values"][eligible],
+                references[..., reference_keys.index("ref24h_mean")],
+                references[..., reference_keys.index("ref24h_std")],
+                model_support_dict,
+                arrays["parameters"],
+            )
+        with registry.timer("swb_stage_seconds", stage="predict_proba"):
+            pred_proba = model.predict_proba(df)
+        preds = return_y_pred(pred_proba, model.classes_)
+        for i, pred, proba in zip(eligible, preds, pred_proba):
+            results[i] = (pred, {k: v for k, v in zip(model.classes_, proba)})
+    if registry.enabled:
+        for pred, n in Counter(pred for pred, _ in results).items():
+            registry.count("swb_predictions_total", n, prediction=pred)
+    return results
@@ -1,11 +1,15 @@
 import re
 import warnings
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
+from scipy.special import stdtr
 from sklearn.preprocessing import StandardScaler
 from sklearn.preprocessing._data import _handle_zeros_in_scale
-from tsfresh.feature_extraction import MinimalFCParameters, extract_features
+
+from sleepwellbaby.metrics import registry
 
 TIME_COL = "time_unix_epoch"
 PR_N_COL = "parameter_name"
@@ -16,6 +20,10 @@ minimum_coverage_features = (
 )
 vitals_freq = 0.4  # Frequency of vital parameter data, Hz
 lookback_windows = [60, 120, 240, 480]  # lookback windows in seconds
+reference_keys = ["ref2h_mean", "ref2h_std", "ref24h_mean", "ref24h_std"]  # reference values per parameter
+rescaled_parameters = ["HR", "RR"]  # parameters rescaled by ref24h values, see `ref24h_correction`
+window_features = ["median", "mean", "variance", "maximum", "minimum"]  # see `window_statistics`
+linear_trend_attrs = ["pvalue", "rvalue", "intercept", "slope"]
 
 
 class StandardScalerWithoutFit(StandardScaler):
@@ -68,16 +76,84 @@ def rescale(v: np.ndarray, ref24h_mean: float, ref24h_std: float) -> np.ndarray:
     ref24h_std : float
         Standard deviation of ref24h values of the patient.
 
+    Returns
+    -------
+    np.ndarray
+        Scaled parameter values, of shape (n_samples, 1) as returned by `StandardScalerWithoutFit`.
+    """
+    return rescale_values(v, ref24h_mean, ref24h_std).reshape(-1, 1)
+
+
+def rescale_values(
+    values: np.ndarray, ref24h_mean: np.ndarray, ref24h_std: np.ndarray, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Vectorized `rescale`, for multiple value arrays and reference values at once.
+
+    Computes `(v - ref24h_mean) / ref24h_std` as `StandardScalerWithoutFit` does, with
+    missing values (0 and -1) set to NaN, and a standard deviation of 0 replaced by 1
+    (as `_handle_zeros_in_scale` does for scalars).
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Array of parameter values of shape (..., n_samples).
+    ref24h_mean : np.ndarray
+        Mean of ref24h values, of shape (...).
+    ref24h_std : np.ndarray
+        Standard deviation of ref24h values, of shape (...).
+    out : np.ndarray, optional
+        Float array of the same shape as `values` to write the result to, may be `values`
+        itself to rescale in place. By default a new array is returned.
+
     Returns
     -------
     np.ndarray
         Scaled parameter values.
     """
-    v = v.astype(float)
-    v[v <= 1e-10] = np.nan  # convert 0 and -1 to nan
+    values = np.asarray(values, dtype=float)
+    mean = np.asarray(ref24h_mean, dtype=float)[..., None]
+    scale = np.asarray(ref24h_std, dtype=float)[..., None]
+    missing = values <= 1e-10  # 0 and -1, before `out` overwrites `values`
+    out = np.subtract(values, mean, out=out)
+    np.divide(out, scale, out=out, where=scale != 0.0)
+    out[missing] = np.nan
+    return out
+
+
+def rescale_parameters(
+    values: np.ndarray, ref24h_mean: np.ndarray, ref24h_std: np.ndarray, parameters: Sequence[str]
+) -> np.ndarray:
+    """
+    Rescale the `rescaled_parameters` of arrays of values in place, see `rescale_values`.
+
+    All parameters (and rows) are rescaled at once, parameters that are not rescaled
+    (e.g. OS) are left as is.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Float array of parameter values of shape (n_rows, n_parameters, n_samples), modified in place.
+    ref24h_mean : np.ndarray
+        Mean of ref24h values, of shape (n_rows, n_parameters).
+    ref24h_std : np.ndarray
+        Standard deviation of ref24h values, of shape (n_rows, n_parameters).
+    parameters : list of str
+        Names of the parameters, in order of the second axis of `values`.
 
-    scaler = StandardScalerWithoutFit(ref24h_mean, ref24h_std)
-    return scaler.transform(v.reshape(-1, 1))
+    Returns
+    -------
+    np.ndarray
+        `values`, rescaled.
+    """
+    rescaled = np.array([x in rescaled_parameters for x in parameters])[:, None]
+    mean = np.asarray(ref24h_mean, dtype=float)[..., None]
+    scale = np.asarray(ref24h_std, dtype=float)[..., None]
+    missing = (values <= 1e-10) & rescaled
+    np.subtract(values, mean, out=values, where=rescaled)
+    np.divide(values, scale, out=values, where=rescaled & (scale != 0.0))
+    values[missing] = np.nan
+    return values
 
 
 def ref24h_correction(df: pd.DataFrame, data: dict) -> pd.DataFrame:
@@ -99,7 +175,7 @@ def ref24h_correction(df: pd.DataFrame, data: dict) -> pd.DataFrame:
     for x in df.columns:
         if x == "OS":
             continue
-        elif x in ["HR", "RR"]:
+        elif x in rescaled_parameters:
             values = data[f"param_{x}"]
             df[x] = rescale(
                 v=df[x].values,
@@ -129,6 +205,9 @@ def calculate_features(df_windows: pd.DataFrame, n_jobs: int = 0) -> pd.DataFram
     pd.DataFrame
         DataFrame with calculated features.
     """
+    # tsfresh is slow to import and not used by the default feature engine
+    from tsfresh.feature_extraction import MinimalFCParameters, extract_features
+
     warnings.simplefilter("ignore")
     to_calculate = {
         **{k: v for k, v in MinimalFCParameters().items() if k != "standard_deviation"},
@@ -194,6 +273,173 @@ def calculate_features(df_windows: pd.DataFrame, n_jobs: int = 0) -> pd.DataFram
     return df_features
 
 
+def window_statistics(v: np.ndarray) -> dict:
+    """
+    Calculate window statistics over the last axis, disregarding missing values.
+
+    Vectorized equivalent of tsfresh's median, mean, variance, maximum, minimum and
+    linear_trend (i.e. `scipy.stats.linregress` on `range(len(x))`), where missing
+    values (NaN) are dropped before numbering the samples.
+
+    Parameters
+    ----------
+    v : np.ndarray
+        Array of shape (..., n_samples), missing values coded as NaN.
+
+    Returns
+    -------
+    dict
+        Arrays of shape (...) keyed by feature name as used by tsfresh,
+        i.e. `window_features` and linear_trend__attr_"<attr>" for `linear_trend_attrs`.
+    """
+    mask = np.isfinite(v)
+    n = mask.sum(axis=-1)
+    # Position of each sample among the non-missing samples
+    x = np.cumsum(mask, axis=-1) - 1.0
+    # NaNs are sorted to the end, so the median is found at the middle of the first n
+    v_sorted = np.sort(v, axis=-1)
+    lo = np.maximum((n - 1) // 2, 0)[..., None]
+    hi = np.maximum(n // 2, 0)[..., None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        median = (
+            np.take_along_axis(v_sorted, lo, axis=-1) + np.take_along_axis(v_sorted, hi, axis=-1)
+        )[..., 0] / 2
+        xmean = (n - 1) / 2
+        ymean = np.where(mask, v, 0.0).sum(axis=-1) / n
+        dx = np.where(mask, x - xmean[..., None], 0.0)
+        dy = np.where(mask, v - ymean[..., None], 0.0)
+        ssxm = (dx * dx).sum(axis=-1) / n
+        ssxym = (dx * dy).sum(axis=-1) / n
+        ssym = (dy * dy).sum(axis=-1) / n
+
+        constant = (ssxm == 0) | (ssym == 0)
+        r = np.clip(np.where(constant, 0.0, ssxym / np.sqrt(ssxm * ssym)), -1.0, 1.0)
+        slope = ssxym / ssxm
+        intercept = ymean - slope * xmean
+
+        # Two-sided p-value of the t-statistic, see `scipy.stats.linregress`
+        dof = n - 2.0
+        tiny = 1.0e-20
+        t = r * np.sqrt(dof / ((1.0 - r + tiny) * (1.0 + r + tiny)))
+        pvalue = 2 * stdtr(dof, -np.abs(t))
+        pvalue = np.where(n == 2, np.where(ssym == 0, 1.0, 0.0), pvalue)
+
+    empty = n == 0
+    stats = {
+        "median": np.where(empty, np.nan, median),
+        "mean": ymean,
+        "variance": ssym,
+        "maximum": np.where(empty, np.nan, np.where(mask, v, -np.inf).max(axis=-1)),
+        "minimum": np.where(empty, np.nan, np.where(mask, v, np.inf).min(axis=-1)),
+        'linear_trend__attr_"pvalue"': np.where(n < 2, np.nan, pvalue),
+        'linear_trend__attr_"rvalue"': r,
+        'linear_trend__attr_"intercept"': intercept,
+        'linear_trend__attr_"slope"': slope,
+    }
+    return stats
+
+
+def calculate_features_native(values: np.ndarray, parameters: List[str]) -> pd.DataFrame:
+    """
+    Calculate window features with NumPy, without the tsfresh overhead.
+
+    Computes the same features as `calculate_features` does for the columns used
+    by the model (see `window_statistics`), for each of the `lookback_windows`.
+    Missing values (NaN) are disregarded.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Parameter values of shape (n_parameters, n_samples) or
+        (n_rows, n_parameters, n_samples), assumes last value to be newest.
+    parameters : list of str
+        Names of the parameters, in order of the second to last axis of `values`.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with one row per window, columns named as by tsfresh
+        (e.g. HR__0_60__mean).
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 2:
+        values = values[None]
+
+    columns, features = [], []
+    for far_past in lookback_windows:
+        stats = window_statistics(values[..., -int(far_past * vitals_freq):])
+        for feature, stat in stats.items():
+            columns.extend(f"{param}__0_{far_past}__{feature}" for param in parameters)
+            features.append(stat)
+    return pd.DataFrame(np.concatenate(features, axis=-1), columns=columns)
+
+
+@lru_cache(maxsize=None)
+def _feature_positions(columns: Tuple[str, ...], parameters: Tuple[str, ...]) -> Dict[str, np.ndarray]:
+    index = {c: i for i, c in enumerate(columns)}
+    return {
+        feature: np.array([
+            [index.get(f"{param}__0_{far_past}__{feature}", -1) for param in parameters]
+            for far_past in lookback_windows
+        ])
+        for feature in window_features + [f'linear_trend__attr_"{attr}"' for attr in linear_trend_attrs]
+    }
+
+
+def feature_positions(columns: Sequence[str], parameters: Sequence[str]) -> Dict[str, np.ndarray]:
+    """
+    Position of each window feature in `columns`, computed once per columns and parameters.
+
+    Parameters
+    ----------
+    columns : list of str
+        Feature columns, e.g. `model_support_dict["Xcol"]`.
+    parameters : list of str
+        Names of the parameters.
+
+    Returns
+    -------
+    dict
+        Arrays of shape (n_windows, n_parameters) keyed by feature name (see `window_statistics`),
+        with the position of the feature per window in `lookback_windows` and parameter,
+        or -1 if the feature is not in `columns`.
+    """
+    return _feature_positions(tuple(columns), tuple(parameters))
+
+
+def calculate_feature_rows(values: np.ndarray, parameters: Sequence[str], columns: Sequence[str]) -> np.ndarray:
+    """
+    Calculate window features with NumPy directly into rows laid out as `columns`.
+
+    Same features as `calculate_features_native`, without building a DataFrame with all
+    features and reindexing it: features of each window are written into a preallocated
+    array at their position in `columns` (see `feature_positions`).
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Parameter values of shape (n_rows, n_parameters, n_samples), missing values as NaN,
+        assumes last value to be newest.
+    parameters : list of str
+        Names of the parameters, in order of the second axis of `values`.
+    columns : list of str
+        Feature columns, e.g. `model_support_dict["Xcol"]`.
+
+    Returns
+    -------
+    np.ndarray
+        Features of shape (n_rows, len(columns)), NaN for columns that are not a window feature.
+    """
+    positions = feature_positions(columns, parameters)
+    # Last column collects features that are not in `columns`
+    rows = np.full((len(values), len(columns) + 1), np.nan)
+    for i, far_past in enumerate(lookback_windows):
+        stats = window_statistics(values[..., -int(far_past * vitals_freq):])
+        for feature, stat in stats.items():
+            rows[:, positions[feature][i]] = stat
+    return rows[:, :-1]
+
+
 def convert_to_features(df):
     """
     Calculates features from parameter values.
@@ -221,7 +467,24 @@ def convert_to_features(df):
     return df
 
 
-def pipeline(payload: dict, model_support_dict: dict) -> pd.DataFrame:
+def convert_to_features_native(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Calculates features from parameter values using `calculate_features_native`.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DataFrame containing rescaled parameter values.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame containing extracted features.
+    """
+    return calculate_features_native(df.values.T, list(df.columns))
+
+
+def pipeline(payload: dict, model_support_dict: dict, engine: str = "native") -> pd.DataFrame:
     """
     Preprocess data to DataFrame to predict on.
 
@@ -231,15 +494,157 @@ def pipeline(payload: dict, model_support_dict: dict) -> pd.DataFrame:
         Dictionary containing parameter values, ref2h metrics, and ref24h metrics.
     model_support_dict : dict
         Dictionary containing model meta information, including names of feature columns.
+    engine : str, optional
+        Feature engine to use, either "native" (NumPy, default) or "tsfresh".
 
     Returns
     -------
     pd.DataFrame
         DataFrame containing extracted features, ready for prediction.
     """
-    return (
-        dict_to_df(payload)
-        .pipe(ref24h_correction, payload)
-        .pipe(convert_to_features)
-        .reindex(columns=model_support_dict["Xcol"])
+    feature_engines = {
+        "native": convert_to_features_native,
+        "tsfresh": convert_to_features,
+    }
+    if engine not in feature_engines:
+        raise ValueError(f"engine must be one of {list(feature_engines)}, got {engine}.")
+    if engine == "native":
+        # Array equivalent of the tsfresh pipeline below, without DataFrames
+        keys = [k for k in payload if "param_" in k]
+        references = np.array([[payload[k]["ref24h_mean"], payload[k]["ref24h_std"]] for k in keys], dtype=float)
+        return pipeline_arrays(
+            [[payload[k]["values"] for k in keys]],
+            references[None, :, 0],
+            references[None, :, 1],
+            model_support_dict,
+            [k.split("param_")[1] for k in keys],
+        )
+    with registry.timer("swb_stage_seconds", stage="dict_to_df"):
+        df = dict_to_df(payload)
+    with registry.timer("swb_stage_seconds", stage="ref24h_correction"):
+        df = ref24h_correction(df, payload)
+    with registry.timer("swb_stage_seconds", stage="features"):
+        df = feature_engines[engine](df)
+    with registry.timer("swb_stage_seconds", stage="reindex"):
+        return df.reindex(columns=model_support_dict["Xcol"])
+
+
+def pipeline_arrays(
+    values: np.ndarray,
+    ref24h_mean: np.ndarray,
+    ref24h_std: np.ndarray,
+    model_support_dict: dict,
+    parameters: Sequence[str] = ("HR", "RR", "OS"),
+) -> pd.DataFrame:
+    """
+    Preprocess arrays of parameter values to a DataFrame to predict on.
+
+    Array equivalent of `pipeline`, features are calculated with
+    `calculate_feature_rows` for all rows at once.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Parameter values of shape (n_rows, n_parameters, n_samples), missing
+        values coded as 0 or -1, assumes last value to be newest.
+    ref24h_mean : np.ndarray
+        Mean of ref24h values, of shape (n_rows, n_parameters).
+    ref24h_std : np.ndarray
+        Standard deviation of ref24h values, of shape (n_rows, n_parameters).
+    model_support_dict : dict
+        Dictionary containing model meta information, including names of feature columns.
+    parameters : list of str, optional
+        Names of the parameters, in order of the second axis of `values`.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame containing extracted features, one row per row of `values`.
+    """
+    # Similar to `ref24h_correction`, only `rescaled_parameters` are rescaled
+    with registry.timer("swb_stage_seconds", stage="rescale"):
+        values = rescale_parameters(np.array(values, dtype=float), ref24h_mean, ref24h_std, parameters)
+    columns = model_support_dict["Xcol"]
+    with registry.timer("swb_stage_seconds", stage="features"):
+        return pd.DataFrame(calculate_feature_rows(values, parameters, columns), columns=columns)
+
+
+def _to_dates(dates: list) -> np.ndarray:
+    """Convert 'YYYY-MM-DD' strings (None for missing) to datetime64[D]."""
+    try:
+        return np.array(dates, dtype="datetime64[D]")
+    except ValueError:
+        # Dates that are not zero padded, e.g. '2024-1-2'
+        return pd.to_datetime(pd.Series(dates, dtype=object), format="%Y-%m-%d").values.astype("datetime64[D]")
+
+
+def payloads_to_arrays(payloads: List[dict]) -> dict:
+    """
+    Convert payloads to arrays, as accepted by `pipeline_arrays` and `eligibility.check_eligibility_batch`.
+
+    Parameters
+    ----------
+    payloads : list of dict
+        Payloads with the same parameters (keys starting with 'param_') and number of values.
+
+    Returns
+    -------
+    dict
+        values : np.ndarray
+            Parameter values of shape (n_payloads, n_parameters, n_samples).
+        references : np.ndarray
+            Reference values of shape (n_payloads, n_parameters, 4), in order of `reference_keys`.
+        birth_date : np.ndarray
+            Birth dates as datetime64[D].
+        gestation_period : np.ndarray
+            Gestation periods in days.
+        observation_date : np.ndarray
+            Observation dates as datetime64[D], NaT if not provided.
+        parameters : list of str
+            Names of the parameters (e.g. 'HR'), in order of the second axis of `values`.
+    """
+    keys = [k for k in payloads[0].keys() if "param_" in k] if payloads else []
+    n_samples = len(payloads[0][keys[0]]["values"]) if keys else 0
+    return {
+        "values": np.array(
+            [[payload[k]["values"] for k in keys] for payload in payloads], dtype=float
+        ).reshape(len(payloads), len(keys), n_samples),
+        "references": np.array(
+            [[[payload[k][r] for r in reference_keys] for k in keys] for payload in payloads], dtype=float
+        ).reshape(len(payloads), len(keys), len(reference_keys)),
+        "birth_date": _to_dates([payload["birth_date"] for payload in payloads]),
+        "gestation_period": np.array([payload["gestation_period"] for payload in payloads], dtype=int),
+        "observation_date": _to_dates([payload.get("observation_date") for payload in payloads]),
+        "parameters": [k.split("param_")[1] for k in keys],
+    }
+
+
+def pipeline_batch(payloads: List[dict], model_support_dict: dict) -> pd.DataFrame:
+    """
+    Preprocess multiple payloads to a single DataFrame to predict on.
+
+    Features are calculated with `calculate_features_native` for all payloads at once.
+
+    Parameters
+    ----------
+    payloads : list of dict
+        Dictionaries containing parameter values, ref2h metrics, and ref24h metrics.
+    model_support_dict : dict
+        Dictionary containing model meta information, including names of feature columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame containing extracted features, one row per payload, ready for prediction.
+    """
+    if len(payloads) == 0:
+        return pd.DataFrame(columns=model_support_dict["Xcol"], dtype=float)
+    arrays = payloads_to_arrays(payloads)
+    references = arrays["references"]
+    return pipeline_arrays(
+        arrays["values"],
+        references[..., reference_keys.index("ref24h_mean")],
+        references[..., reference_keys.index("ref24h_std")],
+        model_support_dict,
+        arrays["parameters"],
     )
@@ -0,0 +1,155 @@
+"""
+Sampled profiling of requests with cProfile, aggregated per endpoint and inference stage.
+
+A fraction `sample_rate` of the requests to the profiled endpoints is profiled in the
+thread handling the request, the profiles are added to one `pstats.Stats` per endpoint.
+In the app this is configured with environment variables (see `dashboard.app`), e.g.
+to profile 5% of the requests while replaying traffic:
+
+    SWB_PROFILE_RATE=0.05 SWB_PROFILE_DIR=/tmp/swb_profiles gunicorn sleepwellbaby.dashboard.app:app
+
+The aggregated profiles are then available at /admin/profile, and written to
+SWB_PROFILE_DIR on exit, to be inspected with e.g. `python -m pstats`, snakeviz or gprof2dot.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import threading
+from typing import Dict, List, Optional, Sequence
+
+# Functions of the inference stages (file name, function name), as timed by `metrics.registry`.
+# The cumulative time of a stage is that of its outermost function, e.g. the predict_proba of the classifier.
+stage_functions = {
+    "eligibility": [("eligibility.py", "check_eligibility"), ("eligibility.py", "check_eligibility_batch")],
+    "pipeline": [("preprocess.py", "pipeline"), ("preprocess.py", "pipeline_arrays")],
+    "rescale": [("preprocess.py", "rescale_parameters"), ("preprocess.py", "ref24h_correction")],
+    "features": [("preprocess.py", "calculate_feature_rows"), ("preprocess.py", "convert_to_features")],
+    "predict_proba": [(None, "predict_proba")],
+}
+profiled_endpoints = ("do_prediction", "do_prediction_batch")
+
+
+class RequestProfiler:
+    """
+    Profiles a random sample of requests and aggregates the profiles per endpoint.
+
+    Parameters
+    ----------
+    sample_rate : float
+        Fraction of the requests to profile, between 0 and 1.
+    endpoints : sequence of str, optional
+        Names of the Flask endpoints to profile, by default /predict and /predict_batch.
+    seed : int, optional
+        Seed of the random sample.
+    """
+
+    def __init__(self, sample_rate: float, endpoints: Sequence[str] = profiled_endpoints, seed: Optional[int] = None):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"sample_rate must be between 0 and 1, got {sample_rate}")
+        self.sample_rate = sample_rate
+        self.endpoints = frozenset(endpoints)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def start(self, endpoint: Optional[str]) -> Optional[cProfile.Profile]:
+        """Start profiling the current thread if a request to `endpoint` is sampled, see `stop`."""
+        if endpoint not in self.endpoints or self._random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active, e.g. of a concurrent request on Python 3.12+
+            return None
+        return profile
+
+    def stop(self, endpoint: str, profile: cProfile.Profile):
+        """Stop a profile returned by `start` and add it to the stats of `endpoint`."""
+        profile.disable()
+        with self._lock:
+            if endpoint in self._stats:
+                self._stats[endpoint].add(profile)
+            else:
+                self._stats[endpoint] = pstats.Stats(profile)
+            self.n_profiled[endpoint] = self.n_profiled.get(endpoint, 0) + 1
+
+    def reset(self):
+        """Remove the collected profiles."""
+        with self._lock:
+            self._stats: Dict[str, pstats.Stats] = {}
+            self.n_profiled: Dict[str, int] = {}
+
+    def dumps(self, endpoint: str) -> Optional[bytes]:
+        """Aggregated profile of `endpoint` in the format of `pstats.Stats.dump_stats`, None if not profiled."""
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            return None if stats is None else marshal.dumps(stats.stats)
+
+    def stage_summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Time spent per inference stage (see `stage_functions`) in the profiled requests.
+
+        Returns
+        -------
+        dict
+            Per endpoint, per stage: calls, cumulative time in seconds and mean time per
+            profiled request in milliseconds. Stages that were not called are left out.
+        """
+        summary = {}
+        with self._lock:
+            for endpoint, stats in self._stats.items():
+                summary[endpoint] = {}
+                for stage, functions in stage_functions.items():
+                    matches = [
+                        (ct, nc)
+                        for (filename, _, name), (_, nc, _, ct, _) in stats.stats.items()
+                        if any(name == f and (file is None or filename.endswith(file)) for file, f in functions)
+                    ]
+                    if matches:
+                        cumtime, calls = max(matches)
+                        summary[endpoint][stage] = {
+                            "calls": calls,
+                            "cumtime": cumtime,
+                            "mean_ms": cumtime / self.n_profiled[endpoint] * 1e3,
+                        }
+        return summary
+
+    def report(self, limit: int = 30, sort: str = "cumulative") -> str:
+        """Stage summary and the `limit` functions with the highest `sort` time per endpoint, as text."""
+        summary = self.stage_summary()
+        stream = io.StringIO()
+        with self._lock:
+            for endpoint, stats in sorted(self._stats.items()):
+                stream.write(f"{endpoint}: {self.n_profiled[endpoint]} profiled requests\n")
+                for stage, s in summary[endpoint].items():
+                    stream.write(f"  {stage:<15} {s['mean_ms']:10.3f} ms per request  ({s['calls']} calls)\n")
+                stats.stream = stream
+                stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue() or "No requests profiled\n"
+
+    def dump(self, directory: str) -> List[str]:
+        """
+        Write the aggregated profile of each endpoint to `<directory>/<endpoint>.prof`, and the report to report.txt.
+
+        Returns
+        -------
+        list of str
+            Paths of the written files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            profiles = {endpoint: marshal.dumps(stats.stats) for endpoint, stats in sorted(self._stats.items())}
+        paths = []
+        for endpoint, profile in profiles.items():
+            path = os.path.join(directory, f"{endpoint}.prof")
+            with open(path, "wb") as f:
+                f.write(profile)
+            paths.append(path)
+        path = os.path.join(directory, "report.txt")
+        with open(path, "w") as f:
+            f.write(self.report())
+        return paths + [path]
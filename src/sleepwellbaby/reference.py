@@ -0,0 +1,271 @@
+from typing import Dict, Sequence
+
+import numpy as np
+import pandas as pd
+
+reference_columns = ["HR", "RESP", "SpO2"]
+
+
+class RollingMeanStd:
+    """
+    Streaming mean and standard deviation over a time window.
+
+    Equivalent of pandas' time-based `.rolling(window, min_periods).mean()` and `.std()`,
+    i.e. over the window (t - window, t], disregarding missing values (NaN). Infinite values
+    are disregarded as well, so unlike pandas the window is finite while it contains them,
+    and as in pandas the statistics recover once they have left the window. Samples are
+    kept in a buffer together with the cumulative count, sum and sum of squares of the
+    stream, so the statistics of a window are the difference of two cumulative values.
+    Samples can be added one at a time (`update`, amortized O(1)) or in blocks (`update_many`).
+
+    Parameters
+    ----------
+    window : pd.Timedelta
+        Length of the window.
+    min_periods : int
+        Minimum number of (non-missing) samples in the window required for a value.
+    n_columns : int
+        Number of columns (parameters) per sample.
+    """
+
+    def __init__(self, window: pd.Timedelta, min_periods: int, n_columns: int):
+        self.window = pd.Timedelta(window).value
+        self.min_periods = max(min_periods, 1)
+        self.n_columns = n_columns
+        self.capacity = 1024
+        self.start = 0
+        self.end = 0
+        self.times = np.empty(self.capacity, dtype="int64")
+        # Cumulative [count, sum, sum of squares] per column, up to and including each sample
+        self.cumulative = np.empty((self.capacity, 3, n_columns))
+        # Cumulative value before the oldest sample in the buffer
+        self.base = np.zeros((3, n_columns))
+        # Values are shifted by the first observed value to limit loss of precision
+        self.shift = np.full(n_columns, np.nan)
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    @property
+    def last(self) -> np.ndarray:
+        return self.cumulative[self.end - 1] if len(self) > 0 else self.base
+
+    def _increments(self, values: np.ndarray) -> np.ndarray:
+        """Count, sum and sum of squares of the shifted values, of shape (n, 3, n_columns)."""
+        # Infinite values would make all later cumulative values infinite
+        valid = np.isfinite(values)
+        first = np.isnan(self.shift) & valid.any(axis=0)
+        if first.any():
+            self.shift[first] = values[valid[:, first].argmax(axis=0), first]
+        x = np.where(valid, values - self.shift, 0.0)
+        return np.stack([valid.astype(float), x, x * x], axis=1)
+
+    def _reserve(self, n: int):
+        """Make room for `n` samples at the end of the buffer."""
+        if self.end + n <= self.capacity:
+            return
+        size = len(self)
+        if size + n > self.capacity // 2:
+            self.capacity = max(2 * self.capacity, 2 * (size + n))
+            times = np.empty(self.capacity, dtype="int64")
+            cumulative = np.empty((self.capacity, 3, self.n_columns))
+        else:
+            times, cumulative = self.times, self.cumulative
+        times[:size] = self.times[self.start:self.end]
+        cumulative[:size] = self.cumulative[self.start:self.end]
+        self.times, self.cumulative = times, cumulative
+        self.start, self.end = 0, size
+
+    def _evict(self, time: int):
+        """Remove samples that are not within the window ending at `time`."""
+        start = self.start + np.searchsorted(
+            self.times[self.start:self.end], time - self.window, side="right"
+        )
+        if start > self.start:
+            self.base = self.cumulative[start - 1].copy()
+            self.start = start
+
+    def _statistics(self, totals: np.ndarray):
+        n, s, ss = totals[..., 0, :], totals[..., 1, :], totals[..., 2, :]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self.shift + s / n
+            var = np.maximum((ss - s * s / n) / (n - 1), 0.0)
+        enough = n >= self.min_periods
+        mean = np.where(enough, mean, np.nan)
+        std = np.where(enough & (n > 1), np.sqrt(var), np.nan)
+        return mean, std
+
+    def update(self, timestamp, values: np.ndarray):
+        """
+        Add a sample, returns mean and standard deviation of the window ending at the sample.
+
+        Parameters
+        ----------
+        timestamp : pd.Timestamp or np.datetime64
+            Time of the sample, should not be before the previous sample.
+        values : np.ndarray
+            Values of the sample, of shape (n_columns,), missing values as NaN.
+
+        Returns
+        -------
+        tuple of np.ndarray
+            Mean and standard deviation per column.
+        """
+        time = pd.Timestamp(timestamp).value
+        if len(self) > 0 and time < self.times[self.end - 1]:
+            raise ValueError("Samples should be added in chronological order.")
+        values = np.asarray(values, dtype=float).reshape(1, self.n_columns)
+        increment = self._increments(values)[0]
+        self._reserve(1)
+        self.cumulative[self.end] = self.last + increment
+        self.times[self.end] = time
+        self.end += 1
+        self._evict(time)
+        return self._statistics(self.cumulative[self.end - 1] - self.base)
+
+    def update_many(self, timestamps, values: np.ndarray):
+        """
+        Add a block of samples, returns mean and standard deviation of the window ending at each sample.
+
+        Parameters
+        ----------
+        timestamps : array-like of datetime
+            Times of the samples, in chronological order and not before the previous sample.
+        values : np.ndarray
+            Values of the samples, of shape (n_samples, n_columns), missing values as NaN.
+
+        Returns
+        -------
+        tuple of np.ndarray
+            Mean and standard deviation, both of shape (n_samples, n_columns).
+        """
+        times = pd.DatetimeIndex(timestamps).asi8
+        values = np.asarray(values, dtype=float).reshape(len(times), self.n_columns)
+        if len(times) == 0:
+            empty = np.empty((0, self.n_columns))
+            return empty, empty
+        if np.any(np.diff(times) < 0) or (len(self) > 0 and times[0] < self.times[self.end - 1]):
+            raise ValueError("Samples should be added in chronological order.")
+
+        n_old = len(self)
+        self._reserve(len(times))
+        self.cumulative[self.end:self.end + len(times)] = self.last + np.cumsum(
+            self._increments(values), axis=0
+        )
+        self.times[self.end:self.end + len(times)] = times
+        self.end += len(times)
+
+        # Cumulative value before each sample in the buffer, window starts at first sample after t - window
+        buffer_times = self.times[self.start:self.end]
+        before = np.concatenate([self.base[None], self.cumulative[self.start:self.end - 1]])
+        first = np.searchsorted(buffer_times, times - self.window, side="right")
+        totals = self.cumulative[self.start + n_old:self.end] - before[first]
+        self._evict(times[-1])
+        return self._statistics(totals)
+
+
+class ReferenceValues:
+    """
+    Streaming computation of reference values, as `data.compute_reference_values`.
+
+    Maintains the rolling mean and standard deviation over 2-hour and 24-hour windows
+    for heart rate (HR), respiration rate (RESP) and oxygen saturation (SpO2). Samples
+    can be added one at a time with `update`, or in bulk with `update_many` and `transform`.
+
+    Parameters
+    ----------
+    freq : float, optional
+        Sampling frequency in Hz (default is 1).
+    tolerance_2 : float, optional
+        Minimum fraction of expected samples required for 2-hour window (default is 0.10).
+    tolerance_24 : float, optional
+        Minimum fraction of expected samples required for 24-hour window (default is 0.05).
+    columns : sequence of str, optional
+        Names of the parameters (default is HR, RESP and SpO2).
+    """
+
+    def __init__(
+        self,
+        freq: float = 1,
+        tolerance_2: float = 0.10,
+        tolerance_24: float = 0.05,
+        columns: Sequence[str] = reference_columns,
+    ):
+        self.columns = list(columns)
+        self.windows = {
+            "2h": RollingMeanStd(pd.Timedelta(2, "h"), int(freq * tolerance_2 * 2 * 60 * 60), len(self.columns)),
+            "24h": RollingMeanStd(pd.Timedelta(24, "h"), int(freq * tolerance_24 * 24 * 60 * 60), len(self.columns)),
+        }
+
+    @property
+    def output_columns(self):
+        """Names of the reference values, in order of `data.compute_reference_values`."""
+        return [
+            f"{c}_{window}_{stat}" for window in self.windows for stat in ["mean", "std"] for c in self.columns
+        ]
+
+    def update(self, timestamp, values) -> Dict[str, float]:
+        """
+        Add a sample, returns the reference values at the time of the sample.
+
+        Parameters
+        ----------
+        timestamp : pd.Timestamp or np.datetime64
+            Time of the sample, should not be before the previous sample.
+        values : array-like or dict
+            Values of the sample in order of `columns`, or keyed by column. Missing values as NaN.
+
+        Returns
+        -------
+        dict
+            Reference values keyed as `output_columns` (e.g. 'HR_2h_mean').
+        """
+        if isinstance(values, dict):
+            values = [values.get(c, np.nan) for c in self.columns]
+        values = np.array(values, dtype=float)
+        result = {}
+        for window, rolling in self.windows.items():
+            mean, std = rolling.update(timestamp, values)
+            result.update({f"{c}_{window}_mean": m for c, m in zip(self.columns, mean)})
+            result.update({f"{c}_{window}_std": s for c, s in zip(self.columns, std)})
+        return {k: result[k] for k in self.output_columns}
+
+    def update_many(self, timestamps, values: np.ndarray) -> np.ndarray:
+        """
+        Add a block of samples, returns the reference values at the time of each sample.
+
+        Parameters
+        ----------
+        timestamps : array-like of datetime
+            Times of the samples, in chronological order and not before the previous sample.
+        values : np.ndarray
+            Values of shape (n_samples, n_columns), missing values as NaN.
+
+        Returns
+        -------
+        np.ndarray
+            Reference values of shape (n_samples, len(output_columns)).
+        """
+        results = []
+        for rolling in self.windows.values():
+            results.extend(rolling.update_many(timestamps, values))
+        return np.concatenate(results, axis=1)
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the samples of a DataFrame, and add the reference values to it as columns.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            DataFrame with a DatetimeIndex in chronological order, containing `columns`.
+
+        Returns
+        -------
+        pd.DataFrame
+            `df` with additional columns `output_columns`.
+        """
+        df[self.output_columns] = self.update_many(
+            df.index, df[self.columns].to_numpy(dtype=float)
+        )
+        return df
@@ -0,0 +1,349 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.special import stdtr
+
+from sleepwellbaby.eligibility import (
+    age_eligibility_array,
+    data_eligibility_array,
+    reference_eligibility_array,
+)
+from sleepwellbaby.model import get_model, ineligible_proba, process_prediction
+from sleepwellbaby.preprocess import (
+    feature_positions,
+    lookback_windows,
+    rescaled_parameters,
+    vitals_freq,
+)
+from sleepwellbaby.reference import ReferenceValues
+
+session_parameters = ["HR", "RR", "OS"]
+n_window_samples = int(max(lookback_windows) * vitals_freq)
+resync_interval = n_window_samples  # recompute cached sums from the buffer every n samples
+sample_interval = pd.Timedelta(seconds=1 / vitals_freq)
+
+
+class PatientSession:
+    """
+    Streaming prediction session of a single patient.
+
+    Keeps the last 192 samples of each parameter in a ring buffer, so each new sample
+    (every 2.5 seconds) can be added without resending the full payload. For each of
+    the `preprocess.lookback_windows`, the count, sum, sum of squares and sum of
+    rank times value of the (non-missing) samples are updated incrementally, from which
+    mean, variance and linear trend follow in closed form. The rescaling based on
+    ref24h values (see `preprocess.ref24h_correction`) is applied to these statistics
+    afterwards, so reference values may change with every sample.
+
+    A session is equivalent to a payload whose values are the last 192 samples,
+    padded with missing values (-1) while fewer samples have been added. Samples
+    skipped between two timestamps are added as missing values, after a gap longer
+    than the window the buffer is reset.
+
+    Parameters
+    ----------
+    birth_date : str
+        Birth date of the patient, format 'yyyy-mm-dd'.
+    gestation_period : int
+        Gestation period of the patient in days.
+    model : BaseEstimator, optional
+        Trained model, loaded with `model.get_model` if not provided.
+    model_support_dict : dict, optional
+        Model meta information, loaded with `model.get_model` if not provided.
+    """
+
+    def __init__(self, birth_date: str, gestation_period: int, model=None, model_support_dict=None):
+        if (model is None) | (model_support_dict is None):
+            model, model_support_dict = get_model()
+        self.model = model
+        self.model_support_dict = model_support_dict
+        self.birth_date = birth_date
+        self.gestation_period = gestation_period
+        self.timestamp = None
+        self.references = None
+        self.lock = threading.Lock()  # held by callers sharing the session between threads
+        self.reference_values = ReferenceValues(freq=vitals_freq, columns=session_parameters)
+
+        self.window_sizes = np.array([int(w * vitals_freq) for w in lookback_windows])
+        self.rescaled = np.array([p in rescaled_parameters for p in session_parameters])
+        self.reset()
+
+        # Position in Xcol of each feature per window and parameter, -1 if not used by the model
+        self.feature_columns = list(model_support_dict["Xcol"])
+        self.feature_positions = feature_positions(self.feature_columns, session_parameters)
+
+    def reset(self):
+        """Empty the ring buffer, reference values and the timestamp are kept."""
+        self.values = np.full((len(session_parameters), n_window_samples), -1.0)
+        self.position = 0  # position of the oldest sample in the ring buffer
+        self.n_appended = 0
+        # Values are shifted to limit loss of precision in the cached sums
+        self.shift = np.zeros(len(session_parameters))
+        self.resync()
+
+    def valid(self, v: np.ndarray) -> np.ndarray:
+        """Mask of samples used for the features, missing values are only removed for rescaled parameters."""
+        rescaled = self.rescaled.reshape((-1,) + (1,) * (np.ndim(v) - 1))
+        return ~rescaled | (v > 1e-10)
+
+    def buffer(self) -> np.ndarray:
+        """All samples per parameter, oldest first."""
+        return np.roll(self.values, -self.position, axis=1)
+
+    def window(self, n: int) -> np.ndarray:
+        """Last `n` samples per parameter, oldest first."""
+        ix = (self.position + np.arange(n_window_samples - n, n_window_samples)) % n_window_samples
+        return self.values[:, ix]
+
+    def resync(self):
+        """Recompute the cached sums of all lookback windows from the buffer."""
+        n_windows, n_parameters = len(lookback_windows), len(session_parameters)
+        self.sums = np.zeros((4, n_windows, n_parameters))  # count, sum, sum of squares, sum of rank * value
+        for i, n in enumerate(self.window_sizes):
+            v = self.window(n)
+            valid = self.valid(v)
+            y = np.where(valid, v - self.shift[:, None], 0.0)
+            rank = np.cumsum(valid, axis=1) - 1
+            self.sums[:, i] = [valid.sum(axis=1), y.sum(axis=1), (y * y).sum(axis=1), (rank * y).sum(axis=1)]
+
+    def append(self, timestamp, values: dict, references: Optional[dict] = None):
+        """
+        Add a sample of each parameter.
+
+        Samples are expected every 2.5 seconds, skipped samples are added as missing values
+        and the buffer is reset if more than a window of samples is skipped.
+
+        Parameters
+        ----------
+        timestamp : pd.Timestamp or str
+            Time of the sample, after the previous sample. The date is used as observation date.
+        values : dict
+            Values keyed by payload key (e.g. 'param_HR'), missing values as None, NaN, 0 or -1.
+            Infinite values are treated as missing.
+        references : dict, optional
+            Reference values structured as in a payload (e.g. references['param_HR']['ref24h_mean']).
+            If not provided, reference values are computed from the samples added to the session
+            without references, so references should either always or never be provided.
+        """
+        timestamp = pd.Timestamp(timestamp)
+        if self.timestamp is not None and timestamp <= self.timestamp:
+            raise ValueError(f"Timestamps should be increasing, got {timestamp} after {self.timestamp}.")
+        n_skipped = 0 if self.timestamp is None else max(round((timestamp - self.timestamp) / sample_interval) - 1, 0)
+        v = np.array([values.get(f"param_{p}") for p in session_parameters], dtype=float)
+        v = np.where(np.isfinite(v), v, -1.0)
+        if references is None:
+            computed = self.reference_values.update(timestamp, np.where(v > 0, v, np.nan))
+            references = {
+                f"param_{p}": {
+                    f"ref{w}_{stat}": computed[f"{p}_{w}_{stat}"] for w in ["2h", "24h"] for stat in ["mean", "std"]
+                }
+                for p in session_parameters
+            }
+        self.references = references
+        self.timestamp = timestamp
+
+        if n_skipped >= n_window_samples - 1:
+            self.reset()
+        else:
+            for _ in range(n_skipped):
+                self.push(np.full(len(session_parameters), -1.0))
+        self.push(v)
+
+    def push(self, v: np.ndarray):
+        """Add values `v` of each parameter to the ring buffer and update the cached sums."""
+        if self.n_appended == 0:
+            self.shift = np.where(self.valid(v) & (v > 0), v, 0.0)
+        oldest = self.values[:, self.position].copy()
+        self.values[:, self.position] = v
+        self.position = (self.position + 1) % n_window_samples
+        self.n_appended += 1
+        if self.n_appended % resync_interval == 0 or self.n_appended == 1:
+            self.resync()
+            return
+
+        # Samples leaving each window, the buffer is padded with -1 at start
+        for i, n in enumerate(self.window_sizes):
+            leaving = oldest if n == n_window_samples else self.window(n + 1)[:, 0]
+            self.update_window(i, leaving, v)
+
+    def update_window(self, i: int, leaving: np.ndarray, entering: np.ndarray):
+        """Update cached sums of window `i` when a sample leaves and a new sample enters."""
+        count, total, squares, ranked = self.sums[:, i]
+        # Leaving sample has rank 0, ranks of the remaining samples decrease by one
+        y = np.where(self.valid(leaving), leaving - self.shift, 0.0)
+        leave = self.valid(leaving)
+        count -= leave
+        total -= y
+        squares -= y * y
+        ranked -= leave * total
+        # Entering sample has rank count
+        y = np.where(self.valid(entering), entering - self.shift, 0.0)
+        ranked += count * y
+        count += self.valid(entering)
+        total += y
+        squares += y * y
+        self.sums[:, i] = [count, total, squares, ranked]
+
+    def to_payload(self) -> dict:
+        """Payload equivalent of the session, as accepted by `model.get_prediction`."""
+        values = self.buffer()
+        payload = {
+            "birth_date": self.birth_date,
+            "gestation_period": self.gestation_period,
+            "observation_date": None if self.timestamp is None else str(self.timestamp.date()),
+        }
+        for i, p in enumerate(session_parameters):
+            payload[f"param_{p}"] = {**self.references[f"param_{p}"], "values": values[i].tolist()}
+        return payload
+
+    def features(self) -> pd.DataFrame:
+        """Features of the current windows, ready for prediction."""
+        count, total, squares, ranked = self.sums
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ymean = total / count
+            xmean = (count - 1) / 2
+            ssxm = (count * count - 1) / 12
+            ssym = squares / count - ymean * ymean
+            ssxym = ranked / count - xmean * ymean
+
+            # Order statistics are calculated from the buffer
+            median, minimum, maximum = [np.empty_like(count) for _ in range(3)]
+            for i, n in enumerate(self.window_sizes):
+                v = self.window(n)
+                v = np.sort(np.where(self.valid(v), v - self.shift[:, None], np.nan), axis=1)
+                k = count[i].astype(int)
+                rows = np.arange(len(k))
+                lo, hi = np.maximum((k - 1) // 2, 0), np.maximum(k // 2, 0)
+                median[i] = (v[rows, lo] + v[rows, hi]) / 2
+                minimum[i] = v[rows, 0]
+                maximum[i] = v[rows, np.maximum(k - 1, 0)]
+            constant = (ssxm == 0) | (maximum == minimum)
+            ssym = np.where(maximum == minimum, 0.0, np.maximum(ssym, 0.0))
+            r = np.clip(np.where(constant, 0.0, ssxym / np.sqrt(ssxm * ssym)), -1.0, 1.0)
+            slope = ssxym / ssxm
+            intercept = ymean - slope * xmean
+
+            dof = count - 2.0
+            tiny = 1.0e-20
+            t = r * np.sqrt(dof / ((1.0 - r + tiny) * (1.0 + r + tiny)))
+            pvalue = 2 * stdtr(dof, -np.abs(t))
+            pvalue = np.where(count == 2, np.where(ssym == 0, 1.0, 0.0), pvalue)
+            pvalue = np.where(count < 2, np.nan, pvalue)
+
+            # Undo the shift, and rescale based on ref24h values
+            offset = self.shift.copy()
+            scale = np.ones(len(session_parameters))
+            for j, p in enumerate(session_parameters):
+                if self.rescaled[j]:
+                    ref = self.references[f"param_{p}"]
+                    offset[j] -= ref["ref24h_mean"]
+                    scale[j] = 1.0 if ref["ref24h_std"] == 0 else ref["ref24h_std"]
+            empty = count == 0
+            stats = {
+                "median": (median + offset) / scale,
+                "mean": (ymean + offset) / scale,
+                "variance": ssym / scale ** 2,
+                "maximum": (maximum + offset) / scale,
+                "minimum": (minimum + offset) / scale,
+                'linear_trend__attr_"pvalue"': pvalue,
+                'linear_trend__attr_"rvalue"': r,
+                'linear_trend__attr_"intercept"': (intercept + offset) / scale,
+                'linear_trend__attr_"slope"': slope / scale,
+            }
+
+        row = np.full(len(self.feature_columns) + 1, np.nan)  # last element for unused features
+        for feature, stat in stats.items():
+            row[self.feature_positions[feature]] = np.where(empty, np.nan, stat)
+        return pd.DataFrame(row[None, :-1], columns=self.feature_columns)
+
+    def eligible(self) -> bool:
+        """Check eligibility of the current windows, see `eligibility.check_eligibility`."""
+        if self.timestamp is None:
+            return False
+        references = {k: {i: np.asarray(r) for i, r in v.items()} for k, v in self.references.items()}
+        if np.isnan([r for v in references.values() for r in v.values()]).any():
+            return False
+        return bool(
+            age_eligibility_array(self.birth_date, self.gestation_period, np.datetime64(self.timestamp.date()))
+            & data_eligibility_array(self.buffer())
+            & reference_eligibility_array(references)
+        )
+
+    def predict(self) -> Tuple[str, Dict[str, float]]:
+        """Predict on the current windows, returns prediction and probabilities as `model.get_prediction`."""
+        if not self.eligible():
+            return "ineligible", dict(ineligible_proba)
+        pred_proba = self.model.predict_proba(self.features())
+        return process_prediction(pred_proba, self.model.classes_)
+
+    def append_and_predict(
+        self, timestamp, values: dict, references: Optional[dict] = None
+    ) -> Tuple[str, Dict[str, float]]:
+        """Add a sample with `append`, and predict with `predict`."""
+        self.append(timestamp, values, references)
+        return self.predict()
+
+
+class SessionStore:
+    """
+    Thread-safe store of a `PatientSession` per patient, with idle expiry.
+
+    The store is locked only to look up or add a session, samples are added to a session
+    while holding its own `PatientSession.lock`. Sessions are removed when no sample was
+    added for `ttl` seconds, or when the store holds `maxsize` sessions and a new session
+    is added (least recently used first).
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        Maximum number of sessions. Default is 1024.
+    ttl : float, optional
+        Seconds after which an idle session expires, None to keep sessions until evicted
+        by size. Default is 3600.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, patient_id: Hashable, birth_date: str, gestation_period: int, model=None, model_support_dict=None
+    ) -> PatientSession:
+        """Session of a patient, a new session if there is none or if it is of another birth date or gestation period."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.get(patient_id)
+            if entry is None or (entry[1].birth_date, entry[1].gestation_period) != (birth_date, gestation_period):
+                entry = (now, PatientSession(birth_date, gestation_period, model, model_support_dict))
+            self._sessions[patient_id] = (now, entry[1])
+            self._sessions.move_to_end(patient_id)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+            return entry[1]
+
+    def pop(self, patient_id: Hashable) -> Optional[PatientSession]:
+        """Remove and return the session of a patient, None if there is none."""
+        with self._lock:
+            entry = self._sessions.pop(patient_id, None)
+        return None if entry is None else entry[1]
+
+    def _expire(self, now: float):
+        """Remove idle sessions, the least recently used sessions are first."""
+        while self.ttl is not None and self._sessions:
+            patient_id, (last_used, _) = next(iter(self._sessions.items()))
+            if now - last_used < self.ttl:
+                break
+            del self._sessions[patient_id]
+
+    def __contains__(self, patient_id: Hashable) -> bool:
+        return patient_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
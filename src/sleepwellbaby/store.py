@@ -0,0 +1,397 @@
+"""
+Columnar on-disk store of SignalBase recordings, read with memory-mapped windows.
+
+A recording of a patient is a directory with the samples on a regular grid (1 Hz or 0.4 Hz)
+starting at an origin timestamp, as raw little-endian arrays:
+
+    meta.json         origin, frequency, number of samples, columns, birth date, gestation period
+    values.f32        float32 values of shape (n_samples, n_columns), NaN if missing
+    present.u8        1 if the sample is in the recording, 0 for gaps in the grid
+    references.f32    float32 reference values of shape (n_samples, 12) at each sample, in order of
+                      `reference.ReferenceValues.output_columns`
+
+Recordings are written in blocks with `RecordingWriter`, which computes the reference values
+with `reference.ReferenceValues`, so a recording never has to be in memory as a whole. meta.json
+is written last, a directory without it is an incomplete recording and is not read. `Recording`
+memory-maps the arrays and reads only the windows and reference values it predicts on, e.g.:
+
+    write_recordings("store", generate_mock_signalbase_data(), birth_date="2000-01-01", gestation_period=210)
+    for patient_id, recording in read_recordings("store"):
+        df_pred = recording.predict()
+
+Values are stored as float32, so probabilities can differ from predictions on the float64
+DataFrame (`utils.get_swb_predictions`) in the order of 1e-6.
+"""
+import json
+import os
+from typing import Any, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from sleepwellbaby.model import get_model
+from sleepwellbaby.preprocess import reference_keys
+from sleepwellbaby.reference import ReferenceValues, reference_columns
+from sleepwellbaby.utils import (
+    check_missing_positions,
+    get_window_timestamps,
+    n_window_samples,
+    predict_windows,
+    split_patients,
+    window_columns,
+    window_length,
+)
+
+store_version = 1
+# Time between samples in nanoseconds per frequency
+sample_periods = {"S": 1_000_000_000, "2s500ms": 2_500_000_000}
+
+
+class RecordingWriter:
+    """
+    Writes a recording of a patient in blocks of samples, see `Recording` for the format.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the recording, created if it does not exist. Existing files are overwritten,
+        meta.json is removed until the writer is closed.
+    origin : pd.Timestamp or str
+        Timestamp of the first sample of the grid, all samples should be on the grid.
+    freq : str, optional
+        Frequency of the samples, 'S' (default) or '2s500ms'.
+    birth_date : str, optional
+        Birth date ('yyyy-mm-dd'), used by `Recording.predict`.
+    gestation_period : int, optional
+        Gestation period in days, used by `Recording.predict`.
+    tolerance_2 : float, optional
+        See `data.compute_reference_values`. Default is 0.10.
+    tolerance_24 : float, optional
+        See `data.compute_reference_values`. Default is 0.05.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        origin: Union[pd.Timestamp, str],
+        freq: str = "S",
+        birth_date: Optional[str] = None,
+        gestation_period: Optional[int] = None,
+        tolerance_2: float = 0.10,
+        tolerance_24: float = 0.05,
+    ):
+        if freq not in sample_periods:
+            raise ValueError(f"freq must be one of {list(sample_periods)}, got {freq}.")
+        self.path = path
+        self.origin = pd.Timestamp(origin)
+        self.freq = freq
+        self.period = sample_periods[freq]
+        self.birth_date = birth_date
+        self.gestation_period = gestation_period
+        self.n_samples = 0
+        self.reference_values = ReferenceValues(1e9 / self.period, tolerance_2, tolerance_24)
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, "meta.json")):
+            os.remove(os.path.join(path, "meta.json"))
+        self._files = {name: open(os.path.join(path, name), "wb") for name in Recording.files}
+
+    def append(self, timestamps: Iterable, values: np.ndarray):
+        """
+        Add a block of samples, after the samples added before.
+
+        Parameters
+        ----------
+        timestamps : array-like of datetime
+            Times of the samples, strictly increasing and on the grid of `origin` and `freq`.
+        values : np.ndarray
+            Values of shape (n_samples, 3) in order of `reference.reference_columns`, NaN if missing.
+
+        Raises
+        ------
+        ValueError
+            If a timestamp is not on the grid, or not after the previous sample.
+        """
+        timestamps = pd.DatetimeIndex(timestamps)
+        if len(timestamps) == 0:
+            return
+        offsets = timestamps.asi8 - self.origin.value
+        positions = offsets // self.period
+        if (offsets % self.period).any():
+            raise ValueError(f"Timestamps are not on the grid of {self.freq} from {self.origin}.")
+        if positions[0] < self.n_samples or (np.diff(positions) <= 0).any():
+            raise ValueError("Timestamps should be strictly increasing and after the previous block.")
+
+        values = np.asarray(values, dtype=float)
+        n = positions[-1] + 1 - self.n_samples
+        positions = positions - self.n_samples
+        block = np.full((n, len(reference_columns)), np.nan, dtype="<f4")
+        block[positions] = values
+        present = np.zeros(n, dtype="u1")
+        present[positions] = 1
+        # Gaps in the grid have no reference values, as with a DataFrame without these rows
+        references = np.full((n, len(self.reference_values.output_columns)), np.nan, dtype="<f4")
+        references[positions] = self.reference_values.update_many(timestamps, values)
+
+        self._files["values.f32"].write(block.tobytes())
+        self._files["present.u8"].write(present.tobytes())
+        self._files["references.f32"].write(references.tobytes())
+        self.n_samples += n
+
+    def close(self):
+        """Close the files and write the meta information, which completes the recording."""
+        self.abort()
+        meta = {
+            "version": store_version,
+            "origin": self.origin.isoformat(),
+            "freq": self.freq,
+            "n_samples": int(self.n_samples),
+            "columns": list(reference_columns),
+            "reference_columns": self.reference_values.output_columns,
+            "birth_date": self.birth_date,
+            "gestation_period": self.gestation_period,
+        }
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def abort(self):
+        """Close the files without writing the meta information, e.g. after an error."""
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class Recording:
+    """
+    Memory-mapped recording of a patient, as written by `RecordingWriter`.
+
+    Only the pages of the windows and reference values that are read are loaded,
+    so a recording does not have to fit in memory.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the recording.
+    """
+
+    files = ["values.f32", "present.u8", "references.f32"]
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != store_version:
+            raise ValueError(f"Unsupported store version {self.meta['version']}, expected {store_version}.")
+        self.origin = pd.Timestamp(self.meta["origin"])
+        self.freq = self.meta["freq"]
+        self.period = sample_periods[self.freq]
+        self.n_samples = self.meta["n_samples"]
+        self.columns = self.meta["columns"]
+        self.reference_columns = self.meta["reference_columns"]
+        self.values = self._map("values.f32", "<f4", (self.n_samples, len(self.columns)))
+        self.present = self._map("present.u8", "u1", (self.n_samples,))
+        self.references = self._map("references.f32", "<f4", (self.n_samples, len(self.reference_columns)))
+        # Position of the reference values per parameter in order of `window_columns`, per `reference_keys`
+        self._reference_positions = np.array([
+            [self.reference_columns.index(f"{c}_{key[len('ref'):]}") for key in reference_keys]
+            for c in window_columns.values()
+        ])
+        self._value_positions = [self.columns.index(c) for c in window_columns.values()]
+
+    def _map(self, name: str, dtype: str, shape: tuple) -> np.ndarray:
+        if shape[0] == 0:
+            # Empty files cannot be memory-mapped
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r", shape=shape)
+
+    def __len__(self) -> int:
+        return self.n_samples
+
+    @property
+    def start(self) -> pd.Timestamp:
+        """Timestamp of the first sample."""
+        return self.origin
+
+    @property
+    def end(self) -> pd.Timestamp:
+        """Timestamp of the last sample."""
+        return self.origin + pd.Timedelta(self.period * (self.n_samples - 1), "ns")
+
+    def positions(self, timestamps: Iterable) -> np.ndarray:
+        """Positions of `timestamps` in the arrays, -1 if not on the grid or not in the recording."""
+        offsets = pd.DatetimeIndex(timestamps).asi8 - self.origin.value
+        positions = offsets // self.period
+        valid = (offsets % self.period == 0) & (positions >= 0) & (positions < self.n_samples)
+        positions = np.where(valid, positions, -1)
+        positions[valid] = np.where(self.present[positions[valid]] == 1, positions[valid], -1)
+        return positions
+
+    def to_frame(self, start=None, end=None) -> pd.DataFrame:
+        """
+        Samples from `start` up to and including `end` as a DataFrame.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Indexed by datetime, with the values and reference values as float64 columns,
+            as `data.compute_reference_values`. Gaps in the grid are left out.
+        """
+        first = 0 if start is None else max(-(-(pd.Timestamp(start).value - self.origin.value) // self.period), 0)
+        last = self.n_samples if end is None else (pd.Timestamp(end).value - self.origin.value) // self.period + 1
+        positions = np.arange(first, min(last, self.n_samples))
+        positions = positions[self.present[positions] == 1]
+        index = pd.DatetimeIndex(self.origin.value + positions * self.period, name="datetime")
+        data = np.concatenate([self.values[positions], self.references[positions]], axis=1)
+        return pd.DataFrame(data.astype(float), index=index, columns=self.columns + self.reference_columns)
+
+    def windows(
+        self, indices: Iterable[pd.Timestamp], missing_index_threshold: float = 0.1
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Windows of values and reference values for each timestamp in `indices`.
+
+        Parameters
+        ----------
+        indices : iterable of pandas.Timestamp
+            Timestamps of the last sample of the windows.
+        missing_index_threshold : float, optional
+            See `utils.get_window_positions`. Default is 0.1.
+
+        Returns
+        -------
+        tuple of np.ndarray
+            values : Values of shape (n_indices, 3, 192) in order of `utils.window_columns`, -1 if missing.
+            references : Reference values of shape (n_indices, 3, 4) in order of `reference_keys`.
+            available : Boolean array of shape (n_indices,), False if a reference value is missing.
+        """
+        indices = pd.DatetimeIndex(indices)
+        positions = self.positions(get_window_timestamps(indices, self.freq))
+        positions = positions.reshape(len(indices), n_window_samples)
+        check_missing_positions(positions, missing_index_threshold)
+
+        values = self.values[positions][..., self._value_positions].astype(float).transpose(0, 2, 1)
+        values[np.broadcast_to((positions == -1)[:, None], values.shape) | np.isnan(values)] = -1
+        last = positions[:, -1]
+        references = np.full((len(indices), len(self.reference_columns)), np.nan)
+        references[last != -1] = self.references[last[last != -1]]
+        available = ~np.isnan(references).any(axis=1)
+        return values, references[:, self._reference_positions], available
+
+    def default_indices(self) -> pd.DatetimeIndex:
+        """Whole minutes of the recording, starting once a full window of data is available."""
+        return pd.date_range(start=(self.start + window_length).ceil("min"), end=self.end.floor("min"), freq="1min")
+
+    def predict(
+        self,
+        indices: Optional[Iterable[pd.Timestamp]] = None,
+        birth_date: Optional[str] = None,
+        gestation_period: Optional[int] = None,
+        missing_index_threshold: float = 0.1,
+        chunk_size: int = 1440,
+        model=None,
+        model_support_dict=None,
+    ) -> pd.DataFrame:
+        """
+        SWB predictions of the windows of `indices`, as `utils.compute_swb_predictions`.
+
+        Windows are read and predicted in chunks of `chunk_size` timestamps, so memory use
+        is bounded by the chunk size. Birth date and gestation period default to those of the recording.
+
+        Returns
+        -------
+        pandas.DataFrame
+            DataFrame indexed by `indices`, with column 'prediction' and a column per class
+            with its probability ('ineligible' and -1 for ineligible windows).
+        """
+        if (model is None) | (model_support_dict is None):
+            model, model_support_dict = get_model()
+        birth_date = birth_date or self.meta["birth_date"]
+        gestation_period = gestation_period or self.meta["gestation_period"]
+        if birth_date is None or gestation_period is None:
+            raise ValueError("birth_date and gestation_period are not stored with the recording.")
+        indices = self.default_indices() if indices is None else pd.DatetimeIndex(indices)
+        results = []
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            values, references, available = self.windows(chunk, missing_index_threshold)
+            results.append(predict_windows(
+                values, references, available, chunk, birth_date, gestation_period, model, model_support_dict
+            ))
+        if not results:
+            return pd.DataFrame(columns=["prediction", "AS", "QS", "W"], index=indices)
+        return pd.concat(results)
+
+
+def write_recording(
+    path: str,
+    df: pd.DataFrame,
+    freq: str = "S",
+    birth_date: Optional[str] = None,
+    gestation_period: Optional[int] = None,
+    chunk_size: int = 86400,
+):
+    """
+    Write a recording of a patient, as `RecordingWriter` in blocks of `chunk_size` samples.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the recording.
+    df : pandas.DataFrame
+        Columns HR, RESP and SpO2, indexed by datetime or with a 'datetime' column.
+    freq, birth_date, gestation_period
+        See `RecordingWriter`.
+    chunk_size : int, optional
+        Number of rows per block. Default is 86400 (a day at 1 Hz).
+    """
+    if not isinstance(df.index, pd.DatetimeIndex):
+        df = df.set_index("datetime")
+    with RecordingWriter(path, df.index[0] if len(df) else pd.Timestamp(0), freq, birth_date, gestation_period) as writer:
+        for start in range(0, len(df), chunk_size):
+            block = df.iloc[start:start + chunk_size]
+            writer.append(block.index, block[reference_columns].to_numpy(dtype=float))
+
+
+def write_recordings(
+    root: str,
+    data: Union[pd.DataFrame, List[pd.DataFrame]],
+    freq: str = "S",
+    birth_date: Optional[Union[str, dict]] = None,
+    gestation_period: Optional[Union[int, dict]] = None,
+    id_column: str = "ID",
+) -> List[Any]:
+    """
+    Write a recording per patient to `<root>/<patient id>`, see `utils.split_patients` and `write_recording`.
+
+    Birth date and gestation period are of all patients, or per patient id.
+
+    Returns
+    -------
+    list
+        Patient ids in order of `data`.
+    """
+    patient_ids = []
+    for patient_id, df in split_patients(data, id_column):
+        write_recording(
+            os.path.join(root, str(patient_id)),
+            df,
+            freq,
+            birth_date[patient_id] if isinstance(birth_date, dict) else birth_date,
+            gestation_period[patient_id] if isinstance(gestation_period, dict) else gestation_period,
+        )
+        patient_ids.append(patient_id)
+    return patient_ids
+
+
+def read_recordings(root: str) -> Iterator[Tuple[str, Recording]]:
+    """Yield (patient id, `Recording`) of each recording in `root`, in order of patient id."""
+    for name in sorted(os.listdir(root)):
+        if os.path.isfile(os.path.join(root, name, "meta.json")):
+            yield name, Recording(os.path.join(root, name))
@@ -0,0 +1,259 @@
+"""
+Streaming SWB predictions from chunks of SignalBase exports (CSV or Parquet).
+
+Exports are read in chunks of rows (`read_chunks`), the 24-hour reference values and the
+last 8 minutes of data of each patient are carried across chunks (`StreamingPredictor`), so
+predictions are made as soon as their window is complete and memory use is bounded by the
+chunk size and the state per patient, not by the length of the recording, e.g.:
+
+    for df_pred in stream_predictions("export.csv", birth_date="2024-01-01", gestation_period=210):
+        ...
+    write_predictions("export.parquet", "predictions.csv", birth_date={1: "2024-01-01"}, gestation_period={1: 210})
+
+Predictions are made every whole minute, as in `utils.get_swb_predictions_parallel`, with
+reference values computed as `data.compute_reference_values(method='streaming')`.
+"""
+import os
+from typing import Any, Dict, Iterable, Iterator, Optional, Union
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = pq = None
+
+from sleepwellbaby.model import get_model
+from sleepwellbaby.reference import ReferenceValues, reference_columns
+from sleepwellbaby.utils import compute_swb_predictions, window_length
+
+# Sampling frequency in Hz per frequency of the data
+sample_frequencies = {"S": 1, "2s500ms": 0.4}
+prediction_columns = ["prediction", "AS", "QS", "W"]
+
+
+class StreamingPredictor:
+    """
+    SWB predictions of a patient from consecutive chunks of a recording.
+
+    Parameters
+    ----------
+    birth_date : str
+        Birth date ('yyyy-mm-dd').
+    gestation_period : int
+        Gestation period in days.
+    freq : str, optional
+        Frequency of the data, 'S' (default) or '2s500ms'.
+    missing_index_threshold : float, optional
+        See `utils.get_swb_predictions`. Default is 0.1.
+    tolerance_2 : float, optional
+        See `data.compute_reference_values`. Default is 0.10.
+    tolerance_24 : float, optional
+        See `data.compute_reference_values`. Default is 0.05.
+    model : BaseEstimator, optional
+        Trained model, loaded with `model.get_model` if not provided.
+    model_support_dict : dict, optional
+        Model meta information, loaded with `model.get_model` if not provided.
+    """
+
+    def __init__(
+        self,
+        birth_date: str,
+        gestation_period: int,
+        freq: str = "S",
+        missing_index_threshold: float = 0.1,
+        tolerance_2: float = 0.10,
+        tolerance_24: float = 0.05,
+        model=None,
+        model_support_dict=None,
+    ):
+        if freq not in sample_frequencies:
+            raise ValueError(f"freq must be one of {list(sample_frequencies)}, got {freq}.")
+        if (model is None) | (model_support_dict is None):
+            model, model_support_dict = get_model()
+        self.birth_date = birth_date
+        self.gestation_period = gestation_period
+        self.freq = freq
+        self.missing_index_threshold = missing_index_threshold
+        self.model = model
+        self.model_support_dict = model_support_dict
+        self.reference_values = ReferenceValues(sample_frequencies[freq], tolerance_2, tolerance_24)
+        # Samples of the last window (with reference values) and the next timestamp to predict
+        self.tail: Optional[pd.DataFrame] = None
+        self.next_index: Optional[pd.Timestamp] = None
+
+    def update(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the next chunk of the recording, returns the predictions of the windows completed by it.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            Columns HR, RESP and SpO2, indexed by datetime in chronological order, after
+            the previous chunk.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Predictions indexed by timestamp, as `utils.compute_swb_predictions`, of each
+            whole minute up to the last sample of `df`.
+        """
+        if len(df) == 0:
+            return pd.DataFrame(columns=prediction_columns, index=pd.DatetimeIndex([]))
+        if self.tail is not None and len(self.tail) and df.index[0] <= self.tail.index[-1]:
+            raise ValueError("Chunks should be in chronological order, without overlap.")
+        df = self.reference_values.transform(df[reference_columns].astype(float))
+        if self.next_index is None:
+            self.next_index = (df.index[0] + window_length).ceil("min")
+        data = df if self.tail is None else pd.concat([self.tail, df])
+        end = df.index[-1]
+        indices = pd.date_range(self.next_index, end.floor("min"), freq="1min")
+        # Windows of the next timestamps start after `end` - 8 minutes
+        self.tail = data.loc[end - window_length:]
+        if len(indices) == 0:
+            return pd.DataFrame(columns=prediction_columns, index=indices)
+        self.next_index = indices[-1] + pd.Timedelta(1, "min")
+        return compute_swb_predictions(
+            data,
+            indices,
+            self.birth_date,
+            self.gestation_period,
+            self.freq,
+            self.missing_index_threshold,
+            self.model,
+            self.model_support_dict,
+        )
+
+
+def read_chunks(path: str, chunk_size: int = 100_000, columns: Optional[list] = None) -> Iterator[pd.DataFrame]:
+    """
+    Read a CSV or Parquet file in chunks of `chunk_size` rows.
+
+    Parquet files are read with pyarrow, which is an optional dependency (`pip install sleepwellbaby[parquet]`).
+    The 'datetime' column is parsed as datetime.
+    """
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("Reading Parquet files requires pyarrow, install it with `pip install sleepwellbaby[parquet]`.")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            df = batch.to_pandas()
+            df["datetime"] = pd.to_datetime(df["datetime"])
+            yield df
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=columns, parse_dates=["datetime"])
+
+
+def stream_predictions(
+    data: Union[str, Iterable[pd.DataFrame]],
+    birth_date: Union[str, Dict[Any, str]],
+    gestation_period: Union[int, Dict[Any, int]],
+    freq: str = "S",
+    chunk_size: int = 100_000,
+    id_column: str = "ID",
+    **kwargs,
+) -> Iterator[pd.DataFrame]:
+    """
+    Yield SWB predictions per chunk of an export, with a `StreamingPredictor` per patient.
+
+    Parameters
+    ----------
+    data : str or iterable of pandas.DataFrame
+        Path of a CSV or Parquet file (see `read_chunks`), or chunks of rows with columns
+        'datetime', HR, RESP, SpO2 and `id_column` (as from `data.generate_mock_signalbase_data`).
+        Rows of a patient should be in chronological order, patients may be interleaved.
+    birth_date : str or dict
+        Birth date ('yyyy-mm-dd') of all patients, or per patient id.
+    gestation_period : int or dict
+        Gestation period in days of all patients, or per patient id.
+    freq : str, optional
+        Frequency of the data, 'S' (default) or '2s500ms'.
+    chunk_size : int, optional
+        Number of rows per chunk if `data` is a path. Default is 100000.
+    id_column : str, optional
+        Column identifying the patient. Default is 'ID'. Without this column, all rows
+        are of a single patient with id 0.
+    **kwargs
+        Other arguments of `StreamingPredictor`.
+
+    Yields
+    ------
+    pandas.DataFrame
+        Predictions completed by a chunk, with columns `id_column`, 'datetime', 'prediction'
+        and a column per class with its probability, as `utils.get_swb_predictions_parallel`.
+    """
+    if isinstance(data, str):
+        data = read_chunks(data, chunk_size)
+    if (kwargs.get("model") is None) | (kwargs.get("model_support_dict") is None):
+        kwargs["model"], kwargs["model_support_dict"] = get_model()
+    predictors: Dict[Any, StreamingPredictor] = {}
+    for chunk in data:
+        groups = chunk.groupby(id_column, sort=False) if id_column in chunk.columns else [(0, chunk)]
+        results = []
+        for patient_id, df in groups:
+            if patient_id not in predictors:
+                predictors[patient_id] = StreamingPredictor(
+                    birth_date[patient_id] if isinstance(birth_date, dict) else birth_date,
+                    gestation_period[patient_id] if isinstance(gestation_period, dict) else gestation_period,
+                    freq,
+                    **kwargs,
+                )
+            df_pred = predictors[patient_id].update(df.set_index("datetime"))
+            if len(df_pred):
+                df_pred.index.name = "datetime"
+                df_pred = df_pred.reset_index()
+                df_pred.insert(0, id_column, patient_id)
+                results.append(df_pred)
+        if results:
+            yield pd.concat(results, ignore_index=True)
+
+
+def write_predictions(
+    data: Union[str, Iterable[pd.DataFrame]], output: str, *args, overwrite: bool = False, **kwargs
+) -> int:
+    """
+    Write the predictions of `stream_predictions` to a CSV or Parquet file as they are made.
+
+    Parameters
+    ----------
+    data : str or iterable of pandas.DataFrame
+        See `stream_predictions`.
+    output : str
+        Path of the output file, Parquet if it ends with '.parquet' (requires pyarrow), CSV otherwise.
+    *args, **kwargs
+        Other arguments of `stream_predictions`.
+    overwrite : bool, optional
+        Replace `output` if it exists. Default is False.
+
+    Returns
+    -------
+    int
+        Number of predictions written.
+
+    Raises
+    ------
+    FileExistsError
+        If `output` exists and `overwrite` is False.
+    """
+    if output.endswith(".parquet") and pq is None:
+        raise ImportError("Writing Parquet files requires pyarrow, install it with `pip install sleepwellbaby[parquet]`.")
+    if os.path.exists(output):
+        if not overwrite:
+            raise FileExistsError(f"{output} exists, set overwrite=True to replace it.")
+        os.remove(output)
+    n_rows, writer = 0, None
+    try:
+        for df_pred in stream_predictions(data, *args, **kwargs):
+            df_pred[["AS", "QS", "W"]] = df_pred[["AS", "QS", "W"]].astype(float)
+            if output.endswith(".parquet"):
+                table = pa.Table.from_pandas(df_pred, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output, table.schema)
+                writer.write_table(table)
+            else:
+                df_pred.to_csv(output, mode="a", header=n_rows == 0, index=False)
+            n_rows += len(df_pred)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
@@ -1,10 +1,90 @@
-from typing import Iterable, List, Tuple
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
 from sleepwellbaby.data import convert_to_payload
-from sleepwellbaby.model import get_prediction, load_model
+from sleepwellbaby.eligibility import check_eligibility_batch
+from sleepwellbaby.model import get_model, get_prediction, return_y_pred
+from sleepwellbaby.preprocess import pipeline_arrays, reference_keys
+
+n_window_samples = 192  # number of samples in a window, 8 minutes at 0.4 Hz
+window_length = pd.Timedelta(8, 'min')
+window_columns = {"param_HR": "HR", "param_RR": "RESP", "param_OS": "SpO2"}
+
+# Model of a worker process of `get_swb_predictions_parallel`, loaded by `init_worker`
+worker_model = None
+worker_model_support_dict = None
+
+
+def get_window_positions(
+    index: pd.DatetimeIndex,
+    indices: Iterable[pd.Timestamp],
+    freq: str = 'S',
+    missing_index_threshold: float = 0.1
+) -> np.ndarray:
+    """
+    Find the positions in `index` of the SWB window timestamps for each timestamp in `indices`.
+
+    Parameters
+    ----------
+    index : pandas.DatetimeIndex
+        Index of the DataFrame containing the data.
+    indices : iterable of pandas.Timestamp
+        Timestamps at which to compute SWB predictions.
+    freq : str, optional
+        Frequency of the data, 'S' (default) or '2s500ms'. For 1Hz data the window
+        timestamps are rounded to whole seconds.
+    missing_index_threshold : float, optional
+        Maximum allowed fraction of missing timestamps in a window, default is 0.1.
+
+    Returns
+    -------
+    np.ndarray
+        Integer array of shape (n_indices, 192), -1 where a timestamp is missing from `index`.
+
+    Raises
+    ------
+    ValueError
+        If more than `missing_index_threshold` of the timestamps of a window are missing from `index`.
+    """
+    indices = pd.DatetimeIndex(indices)
+    timestamps = get_window_timestamps(indices, freq)
+    positions = index.get_indexer(timestamps).reshape(len(indices), n_window_samples)
+    check_missing_positions(positions, missing_index_threshold)
+    assert (timestamps[n_window_samples - 1::n_window_samples] == indices).all()
+    return positions
+
+
+def get_window_timestamps(indices: pd.DatetimeIndex, freq: str = 'S') -> pd.DatetimeIndex:
+    """Timestamps of the windows of `indices`, 192 per index, see `get_window_positions`."""
+    # One timestamp every 2.5 seconds in the 8 minutes up to and including the index
+    offsets = pd.to_timedelta(
+        np.arange(1 - n_window_samples, 1, dtype="int64") * 2_500_000_000, unit="ns"
+    )
+    timestamps = indices.repeat(n_window_samples) + np.tile(offsets, len(indices))
+    if freq == 'S':
+        timestamps = timestamps.round('1s')
+    return timestamps
+
+
+def check_missing_positions(positions: np.ndarray, missing_index_threshold: float = 0.1):
+    """Raise a ValueError if more than `missing_index_threshold` of the positions of a window are missing (-1)."""
+    n_missing = (positions == -1).sum(axis=1)
+    too_many_missing = np.flatnonzero(n_missing / n_window_samples > missing_index_threshold)
+    if len(too_many_missing) > 0:
+        raise ValueError(f"More than {missing_index_threshold*100}% of the timestamps missing from DataFrame index: n = {n_missing[too_many_missing[0]]}")
+
+
+def take_windows(df: pd.DataFrame, columns: List[str], positions: np.ndarray) -> np.ndarray:
+    """Take values of `columns` at `positions` (as from `get_window_positions`), NaN where missing."""
+    values = df[columns].to_numpy(dtype=float)[positions]
+    values[positions == -1] = np.nan
+    return values
 
 
 # Helper function to get predictions
@@ -14,7 +94,8 @@ def get_swb_predictions(
     birth_date: str,
     gestation_period: int,
     freq: str = 'S',
-    missing_index_threshold: float = 0.1
+    missing_index_threshold: float = 0.1,
+    vectorized: bool = True
 ) -> Tuple[pd.DataFrame, List[str]]:
     """
     Generate SleepWellBaby (SWB) predictions for specified timestamps in a DataFrame.
@@ -41,6 +122,10 @@ def get_swb_predictions(
         Maximum allowed fraction of missing timestamps in the window for a prediction to be attempted.
         If the fraction of missing timestamps exceeds this threshold, a ValueError is raised.
         Default is 0.1 (i.e., 10%).
+    vectorized : bool, optional
+        Compute windows, eligibility and features for chunks of timestamps at once (default,
+        see `compute_swb_predictions`), instead of looping over the timestamps and predicting
+        each payload separately. Both give the same predictions.
 
     Returns
     -------
@@ -55,7 +140,11 @@ def get_swb_predictions(
     - If any required reference columns are missing for a timestamp, the prediction is set to 'ineligible' and probabilities to -1.
     - If more than `missing_index_threshold` fraction of timestamps are missing from the DataFrame index for a given window, a ValueError is raised.
     """
-    model, model_support_dict = load_model()
+    if vectorized:
+        return get_swb_predictions_vectorized(
+            df, indices, birth_date, gestation_period, freq, missing_index_threshold
+        )
+    model, model_support_dict = get_model()
     ref_columns = [c for c in df.columns if ('mean' in c) or ('std' in c)]
     for ix, t in enumerate(tqdm(indices, desc="Calculating SWB")):
         # Get the right timestamps for SWB, one every 2.5 seconds
@@ -86,3 +175,315 @@ def get_swb_predictions(
         df.loc[t, 'prediction'] = pred
         df.loc[t, columns] = pd.DataFrame(proba_dict, index=[0,]).iloc[0]
     return df, columns
+
+
+def compute_swb_predictions(
+    df: pd.DataFrame,
+    indices: Iterable[pd.Timestamp],
+    birth_date: str,
+    gestation_period: int,
+    freq: str = 'S',
+    missing_index_threshold: float = 0.1,
+    model=None,
+    model_support_dict=None,
+    chunk_size: int = 1440,
+) -> pd.DataFrame:
+    """
+    Compute SWB predictions for the timestamps in `indices`, in chunks of `chunk_size` timestamps.
+
+    Per chunk, selects the windows with `get_window_positions`, checks eligibility
+    for all windows at once and predicts all eligible windows with a single model call.
+    The windows of a chunk are copied into an array of chunk_size x 3 x 192 values
+    (about 6.6 MB for the default chunk size of 1440), so memory use is bounded by the
+    chunk size rather than by the number of timestamps.
+    See `get_swb_predictions` for a description of the other parameters.
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame indexed by `indices`, with column 'prediction' and a column per class
+        with its probability ('ineligible' and -1 for ineligible windows).
+    """
+    if (model is None) | (model_support_dict is None):
+        model, model_support_dict = get_model()
+    indices = pd.DatetimeIndex(indices)
+    if len(indices) <= chunk_size:
+        return _compute_window_predictions(
+            df, indices, birth_date, gestation_period, freq, missing_index_threshold, model, model_support_dict
+        )
+    return pd.concat([
+        _compute_window_predictions(
+            df, indices[start:start + chunk_size], birth_date, gestation_period, freq, missing_index_threshold,
+            model, model_support_dict
+        )
+        for start in range(0, len(indices), chunk_size)
+    ])
+
+
+def _compute_window_predictions(
+    df: pd.DataFrame,
+    indices: pd.DatetimeIndex,
+    birth_date: str,
+    gestation_period: int,
+    freq: str,
+    missing_index_threshold: float,
+    model,
+    model_support_dict: dict,
+) -> pd.DataFrame:
+    """Predictions of the windows of all `indices` at once, see `compute_swb_predictions`."""
+    ref_columns = [c for c in df.columns if ('mean' in c) or ('std' in c)]
+    positions = get_window_positions(df.index, indices, freq, missing_index_threshold)
+
+    values = take_windows(df, list(window_columns.values()), positions).transpose(0, 2, 1)
+    values = np.nan_to_num(values, nan=-1)
+    row_positions = positions[:, -1:]
+    # Reference values of shape (n_windows, n_parameters, 4), in order of `reference_keys`
+    references = np.stack(
+        [
+            take_windows(df, [f"{c}_{key[len('ref'):]}" for key in reference_keys], row_positions)[:, 0]
+            for c in window_columns.values()
+        ],
+        axis=1,
+    )
+
+    # Windows without reference values are ineligible
+    eligible = ~np.isnan(take_windows(df, ref_columns, row_positions)[:, 0]).any(axis=1)
+    return predict_windows(
+        values, references, eligible, indices, birth_date, gestation_period, model, model_support_dict
+    )
+
+
+def predict_windows(
+    values: np.ndarray,
+    references: np.ndarray,
+    eligible: np.ndarray,
+    indices: pd.DatetimeIndex,
+    birth_date: str,
+    gestation_period: int,
+    model,
+    model_support_dict: dict,
+) -> pd.DataFrame:
+    """
+    Predict windows of values with a single model call, see `compute_swb_predictions`.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Values of shape (n_windows, n_parameters, 192) in order of `window_columns`, missing values as -1.
+    references : np.ndarray
+        Reference values of shape (n_windows, n_parameters, 4), in order of `reference_keys`.
+    eligible : np.ndarray
+        Boolean array of shape (n_windows,), False for windows without reference values,
+        eligibility is only checked for the other windows.
+    indices : pandas.DatetimeIndex
+        Timestamp of each window.
+    birth_date : str
+        Birth date ('yyyy-mm-dd').
+    gestation_period : int
+        Gestation period in days.
+    model : BaseEstimator or ArrayModel
+        Trained model.
+    model_support_dict : dict
+        Model meta information.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Predictions indexed by `indices`, as returned by `compute_swb_predictions`.
+    """
+    eligible = np.array(eligible, dtype=bool)
+    observation_dates = indices.normalize()
+    if observation_dates.tz is not None:
+        observation_dates = observation_dates.tz_localize(None)
+    eligible[eligible] = check_eligibility_batch(
+        values[eligible],
+        references[eligible],
+        birth_date,
+        gestation_period,
+        observation_dates.values[eligible],
+    )["eligible"]
+
+    columns = ["AS", "QS", "W"]
+    preds = np.full(len(indices), "ineligible", dtype=object)
+    probas = np.full((len(indices), len(columns)), -1, dtype=object)
+    if eligible.any():
+        features = pipeline_arrays(
+            values[eligible],
+            references[eligible][..., reference_keys.index("ref24h_mean")],
+            references[eligible][..., reference_keys.index("ref24h_std")],
+            model_support_dict,
+        )
+        pred_proba = model.predict_proba(features)
+        columns = list(model.classes_)
+        preds[eligible] = return_y_pred(pred_proba, model.classes_)
+        probas[eligible] = pred_proba
+
+    df_pred = pd.DataFrame(probas, index=indices, columns=columns)
+    df_pred.insert(0, 'prediction', preds)
+    return df_pred
+
+
+def get_swb_predictions_vectorized(
+    df: pd.DataFrame,
+    indices: Iterable[pd.Timestamp],
+    birth_date: str,
+    gestation_period: int,
+    freq: str = 'S',
+    missing_index_threshold: float = 0.1
+) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Vectorized implementation of `get_swb_predictions`, see there for details.
+
+    Predictions are computed with `compute_swb_predictions` and written to `df` as whole columns.
+    """
+    indices = pd.DatetimeIndex(indices)
+    df_pred = compute_swb_predictions(
+        df, indices, birth_date, gestation_period, freq, missing_index_threshold
+    )
+    columns = list(df_pred.columns[1:])
+
+    missing_indices = indices[~indices.isin(df.index)].unique()
+    if len(missing_indices) > 0:
+        # Rows are added for indices that do not occur in the DataFrame
+        df = df.reindex(df.index.append(missing_indices))
+    df.loc[:, 'prediction'] = None
+    df.loc[:, columns] = None
+    df.loc[indices, 'prediction'] = df_pred['prediction'].values
+    df.loc[indices, columns] = df_pred[columns].values
+    return df, columns
+
+
+def init_worker():
+    """Load the model once per worker process of `get_swb_predictions_parallel`."""
+    global worker_model, worker_model_support_dict
+    worker_model, worker_model_support_dict = get_model()
+
+
+def predict_chunk(task: dict) -> pd.DataFrame:
+    """Compute SWB predictions for a time chunk of a patient, see `get_swb_predictions_parallel`."""
+    if worker_model is None:
+        init_worker()
+    df_pred = compute_swb_predictions(
+        task["df"],
+        task["indices"],
+        task["birth_date"],
+        task["gestation_period"],
+        task["freq"],
+        task["missing_index_threshold"],
+        model=worker_model,
+        model_support_dict=worker_model_support_dict,
+    )
+    df_pred.index.name = 'datetime'
+    df_pred = df_pred.reset_index()
+    df_pred.insert(0, task["id_column"], task["patient_id"])
+    return df_pred
+
+
+def default_swb_indices(df: pd.DataFrame) -> pd.DatetimeIndex:
+    """Whole minutes of a recording, starting once a full window of data is available."""
+    return pd.date_range(
+        start=(df.index.min() + window_length).ceil('min'),
+        end=df.index.max().floor('min'),
+        freq='1min',
+    )
+
+
+def split_patients(
+    data: Union[pd.DataFrame, List[pd.DataFrame]], id_column: str = 'ID'
+) -> Iterator[Tuple[Any, pd.DataFrame]]:
+    """Yield (patient id, DataFrame indexed by datetime) for each patient in `data`."""
+    if isinstance(data, pd.DataFrame):
+        data = (df for _, df in data.groupby(id_column, sort=False))
+    for i, df in enumerate(data):
+        patient_id = df[id_column].iloc[0] if id_column in df.columns else i
+        if not isinstance(df.index, pd.DatetimeIndex):
+            df = df.set_index('datetime')
+        yield patient_id, df.sort_index()
+
+
+def get_swb_predictions_parallel(
+    data: Union[pd.DataFrame, List[pd.DataFrame]],
+    birth_date: Union[str, Dict[Any, str]],
+    gestation_period: Union[int, Dict[Any, int]],
+    indices: Optional[Dict[Any, Iterable[pd.Timestamp]]] = None,
+    freq: str = 'S',
+    missing_index_threshold: float = 0.1,
+    chunk_size: int = 1440,
+    n_jobs: Optional[int] = None,
+    id_column: str = 'ID'
+) -> pd.DataFrame:
+    """
+    Generate SWB predictions for multiple patients, distributed over multiple processes.
+
+    Each patient's timestamps are split into chunks of `chunk_size` timestamps, and each
+    chunk is predicted by `compute_swb_predictions` in a worker process, which loads the
+    model once. Only the data of a chunk (and the preceding window) is sent to a worker,
+    and at most two chunks per worker are in progress at any time.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame or list of pandas.DataFrame
+        DataFrame with data of multiple patients, identified by `id_column`
+        (as from `generate_mock_signalbase_data`), or a DataFrame per patient.
+        Should contain reference values (see `compute_reference_values`), and be
+        indexed by datetime or contain a 'datetime' column.
+    birth_date : str or dict
+        Birth date ('yyyy-mm-dd') of all patients, or per patient id.
+    gestation_period : int or dict
+        Gestation period in days of all patients, or per patient id.
+    indices : dict, optional
+        Timestamps at which to compute SWB predictions per patient id. By default
+        every whole minute from 8 minutes after the start of a patient's recording.
+    freq : str, optional
+        Frequency of the data, 'S' (default) or '2s500ms', see `get_swb_predictions`.
+    missing_index_threshold : float, optional
+        See `get_swb_predictions`. Default is 0.1.
+    chunk_size : int, optional
+        Number of timestamps per chunk. Default is 1440 (one day at one prediction per minute).
+    n_jobs : int, optional
+        Number of worker processes, defaults to the number of CPUs. With n_jobs=1
+        all chunks are predicted in the current process.
+    id_column : str, optional
+        Column identifying the patient. Default is 'ID'. For a list of DataFrames without
+        this column, the position in the list is used as id.
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame with columns `id_column`, 'datetime', 'prediction' and a column per class
+        with its probability, ordered by patient (in order of `data`) and timestamp.
+    """
+    n_jobs = n_jobs or os.cpu_count()
+
+    def tasks() -> Iterator[dict]:
+        for patient_id, df in split_patients(data, id_column):
+            ix = default_swb_indices(df) if indices is None else pd.DatetimeIndex(indices[patient_id])
+            for start in range(0, len(ix), chunk_size):
+                ix_chunk = ix[start:start + chunk_size]
+                yield {
+                    "patient_id": patient_id,
+                    "id_column": id_column,
+                    "df": df.loc[ix_chunk.min() - window_length:ix_chunk.max()].copy(),
+                    "indices": ix_chunk,
+                    "birth_date": birth_date[patient_id] if isinstance(birth_date, dict) else birth_date,
+                    "gestation_period": gestation_period[patient_id] if isinstance(gestation_period, dict) else gestation_period,
+                    "freq": freq,
+                    "missing_index_threshold": missing_index_threshold,
+                }
+
+    if n_jobs == 1:
+        results = [predict_chunk(task) for task in tasks()]
+    else:
+        results = []
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_worker) as executor:
+            # Bound the number of chunks in memory, results are collected in order of submission
+            pending = deque()
+            for task in tasks():
+                if len(pending) >= 2 * n_jobs:
+                    results.append(pending.popleft().result())
+                pending.append(executor.submit(predict_chunk, task))
+            results.extend(future.result() for future in pending)
+
+    if len(results) == 0:
+        return pd.DataFrame(columns=[id_column, 'datetime', 'prediction', 'AS', 'QS', 'W'])
+    return pd.concat(results, ignore_index=True)
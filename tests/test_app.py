@@ -1,6 +1,10 @@
 
 import json
 
+import numpy as np
+import pandas as pd
+
+from sleepwellbaby import version
 from sleepwellbaby.dashboard.app import app
 from sleepwellbaby.data import get_example_payload
 
@@ -28,3 +32,175 @@ def test_predict_endpoint():
     assert "valid_methods" in data
     assert "requested_method" in data
 
+
+def test_predict_batch_endpoint():
+    client = app.test_client()
+
+    payload = get_example_payload()
+    payload["observation_date"] = payload["birth_date"]
+    response = client.post("/predict", data=json.dumps(payload), content_type="application/json")
+    expected = response.get_json()
+
+    invalid_values = {**payload, "id": "invalid_values"}
+    invalid_values["param_HR"] = {**payload["param_HR"], "values": payload["param_HR"]["values"][:100]}
+    invalid_date = {**payload, "id": "invalid_date", "observation_date": "2000-01-01"}
+    ineligible = {**payload, "id": "ineligible", "gestation_period": 150}
+    nan_values = {**payload, "id": "nan_values"}
+    nan_values["param_RR"] = {**payload["param_RR"], "values": [float("nan")] + payload["param_RR"]["values"][1:]}
+    items = [
+        {**payload, "id": "valid"},
+        invalid_values,
+        {"id": "missing_fields"},
+        invalid_date,
+        ineligible,
+        nan_values,
+    ]
+    response = client.post("/predict_batch", data=json.dumps(items), content_type="application/json")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert "api_version" in data
+    results = data["predictions"]
+    assert [r["id"] for r in results] == [i["id"] for i in items]
+
+    assert results[0]["errors"] is None
+    for k in ["prediction", "AS", "QS", "W"]:
+        assert results[0][k] == expected[k]
+    assert "param_HR.values" in results[1]["errors"]
+    assert results[1]["prediction"] is None
+    assert "birth_date" in results[2]["errors"]
+    assert "observation_date" in results[3]["errors"]
+    assert results[4]["errors"] is None
+    assert results[4]["prediction"] == "ineligible"
+    assert "finite" in results[5]["errors"]["param_RR.values"]
+    assert results[5]["prediction"] is None
+
+    # Body should be a list
+    response = client.post("/predict_batch", data=json.dumps(payload), content_type="application/json")
+    assert response.status_code == 400
+
+
+def test_session_endpoint():
+    client = app.test_client()
+
+    payload = get_example_payload()
+    payload["observation_date"] = payload["birth_date"]
+    response = client.post("/predict", data=json.dumps(payload), content_type="application/json")
+    expected = response.get_json()
+
+    # Send the values of the example payload one by one
+    timestamps = pd.date_range(payload["birth_date"], periods=192, freq="2500ms")
+    references = {k: {i: v for i, v in payload[k].items() if i != "values"} for k in ["param_HR", "param_RR", "param_OS"]}
+    for i, t in enumerate(timestamps):
+        sample = {
+            "birth_date": payload["birth_date"],
+            "gestation_period": payload["gestation_period"],
+            "timestamp": t.isoformat(),
+            "references": references,
+            **{k: payload[k]["values"][i] for k in references},
+        }
+        response = client.post("/session/bed_1", data=json.dumps(sample), content_type="application/json")
+        assert response.status_code == 200
+    data = response.get_json()
+    assert data["prediction"] == expected["prediction"]
+    for k in ["AS", "QS", "W"]:
+        assert np.isclose(data[k], expected[k])
+
+    # Non-finite values are rejected, the session continues with the next samples
+    for value in [float("inf"), float("nan")]:
+        response = client.post(
+            "/session/bed_1", data=json.dumps({**sample, "param_HR": value}), content_type="application/json"
+        )
+        assert response.status_code == 400
+        assert "finite" in response.get_json()["errors"]["param_HR"]
+    for t in pd.date_range(timestamps[-1], periods=4, freq="2500ms")[1:]:
+        sample = {**sample, "timestamp": t.isoformat()}
+        response = client.post("/session/bed_1", data=json.dumps(sample), content_type="application/json")
+        assert response.status_code == 200
+        assert response.get_json()["prediction"] != "ineligible"
+
+    # Invalid sample
+    del sample["param_HR"]
+    response = client.post("/session/bed_1", data=json.dumps(sample), content_type="application/json")
+    assert response.status_code == 400
+
+    response = client.delete("/session/bed_1")
+    assert response.status_code == 204
+
+
+def test_predict_endpoint_binary():
+    from sleepwellbaby.dashboard.binary_payload import binary_mimetype, encode_payload
+
+    client = app.test_client()
+    payload = get_example_payload()
+    payload["observation_date"] = payload["birth_date"]
+    expected = client.post("/predict", data=json.dumps(payload), content_type="application/json").get_json()
+
+    response = client.post("/predict", data=encode_payload(payload), content_type=binary_mimetype)
+    assert response.status_code == 200
+    assert response.get_json() == expected
+
+    response = client.post("/predict", data=encode_payload(payload, dtype="<f4"), content_type=binary_mimetype)
+    assert response.status_code == 200
+    assert response.get_json()["prediction"] == expected["prediction"]
+
+    # Invalid values, header and body
+    invalid = {**payload, "param_RR": {**payload["param_RR"], "values": [-2] + payload["param_RR"]["values"][1:]}}
+    response = client.post("/predict", data=encode_payload(invalid), content_type=binary_mimetype)
+    assert response.status_code == 400
+    assert "param_RR" in response.get_json()["message"]
+    for value in [float("nan"), float("inf")]:
+        invalid = {**payload, "param_HR": {**payload["param_HR"], "values": [value] + payload["param_HR"]["values"][1:]}}
+        response = client.post("/predict", data=encode_payload(invalid), content_type=binary_mimetype)
+        assert response.status_code == 400
+        assert "param_HR" in response.get_json()["message"]
+        assert "finite" in response.get_json()["message"]
+
+    invalid = {**payload, "param_OS": {k: v for k, v in payload["param_OS"].items() if k != "ref2h_mean"}}
+    response = client.post("/predict", data=encode_payload(invalid), content_type=binary_mimetype)
+    assert response.status_code == 400
+    assert "param_OS.ref2h_mean" in response.get_json()["errors"]
+
+    for body in [b"", b"JSON" + encode_payload(payload)[4:], encode_payload(payload)[:-8]]:
+        response = client.post("/predict", data=body, content_type=binary_mimetype)
+        assert response.status_code == 400
+        assert "api_version" in response.get_json()
+
+
+def test_predict_endpoint_validation():
+    client = app.test_client()
+    payload = get_example_payload()
+
+    # observation_date may be null (today)
+    payload["observation_date"] = None
+    response = client.post("/predict", json=payload)
+    assert response.status_code == 200
+
+    response = client.post("/predict", json={**payload, "gestation_period": "200"})
+    assert response.status_code == 400
+    data = response.get_json()
+    assert data["message"] == "Input payload validation failed"
+    assert "gestation_period" in data["errors"]
+
+    # Observation before birth
+    response = client.post("/predict", json={**payload, "observation_date": "2000-01-01"})
+    assert response.status_code == 400
+
+
+def test_api_version(monkeypatch):
+    import sleepwellbaby.dashboard.app as swb_app
+
+    client = app.test_client()
+    payload = get_example_payload()
+    for orjson in [swb_app.orjson, None]:
+        monkeypatch.setattr(swb_app, "orjson", orjson)
+        for response in [
+            client.post("/predict", json=payload),
+            client.post("/predict", json={**payload, "birth_date": "yesterday"}),
+            client.get("/predict"),
+            client.post("/predict_batch", json={}),
+        ]:
+            assert response.mimetype == "application/json"
+            assert response.get_json()["api_version"] == version
+
+        # Not added to the Swagger definitions
+        assert "api_version" not in client.get("/swagger.json").get_json()
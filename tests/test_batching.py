@@ -0,0 +1,172 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import sleepwellbaby.dashboard.app as swb_app
+from sleepwellbaby.batching import BatchedModel, MicroBatcher, Overloaded
+from sleepwellbaby.data import get_example_payload
+from sleepwellbaby.model import get_model, get_prediction
+
+
+def test_micro_batcher():
+    batches = []
+
+    def process_batch(items):
+        batches.append(items)
+        return [2 * i for i in items]
+
+    batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait=0.05)
+    futures = [batcher.submit(i) for i in range(10)]
+    assert [f.result(timeout=10) for f in futures] == [2 * i for i in range(10)]
+    assert all(len(b) <= 4 for b in batches)
+    assert sum(batches, []) == list(range(10))
+
+    metrics = batcher.metrics()
+    assert metrics["items"] == 10
+    assert metrics["batches"] == len(batches)
+    assert metrics["max_batch_size"] == max(map(len, batches))
+    assert 0 <= metrics["mean_wait"] <= metrics["max_wait"]
+    batcher.reset_metrics()
+    assert batcher.metrics()["items"] == 0
+
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit(0)
+
+
+def test_micro_batcher_errors():
+    def process_batch(items):
+        raise ValueError("failed")
+
+    blocked = threading.Event()
+    batcher = MicroBatcher(lambda items: blocked.wait(10) and items, 1, 0.0, max_queue_size=1)
+    batcher.submit(0)  # taken by the dispatcher, which blocks
+    futures, overloaded = [], False
+    for i in range(3):
+        try:
+            futures.append(batcher.submit(i))
+        except Overloaded:
+            overloaded = True
+    assert overloaded
+    blocked.set()
+    assert [f.result(timeout=10) for f in futures] == [[i] for i in range(len(futures))]
+    batcher.close()
+
+    batcher = MicroBatcher(process_batch, 4, 0.0)
+    with pytest.raises(ValueError, match="failed"):
+        batcher.submit(0).result(timeout=10)
+    batcher.close()
+
+
+def test_micro_batcher_batch_size():
+    batches = []
+    blocked = threading.Event()
+
+    def process_batch(items):
+        blocked.wait(10)
+        batches.append(items)
+        return items
+
+    batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait=0.0, item_size=len)
+    futures = [batcher.submit([0])]  # taken by the dispatcher, which blocks
+    time.sleep(0.1)
+    futures += [batcher.submit([i] * n) for i, n in enumerate([3, 2, 6, 1], 1)]
+    blocked.set()
+    assert [f.result(timeout=10) for f in futures] == [[0], [1] * 3, [2] * 2, [3] * 6, [4]]
+    # Rows of a batch do not exceed max_batch_size, unless a single item is larger
+    assert [sum(map(len, b)) for b in batches] == [1, 3, 2, 6, 1]
+    batcher.close()
+
+
+def test_micro_batcher_failing_item():
+    def process_batch(items):
+        if "invalid" in items:
+            raise ValueError("invalid item")
+        return items
+
+    batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait=0.1)
+    futures = [batcher.submit(i) for i in ["a", "invalid", "b"]]
+    assert futures[0].result(timeout=10) == "a"
+    with pytest.raises(ValueError, match="invalid item"):
+        futures[1].result(timeout=10)
+    assert futures[2].result(timeout=10) == "b"
+    assert batcher.metrics()["batches"] == 1
+
+    # Errors of item_size fail the item, not the dispatcher
+    batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait=0.0, item_size=len)
+    with pytest.raises(TypeError):
+        batcher.submit(1).result(timeout=10)
+    assert batcher.submit("c").result(timeout=10) == "c"
+    batcher.close()
+
+
+def test_batched_model_invalid_input():
+    model, model_support_dict = get_model()
+    batched = BatchedModel(model, max_batch_size=16, max_wait=0.1)
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(2, len(model_support_dict["Xcol"]))), columns=model_support_dict["Xcol"])
+    X_nan = X.iloc[1:] * np.nan
+
+    with ThreadPoolExecutor(2) as executor:
+        valid = executor.submit(batched.predict_proba, X.iloc[:1])
+        invalid = executor.submit(batched.predict_proba, X_nan)
+        np.testing.assert_array_equal(valid.result(), model.predict_proba(X.iloc[:1]))
+        with pytest.raises(ValueError):
+            invalid.result()
+    batched.batcher.close()
+
+
+def test_batched_model_timeout(monkeypatch):
+    class SlowModel:
+        classes_ = ["AS", "QS", "W"]
+
+        def predict_proba(self, X):
+            time.sleep(0.5)
+            return np.zeros((len(X), 3))
+
+    batched = BatchedModel(SlowModel(), max_batch_size=4, max_wait=0.0, timeout=0.05)
+    with pytest.raises(TimeoutError):
+        batched.predict_proba(np.zeros((1, 3)))
+
+    payload = get_example_payload()
+    payload["observation_date"] = payload["birth_date"]
+    monkeypatch.setattr(swb_app, "get_serving_model", lambda: (batched, get_model()[1]))
+    client = swb_app.app.test_client()
+    for response in [client.post("/predict", json=payload), client.post("/predict_batch", json=[{**payload, "id": "1"}])]:
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+    batched.batcher.close()
+
+
+def test_batched_model():
+    model, model_support_dict = get_model()
+    batched = BatchedModel(model, max_batch_size=16, max_wait=0.02)
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(40, len(model_support_dict["Xcol"]))), columns=model_support_dict["Xcol"])
+    expected = model.predict_proba(X)
+
+    with ThreadPoolExecutor(8) as executor:
+        rows = list(executor.map(lambda i: batched.predict_proba(X.iloc[i:i + 1]), range(len(X))))
+    np.testing.assert_array_equal(np.concatenate(rows), expected)
+    np.testing.assert_array_equal(batched.predict_proba(X.iloc[:5]), expected[:5])
+    assert batched.metrics()["items"] == len(X) + 1
+    assert batched.metrics()["mean_batch_size"] > 1
+    batched.batcher.close()
+
+
+def test_predict_endpoint_batched_model(monkeypatch):
+    payload = get_example_payload()
+    payload["observation_date"] = payload["birth_date"]
+    monkeypatch.setattr(swb_app, "predict_batch_size", 8)
+
+    model, _ = swb_app.get_serving_model()
+    assert isinstance(model, BatchedModel)
+    client = swb_app.app.test_client()
+    data = client.post("/predict", json=payload).get_json()
+    prediction, pred_proba = get_prediction(payload)
+    assert data["prediction"] == prediction
+    assert data["AS"] == pred_proba["AS"]
@@ -0,0 +1,91 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import sleepwellbaby.dashboard.app as swb_app
+from sleepwellbaby import cache as swb_cache
+from sleepwellbaby.cache import PayloadCache, cached_pipeline, payload_key
+from sleepwellbaby.data import get_example_payload
+from sleepwellbaby.model import get_model, get_prediction
+from sleepwellbaby.preprocess import pipeline
+
+
+@pytest.fixture
+def payload():
+    payload = copy.deepcopy(get_example_payload())
+    payload["observation_date"] = payload["birth_date"]
+    return payload
+
+
+def test_payload_key(payload):
+    key = payload_key(payload)
+    assert len(key) == 16
+    assert payload_key(copy.deepcopy(payload)) == key
+    # Values as array (e.g. binary payloads) give the same key
+    arrays = {**payload, "param_HR": {**payload["param_HR"], "values": np.array(payload["param_HR"]["values"])}}
+    assert payload_key(arrays) == key
+
+    changes = [
+        ("birth_date", "2020-01-02"),
+        ("gestation_period", payload["gestation_period"] + 1),
+        ("observation_date", "2000-01-01"),
+        ("param_RR", {**payload["param_RR"], "ref2h_std": payload["param_RR"]["ref2h_std"] + 1}),
+        ("param_OS", {**payload["param_OS"], "values": payload["param_OS"]["values"][::-1]}),
+    ]
+    for k, v in changes:
+        assert payload_key({**payload, k: v}) != key, k
+
+    today = pd.Timestamp.today().strftime("%Y-%m-%d")
+    assert payload_key({**payload, "observation_date": None}) == payload_key({**payload, "observation_date": today})
+
+
+def test_payload_cache(monkeypatch):
+    cache = PayloadCache(maxsize=2, ttl=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # evicts b, least recently used
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.metrics() == {"hits": 2, "misses": 1, "hit_rate": 2 / 3, "size": 2}
+
+    now = swb_cache.time.monotonic()
+    monkeypatch.setattr(swb_cache.time, "monotonic", lambda: now + 11)
+    assert cache.get("a", "expired") == "expired"
+    assert len(cache) == 1
+
+    cache.clear()
+    assert cache.metrics() == {"hits": 0, "misses": 0, "hit_rate": 0.0, "size": 0}
+
+
+def test_get_prediction_cache(payload):
+    cache = PayloadCache()
+    expected = get_prediction(payload)
+    assert get_prediction(payload, cache=cache) == expected
+    result = get_prediction(payload, cache=cache)
+    assert result == expected
+    result[1]["AS"] = 0  # returned probabilities are a copy
+    assert get_prediction(payload, cache=cache) == expected
+    assert cache.metrics()["hits"] == 2
+    assert cache.metrics()["misses"] == 1
+
+
+def test_cached_pipeline(payload):
+    _, model_support_dict = get_model()
+    cache = PayloadCache()
+    expected = pipeline(payload, model_support_dict)
+    for _ in range(2):
+        pd.testing.assert_frame_equal(cached_pipeline(payload, model_support_dict, cache), expected)
+    assert cache.metrics()["hits"] == 1
+
+
+def test_predict_endpoint_cache(payload, monkeypatch):
+    cache = PayloadCache()
+    monkeypatch.setattr(swb_app, "prediction_cache", cache)
+    client = swb_app.app.test_client()
+    responses = [client.post("/predict", json=payload).get_json() for _ in range(3)]
+    assert responses[0] == responses[1] == responses[2]
+    assert cache.metrics()["hits"] == 2
@@ -3,11 +3,18 @@ import numpy as np
 import pandas as pd
 import pytest
 
+from sleepwellbaby.data import get_example_payload
 from sleepwellbaby.eligibility import (
+    _cached_age_eligibility,
     age_eligibility,
+    cached_age_eligibility,
+    check_eligibility,
+    check_eligibility_batch,
     data_eligibility,
+    ineligibility_reasons,
     reference_eligibility,
 )
+from sleepwellbaby.preprocess import payloads_to_arrays
 
 
 def test_data_eligibility():
@@ -196,3 +203,83 @@ def test_reference_eligibility():
     # One parameter out of bounds
     payload["param_RR"]["ref2h_mean"] = 19  # min is 20
     assert reference_eligibility(payload) is False
+
+    # Missing reference values, as reference_eligibility_array
+    payload["param_RR"]["ref2h_mean"] = 50
+    for key in ["ref2h_mean", "ref24h_std"]:
+        assert reference_eligibility({**payload, "param_HR": {**payload["param_HR"], key: np.nan}}) is False
+
+
+def test_check_eligibility_batch():
+    payloads = []
+    for _ in range(6):
+        payload = get_example_payload()
+        payload["observation_date"] = payload["birth_date"]
+        payloads.append(payload)
+    payloads[1]["gestation_period"] = 300  # PMA above range
+    payloads[2]["param_RR"]["values"][-20:] = [-1] * 20  # newest values missing
+    payloads[3]["param_OS"]["ref2h_std"] = 0  # lower bound not included
+    payloads[4]["param_HR"]["ref24h_mean"] = 100  # lower bound included
+    payloads[5]["gestation_period"] = 300
+    payloads[5]["param_HR"]["ref2h_mean"] = 250
+
+    masks = check_eligibility_batch(**payloads_to_arrays(payloads))
+    for payload, age, data, ref in zip(payloads, masks["age"], masks["data"], masks["reference"]):
+        assert age == age_eligibility(payload)
+        assert data == data_eligibility(payload)
+        assert ref == reference_eligibility(payload)
+    assert masks["eligible"].tolist() == [True, False, False, False, True, False]
+    assert ineligibility_reasons(masks) == [[], ["age"], ["data"], ["reference"], [], ["age", "reference"]]
+
+
+def test_check_eligibility_batch_observation_date():
+    payload = get_example_payload()
+    payload["birth_date"] = "2024-1-1"
+    payload["gestation_period"] = 231
+    arrays = payloads_to_arrays([payload])
+    assert np.isnat(arrays["observation_date"][0])
+    assert arrays["birth_date"][0] == np.datetime64("2024-01-01")
+    # Observation date not provided, checked for today
+    assert not check_eligibility_batch(**arrays)["age"][0]
+
+
+def test_check_eligibility_short_circuit(monkeypatch):
+    payload = get_example_payload()
+    payload["observation_date"] = payload["birth_date"]
+    payload["gestation_period"] = 300  # PMA above range
+    payload["param_HR"]["ref2h_mean"] = 250
+
+    checked = []
+    monkeypatch.setattr(
+        "sleepwellbaby.eligibility.data_eligibility", lambda p: checked.append("data") or data_eligibility(p)
+    )
+    assert check_eligibility(payload) is False
+    assert checked == ["data"]
+
+    checked.clear()
+    assert check_eligibility(payload, short_circuit=True) is False
+    assert checked == []
+
+    # Same result for all combinations of the rules
+    for gestation_period in [231, 300]:
+        for ref2h_mean in [150, 250]:
+            for values in [[100.0] * 192, [-1.0] * 192]:
+                payload["gestation_period"] = gestation_period
+                payload["param_HR"]["ref2h_mean"] = ref2h_mean
+                payload["param_HR"]["values"] = values
+                assert check_eligibility(payload, short_circuit=True, cache_age=True) == check_eligibility(payload)
+
+
+def test_cached_age_eligibility():
+    _cached_age_eligibility.cache_clear()
+    payload = {"birth_date": "2024-01-01", "gestation_period": 231, "observation_date": "2024-01-07"}
+    assert cached_age_eligibility(payload) is True
+    assert cached_age_eligibility(dict(payload)) is True
+    assert _cached_age_eligibility.cache_info().hits == 1
+    payload["observation_date"] = "2024-01-08"
+    assert cached_age_eligibility(payload) is False
+    payload["observation_date"] = None
+    assert cached_age_eligibility(payload) == age_eligibility(payload)
+    payload["observation_date"] = "2023-12-31"
+    with pytest.raises(ValueError, match="Observation date cannot be before birth date."):
+        cached_age_eligibility(payload)
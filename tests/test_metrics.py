@@ -0,0 +1,103 @@
+import copy
+
+import pytest
+
+import sleepwellbaby.dashboard.app as swb_app
+from sleepwellbaby.data import get_example_payload
+from sleepwellbaby.eligibility import check_eligibility
+from sleepwellbaby.metrics import Histogram, Registry, registry
+from sleepwellbaby.model import get_predictions
+
+
+@pytest.fixture
+def enabled_registry(monkeypatch):
+    registry.reset()
+    monkeypatch.setattr(registry, "enabled", True)
+    yield registry
+    registry.reset()
+
+
+def test_histogram():
+    histogram = Histogram([1, 2, 5])
+    for value in [0.5, 1, 3, 10]:
+        histogram.observe(value)
+    assert histogram.counts == [2, 0, 1, 1]
+    assert histogram.sum == 14.5
+    assert histogram.count == 4
+
+
+def test_registry():
+    metrics = Registry()
+    metrics.count("requests_total", endpoint="predict")
+    metrics.observe("seconds", 0.1)
+    with metrics.timer("seconds"):
+        pass
+    assert metrics.render() == "\n"
+
+    metrics.enabled = True
+    metrics.describe("seconds", "histogram", "Duration.", buckets=[0.5, 1])
+    metrics.count("requests_total", endpoint="predict")
+    metrics.count("requests_total", 2, endpoint="predict")
+    metrics.observe("seconds", 0.75, stage="a")
+    with metrics.timer("seconds", stage="a"):
+        pass
+    metrics.collect("cache", lambda: {"hits": 3, "hit_rate": 0.5}, counters=["hits"])
+    lines = metrics.render().splitlines()
+    assert lines.pop(7).startswith('seconds_sum{stage="a"} 0.75')
+    assert lines == [
+        "# TYPE requests_total counter",
+        'requests_total{endpoint="predict"} 3',
+        "# HELP seconds Duration.",
+        "# TYPE seconds histogram",
+        'seconds_bucket{stage="a",le="0.5"} 1',
+        'seconds_bucket{stage="a",le="1"} 2',
+        'seconds_bucket{stage="a",le="+Inf"} 2',
+        'seconds_count{stage="a"} 2',
+        "# TYPE cache_hits counter",
+        "cache_hits 3",
+        "# TYPE cache_hit_rate gauge",
+        "cache_hit_rate 0.5",
+    ]
+
+    metrics.reset()
+    assert metrics.render().splitlines() == lines[-4:]
+
+
+def test_get_predictions_metrics(enabled_registry):
+    payload = copy.deepcopy(get_example_payload())
+    payload["observation_date"] = payload["birth_date"]
+    ineligible = {**payload, "gestation_period": 100}
+    no_data = {**payload, "param_HR": {**payload["param_HR"], "values": [-1] * 192}}
+    results = get_predictions([payload, ineligible, payload, {**no_data, "gestation_period": 100}, no_data])
+
+    # Payloads are counted by their first failing rule only, as in `check_eligibility`
+    counters = enabled_registry._counters
+    assert counters[("swb_ineligible_total", (("reason", "age"),))] == 2
+    assert counters[("swb_ineligible_total", (("reason", "data"),))] == 1
+    for p in [ineligible, {**no_data, "gestation_period": 100}, no_data]:
+        check_eligibility(p)
+    assert counters[("swb_ineligible_total", (("reason", "age"),))] == 4
+    assert counters[("swb_ineligible_total", (("reason", "data"),))] == 2
+    assert counters[("swb_predictions_total", (("prediction", results[0][0]),))] == 2
+    assert counters[("swb_predictions_total", (("prediction", "ineligible"),))] == 3
+    histograms = enabled_registry._histograms
+    assert histograms[("swb_batch_size", (("batcher", "get_predictions"),))].sum == 5
+    for stage in ["eligibility", "pipeline", "rescale", "features", "predict_proba"]:
+        assert histograms[("swb_stage_seconds", (("stage", stage),))].count == 1
+
+
+def test_metrics_endpoint(enabled_registry):
+    payload = copy.deepcopy(get_example_payload())
+    payload["observation_date"] = payload["birth_date"]
+    client = swb_app.app.test_client()
+    client.post("/predict", json=payload)
+    client.post("/predict", json={**payload, "gestation_period": 100})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert 'swb_requests_total{endpoint="do_prediction",status="200"} 2' in text
+    assert 'swb_ineligible_total{reason="age"} 1' in text
+    assert 'swb_stage_seconds_count{stage="predict_proba"} 1' in text
+    assert 'swb_request_seconds_count{endpoint="do_prediction"} 2' in text
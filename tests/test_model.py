@@ -5,6 +5,7 @@ from sklearn.base import BaseEstimator
 from sleepwellbaby.data import get_example_payload
 from sleepwellbaby.model import (
     get_prediction,
+    get_predictions,
     load_model,
     process_prediction,
     return_y_pred,
@@ -77,3 +78,28 @@ def test_get_prediction():
                                             0.20849384661464576,
                                             0.22991198504284074,])
     assert np.isclose(example_payload_expectation, example_payload_prediction).all()
+
+
+def test_get_predictions():
+    model, model_support_dict = load_model()
+    payloads = [get_example_payload() for _ in range(7)]
+    payloads[1]["gestation_period"] = 150  # ineligible, PMA too low
+    payloads[2]["param_HR"]["values"] = payloads[2]["param_HR"]["values"][::-1]
+    payloads[3]["param_RR"]["values"][-30:] = [-1] * 30  # ineligible, data incomplete
+    # ineligible, missing or infinite reference values
+    payloads[4]["param_RR"]["ref2h_std"] = np.nan
+    payloads[5]["param_HR"]["ref24h_mean"] = np.nan
+    payloads[6]["param_OS"]["ref2h_mean"] = np.inf
+
+    results = get_predictions(payloads, model, model_support_dict)
+    assert len(results) == len(payloads)
+    for payload, (pred, proba_dict) in zip(payloads, results):
+        expected_pred, expected_proba = get_prediction(payload, model, model_support_dict)
+        assert pred == expected_pred
+        assert set(proba_dict.keys()) == set(expected_proba.keys())
+        assert all(np.isclose(proba_dict[k], expected_proba[k]) for k in expected_proba)
+    assert results[1][0] == "ineligible"
+    assert results[3][0] == "ineligible"
+    assert [pred for pred, _ in results[4:]] == ["ineligible"] * 3
+
+    assert get_predictions([], model, model_support_dict) == []
@@ -0,0 +1,88 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sleepwellbaby.data import get_example_payload
+from sleepwellbaby.model import get_model, get_prediction, get_predictions, load_model
+from sleepwellbaby.model_arrays import (
+    ArrayModel,
+    export_model_arrays,
+    load_model_arrays,
+)
+from sleepwellbaby.preprocess import pipeline
+
+# Features (X) and probabilities of the sklearn model (proba), recorded from the payloads of
+# test_preprocess with perturbations, and with features on split thresholds of the trees
+corpus_path = Path(__file__).parent / "data" / "inference_corpus.npz"
+
+
+@pytest.fixture(scope="module")
+def model_arrays_dir(tmp_path_factory):
+    model, _ = load_model()
+    return export_model_arrays(model, tmp_path_factory.mktemp("model_arrays"))
+
+
+def test_array_model_matches_model(model_arrays_dir):
+    model, model_support_dict = load_model()
+    array_model = load_model_arrays(model_arrays_dir)
+    assert list(array_model.classes_) == list(model.classes_)
+
+    # Perturbed features of the example payload, including values beyond the calibrator bounds
+    np.random.seed(0)
+    df = pipeline(get_example_payload(), model_support_dict)
+    X = pd.DataFrame(
+        df.values * np.random.normal(1, 0.5, size=(300, df.shape[1])), columns=df.columns
+    )
+    np.testing.assert_array_equal(array_model.predict_proba(X), model.predict_proba(X))
+    np.testing.assert_array_equal(array_model.predict_proba(X.values[:1]), model.predict_proba(X[:1]))
+
+
+def test_load_model_arrays_read_only(model_arrays_dir):
+    array_model = load_model_arrays(model_arrays_dir)
+    assert not array_model.arrays["threshold"].flags.writeable
+    assert isinstance(array_model.arrays["threshold"].base, np.memmap)
+    in_memory = load_model_arrays(model_arrays_dir, mmap_mode=None)
+    assert in_memory.arrays["threshold"].base is None
+
+
+def test_get_model_from_arrays(model_arrays_dir, monkeypatch):
+    monkeypatch.setenv("SWB_MODEL_ARRAYS", str(model_arrays_dir))
+    get_model.cache_clear()
+    try:
+        model, model_support_dict = get_model()
+        assert "Xcol" in model_support_dict
+        pred, proba = get_prediction(get_example_payload(), model, model_support_dict)
+        assert pred == get_prediction(get_example_payload(), *load_model())[0]
+    finally:
+        get_model.cache_clear()
+
+
+def test_array_model_matches_recorded_corpus():
+    model, _ = load_model()
+    array_model = ArrayModel.from_model(model)
+    corpus = np.load(corpus_path)
+    np.testing.assert_array_equal(array_model.predict_proba(corpus["X"]), corpus["proba"])
+    for i in [0, 7, 503]:
+        np.testing.assert_array_equal(array_model.predict_proba(corpus["X"][i:i + 1]), corpus["proba"][i:i + 1])
+
+
+def test_array_model_invalid_input():
+    model, _ = load_model()
+    array_model = ArrayModel.from_model(model)
+    with pytest.raises(ValueError, match="Input contains NaN"):
+        array_model.predict_proba(np.full((1, array_model.n_features_in_), np.nan))
+    with pytest.raises(ValueError, match="X should have shape"):
+        array_model.predict_proba(np.zeros((1, 3)))
+
+
+def test_get_prediction_inference():
+    payloads = [get_example_payload(), get_example_payload()]
+    payloads[1]["param_HR"]["values"] = [-1] * 192
+    model, model_support_dict = load_model()
+    expected = get_predictions(payloads, model, model_support_dict)
+    assert get_predictions(payloads, model, model_support_dict, inference="arrays") == expected
+    assert get_prediction(payloads[0], model, model_support_dict, inference="arrays") == expected[0]
+    with pytest.raises(ValueError, match="inference must be one of"):
+        get_prediction(payloads[0], model, model_support_dict, inference="other")
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+from sleepwellbaby.data import get_example_payload
+from sleepwellbaby.model import load_model
+from sleepwellbaby.preprocess import (
+    StandardScalerWithoutFit,
+    calculate_feature_rows,
+    convert_to_features_native,
+    dict_to_df,
+    feature_positions,
+    pipeline,
+    ref24h_correction,
+    rescale,
+    rescale_parameters,
+    rescale_values,
+    window_statistics,
+)
+
+
+def make_payloads():
+    np.random.seed(42)
+    payloads = [get_example_payload()]
+
+    # Scattered missing values (coded as -1 and 0)
+    payload = get_example_payload()
+    for k in ["param_HR", "param_RR", "param_OS"]:
+        values = np.array(payload[k]["values"])
+        values[np.random.choice(192, 60, replace=False)] = -1
+        values[np.random.choice(192, 10, replace=False)] = 0
+        payload[k]["values"] = values.tolist()
+    payloads.append(payload)
+
+    # Only two values left in the shortest window, and a constant parameter
+    payload = get_example_payload()
+    payload["param_HR"]["values"][-24:-2] = [-1] * 22
+    payload["param_RR"]["values"] = [50.0] * 192
+    payloads.append(payload)
+
+    # Single value and no values at all
+    payload = get_example_payload()
+    payload["param_HR"]["values"][:-1] = [-1] * 191
+    payload["param_RR"]["values"] = [-1] * 192
+    payloads.append(payload)
+    return payloads
+
+
+@pytest.mark.parametrize("payload", make_payloads())
+def test_native_features_match_tsfresh(payload):
+    _, model_support_dict = load_model()
+    df_tsfresh = pipeline(payload, model_support_dict, engine="tsfresh")
+    df_native = pipeline(payload, model_support_dict, engine="native")
+    assert list(df_native.columns) == list(df_tsfresh.columns)
+    assert df_native.shape == (1, len(model_support_dict["Xcol"]))
+    np.testing.assert_allclose(
+        df_native.values, df_tsfresh.values.astype(float), rtol=1e-9, atol=1e-12
+    )
+
+
+def test_window_statistics_batch():
+    from scipy.stats import linregress
+
+    np.random.seed(0)
+    v = np.random.normal(size=(5, 3, 48))
+    v[2, 1, 7] = np.nan
+    stats = window_statistics(v)
+    assert all(result.shape == (5, 3) for result in stats.values())
+    x = v[2, 1][~np.isnan(v[2, 1])]
+    expected = linregress(range(len(x)), x)
+    assert np.isclose(stats['linear_trend__attr_"slope"'][2, 1], expected.slope)
+    assert np.isclose(stats['linear_trend__attr_"pvalue"'][2, 1], expected.pvalue)
+    assert np.isclose(stats["median"][2, 1], np.median(x))
+    assert np.isclose(stats["median"][0, 0], np.median(v[0, 0]))
+
+
+def test_pipeline_invalid_engine():
+    _, model_support_dict = load_model()
+    with pytest.raises(ValueError, match="engine must be one of"):
+        pipeline(get_example_payload(), model_support_dict, engine="other")
+
+
+@pytest.mark.parametrize("payload", make_payloads())
+def test_pipeline_native_matches_dataframes(payload):
+    # Same features as with the DataFrame steps of the tsfresh pipeline
+    _, model_support_dict = load_model()
+    expected = (
+        dict_to_df(payload)
+        .pipe(ref24h_correction, payload)
+        .pipe(convert_to_features_native)
+        .reindex(columns=model_support_dict["Xcol"])
+    )
+    df = pipeline(payload, model_support_dict)
+    assert list(df.columns) == list(expected.columns)
+    np.testing.assert_array_equal(df.values, expected.values)
+
+
+def test_calculate_feature_rows():
+    columns = ["RR__0_60__mean", "other", "HR__0_480__minimum"]
+    positions = feature_positions(columns, ["HR", "RR"])
+    assert positions["mean"][0].tolist() == [-1, 0]
+    assert positions["minimum"][3].tolist() == [2, -1]
+
+    v = np.random.default_rng(0).normal(size=(4, 2, 192))
+    rows = calculate_feature_rows(v, ["HR", "RR"], columns)
+    assert rows.shape == (4, 3)
+    np.testing.assert_array_equal(rows[:, 0], v[:, 1, -24:].mean(axis=-1))
+    assert np.isnan(rows[:, 1]).all()
+    np.testing.assert_array_equal(rows[:, 2], v[:, 0].min(axis=-1))
+
+
+@pytest.mark.parametrize("std", [10.0, 0.0, np.nan])
+def test_rescale_matches_standard_scaler(std):
+    v = np.array(make_payloads()[1]["param_HR"]["values"], dtype=float)
+    expected = v.copy()
+    expected[expected <= 1e-10] = np.nan
+    expected = StandardScalerWithoutFit(120.0, std).transform(expected.reshape(-1, 1))
+    np.testing.assert_array_equal(rescale(v, 120.0, std), expected)
+
+    out = v.copy()
+    assert rescale_values(out, 120.0, std, out=out) is out
+    np.testing.assert_array_equal(out, expected[:, 0])
+
+
+def test_rescale_parameters():
+    payloads = make_payloads()
+    values = np.array([[p[k]["values"] for k in ["param_HR", "param_RR", "param_OS"]] for p in payloads])
+    mean = np.array([[p[k]["ref24h_mean"] for k in ["param_HR", "param_RR", "param_OS"]] for p in payloads])
+    std = np.array([[p[k]["ref24h_std"] for k in ["param_HR", "param_RR", "param_OS"]] for p in payloads])
+    std[0, 1] = 0.0
+
+    result = values.copy()
+    assert rescale_parameters(result, mean, std, ["HR", "RR", "OS"]) is result
+    np.testing.assert_array_equal(result[:, :2], rescale_values(values[:, :2], mean[:, :2], std[:, :2]))
+    np.testing.assert_array_equal(result[:, 2], values[:, 2])  # OS is not rescaled
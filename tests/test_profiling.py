@@ -0,0 +1,77 @@
+import copy
+import pstats
+
+import pytest
+
+import sleepwellbaby.dashboard.app as swb_app
+from sleepwellbaby.data import get_example_payload
+from sleepwellbaby.model import get_prediction
+from sleepwellbaby.profiling import RequestProfiler
+
+
+@pytest.fixture
+def payload():
+    payload = copy.deepcopy(get_example_payload())
+    payload["observation_date"] = payload["birth_date"]
+    return payload
+
+
+def test_request_profiler(payload, tmp_path):
+    with pytest.raises(ValueError):
+        RequestProfiler(2)
+    assert RequestProfiler(0).start("do_prediction") is None
+    profiler = RequestProfiler(1)
+    assert profiler.start("specs") is None
+
+    for _ in range(2):
+        profile = profiler.start("do_prediction")
+        get_prediction(payload)
+        profiler.stop("do_prediction", profile)
+    assert profiler.n_profiled == {"do_prediction": 2}
+
+    summary = profiler.stage_summary()["do_prediction"]
+    assert set(summary) == {"eligibility", "pipeline", "rescale", "features", "predict_proba"}
+    assert summary["predict_proba"]["calls"] == 2
+    assert summary["pipeline"]["cumtime"] >= summary["features"]["cumtime"]
+    assert "predict_proba" in profiler.report()
+
+    paths = profiler.dump(str(tmp_path))
+    assert [p.split("/")[-1] for p in paths] == ["do_prediction.prof", "report.txt"]
+    assert pstats.Stats(paths[0]).total_calls == profiler._stats["do_prediction"].total_calls
+
+    profiler.reset()
+    assert profiler.report() == "No requests profiled\n"
+
+
+def test_admin_profile_endpoint(payload, monkeypatch, tmp_path):
+    client = swb_app.app.test_client()
+    monkeypatch.setattr(swb_app, "profiler", RequestProfiler(1))
+    monkeypatch.setattr(swb_app, "admin_token", None)
+    assert client.get("/admin/profile").status_code == 404
+
+    monkeypatch.setattr(swb_app, "admin_token", "secret")
+    assert client.get("/admin/profile").status_code == 401
+    assert client.delete("/admin/profile", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    client = swb_app.app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = "Bearer secret"
+    monkeypatch.setattr(swb_app, "profiler", None)
+    assert client.get("/admin/profile").status_code == 404
+
+    monkeypatch.setattr(swb_app, "profiler", RequestProfiler(1))
+    monkeypatch.setattr(swb_app, "profile_dir", str(tmp_path))
+    for _ in range(2):
+        assert client.post("/predict", json=payload).status_code == 200
+    client.get("/metrics")  # not profiled
+
+    response = client.get("/admin/profile")
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).startswith("do_prediction: 2 profiled requests")
+    response = client.get("/admin/profile?endpoint=do_prediction")
+    assert response.mimetype == "application/octet-stream"
+    assert client.get("/admin/profile?endpoint=do_prediction_batch").status_code == 404
+
+    files = client.post("/admin/profile").get_json()["files"]
+    assert (tmp_path / "do_prediction.prof").exists()
+    assert len(files) == 2
+    assert client.delete("/admin/profile").status_code == 204
+    assert swb_app.profiler.n_profiled == {}
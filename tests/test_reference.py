@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sleepwellbaby.data import compute_reference_values, generate_mock_signalbase_data
+from sleepwellbaby.reference import ReferenceValues, RollingMeanStd
+
+
+def make_df(freq='S'):
+    np.random.seed(42)
+    df = generate_mock_signalbase_data(duration=30, freq=freq).set_index('datetime')
+    # Gaps in the recording and missing values
+    df = df.drop(df.index[10000:20000])
+    df.loc[df.index[np.random.choice(len(df), len(df) // 10, replace=False)], 'HR'] = np.nan
+    df.loc[df.index[30000:40000], 'RESP'] = np.nan
+    return df
+
+
+@pytest.mark.parametrize("freq", ['S', '2s500ms'])
+def test_streaming_reference_values_match_pandas(freq):
+    hz = 1 if freq == 'S' else 0.4
+    df = make_df(freq)
+    expected = compute_reference_values(df.copy(), freq=hz)
+    result = compute_reference_values(df.copy(), freq=hz, method='streaming')
+    assert list(result.columns) == list(expected.columns)
+    # Values without sufficient samples should be missing in both
+    assert expected['HR_24h_mean'].isna().any()
+    np.testing.assert_allclose(result.values.astype(float), expected.values.astype(float), rtol=1e-8)
+
+
+def test_streaming_reference_values_incremental():
+    df = make_df().iloc[:20000]
+    expected = compute_reference_values(df.copy(), freq=1, tolerance_24=0.01)
+    columns = ReferenceValues().output_columns
+
+    # Per sample
+    reference = ReferenceValues(tolerance_24=0.01)
+    result = [reference.update(t, row) for t, row in zip(df.index, df[['HR', 'RESP', 'SpO2']].to_dict('records'))]
+    result = pd.DataFrame(result, index=df.index)
+    np.testing.assert_allclose(result[columns].values, expected[columns].values, rtol=1e-8)
+
+    # Blocks of varying size
+    reference = ReferenceValues(tolerance_24=0.01)
+    result = np.concatenate([
+        reference.update_many(df.index[a:b], df[['HR', 'RESP', 'SpO2']].values[a:b])
+        for a, b in [(0, 1), (1, 5000), (5000, 5001), (5001, 20000)]
+    ])
+    np.testing.assert_allclose(result, expected[columns].values, rtol=1e-8)
+
+    with pytest.raises(ValueError, match="chronological order"):
+        reference.update(df.index[0], [1, 2, 3])
+
+
+def test_rolling_mean_std_infinite_values():
+    df = make_df().iloc[:600][['HR', 'RESP', 'SpO2']]
+    df.iloc[100, 0] = np.inf
+    df.iloc[200, 1] = -np.inf
+    rolling = RollingMeanStd(pd.Timedelta(1, 'min'), 10, 3)
+    result = np.array([np.concatenate(rolling.update(t, row)) for t, row in zip(df.index, df.values)])
+    # Infinite values are missing values, pandas recovers once they have left the window
+    finite = df.replace([np.inf, -np.inf], np.nan).rolling('1min', min_periods=10)
+    np.testing.assert_allclose(result, np.hstack([finite.mean().values, finite.std().values]), rtol=1e-8)
+    window = df.rolling('1min', min_periods=10)
+    expected = np.hstack([window.mean().values, window.std().values])
+    after = df.index > df.index[200] + pd.Timedelta(1, 'min')
+    assert after.sum() > 300
+    np.testing.assert_allclose(result[after], expected[after], rtol=1e-8)
+
+
+def test_compute_reference_values_invalid_method():
+    with pytest.raises(ValueError, match="method must be"):
+        compute_reference_values(make_df().iloc[:10], method='other')
@@ -0,0 +1,85 @@
+import copy
+
+import pytest
+
+import sleepwellbaby.dashboard.app as swb_app
+from sleepwellbaby.batching import Overloaded
+from sleepwellbaby.dashboard.serving import PredictionPool, predict_payloads
+from sleepwellbaby.data import get_example_payload
+from sleepwellbaby.model import get_prediction
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = PredictionPool(n_workers=1, max_batch_size=4, max_wait=0.05, max_queue_size=8)
+    yield pool
+    pool.close()
+
+
+def _payloads(n):
+    payloads = []
+    for i in range(n):
+        payload = copy.deepcopy(get_example_payload())
+        payload["observation_date"] = payload["birth_date"]
+        payload["param_HR"]["values"][-1] += i
+        payloads.append(payload)
+    return payloads
+
+
+def test_prediction_pool(pool):
+    payloads = _payloads(6)
+    futures = [pool.submit(payload) for payload in payloads]
+    for payload, future in zip(payloads, futures):
+        assert future.result(timeout=120) == get_prediction(payload)
+    assert pool.predict(payloads[0]) == get_prediction(payloads[0])
+
+
+def test_prediction_pool_invalid_payload(pool):
+    payloads = _payloads(3)
+    payloads[1]["param_HR"]["values"] = [float("nan")] * len(payloads[1]["param_HR"]["values"])
+
+    results = predict_payloads(payloads, "sklearn")
+    assert isinstance(results[1], ValueError)
+    assert results[0] == get_prediction(payloads[0])
+    assert results[2] == get_prediction(payloads[2])
+
+    futures = [pool.submit(payload) for payload in payloads]
+    assert futures[0].result(timeout=120) == results[0]
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=120)
+    assert futures[2].result(timeout=120) == results[2]
+
+
+def test_prediction_pool_overloaded(pool):
+    # Block the dispatcher, so payloads stay in the queue
+    for _ in range(2 * pool.n_workers):
+        pool._slots.acquire()
+    futures = []
+    with pytest.raises(Overloaded):
+        for payload in _payloads(pool.max_batch_size + pool.queue.maxsize + 1):
+            futures.append(pool.submit(payload))
+    for _ in range(2 * pool.n_workers):
+        pool._slots.release()
+    for future in futures:
+        assert future.result(timeout=120)[0] in ["AS", "QS", "W", "ineligible"]
+
+
+def test_predict_endpoint_pool(pool, monkeypatch):
+    client = swb_app.app.test_client()
+    payload = _payloads(1)[0]
+    expected = client.post("/predict", json=payload).get_json()
+
+    monkeypatch.setattr(swb_app, "get_pool", lambda inference: pool)
+    assert client.post("/predict", json=payload).get_json() == expected
+    # Observation before birth fails before it is batched
+    response = client.post("/predict", json={**payload, "observation_date": "2000-01-01"})
+    assert response.status_code == 400
+
+    def overloaded(payload, timeout=None):
+        raise Overloaded("Prediction queue is full")
+
+    monkeypatch.setattr(pool, "predict", overloaded)
+    response = client.post("/predict", json=payload)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.get_json()["api_version"]
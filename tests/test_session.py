@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sleepwellbaby.model import get_prediction, load_model
+from sleepwellbaby.preprocess import pipeline
+from sleepwellbaby.session import PatientSession, SessionStore
+
+references = {
+    "param_HR": {"ref2h_mean": 150.0, "ref2h_std": 20.0, "ref24h_mean": 148.0, "ref24h_std": 19.0},
+    "param_RR": {"ref2h_mean": 50.0, "ref2h_std": 15.0, "ref24h_mean": 52.0, "ref24h_std": 14.0},
+    "param_OS": {"ref2h_mean": 95.0, "ref2h_std": 4.0, "ref24h_mean": 94.0, "ref24h_std": 4.5},
+}
+
+
+def make_samples(n):
+    np.random.seed(42)
+    samples = pd.DataFrame({
+        "param_HR": np.random.normal(150, 20, n),
+        "param_RR": np.random.normal(50, 15, n),
+        "param_OS": np.random.choice(range(85, 100), n).astype(float),
+    }, index=pd.date_range("2024-01-10", periods=n, freq="2500ms"))
+    samples.iloc[np.random.choice(n, n // 8, replace=False), 0] = np.nan
+    samples.iloc[np.random.choice(n, n // 8, replace=False), 1] = -1
+    samples.iloc[np.random.choice(n, n // 20, replace=False), 2] = np.nan
+    samples.iloc[300:330, 2] = 97.0  # constant values
+    return samples
+
+
+def test_session_matches_payload_prediction():
+    model, model_support_dict = load_model()
+    session = PatientSession("2024-01-01", 210, model, model_support_dict)
+    samples = make_samples(500)
+    for i, (t, row) in enumerate(samples.iterrows()):
+        if i % 40 != 39 and i < 490:
+            session.append(t, row.to_dict(), references)
+            continue
+        pred, proba_dict = session.append_and_predict(t, row.to_dict(), references)
+        payload = session.to_payload()
+        assert payload["param_HR"]["values"][-1] == (-1 if np.isnan(row["param_HR"]) else row["param_HR"])
+        np.testing.assert_allclose(
+            session.features().values, pipeline(payload, model_support_dict).values, rtol=1e-7, atol=1e-9
+        )
+        expected_pred, expected_proba = get_prediction(payload, model, model_support_dict)
+        assert pred == expected_pred
+        assert all(np.isclose(proba_dict[k], expected_proba[k]) for k in expected_proba)
+    assert pred != "ineligible"
+
+
+def test_session_without_references():
+    model, model_support_dict = load_model()
+    session = PatientSession("2024-01-01", 210, model, model_support_dict)
+    assert session.predict()[0] == "ineligible"
+    samples = make_samples(400)
+    for t, row in samples.iterrows():
+        session.append(t, row.to_dict())
+    pred, _ = session.predict()
+    # Not enough samples for the 24h reference values
+    assert pred == "ineligible"
+    assert np.isnan(session.references["param_HR"]["ref24h_mean"])
+    assert session.references["param_HR"]["ref2h_mean"] == pytest.approx(samples["param_HR"][samples["param_HR"] > 0].mean())
+
+
+def test_session_gaps():
+    model, model_support_dict = load_model()
+    session = PatientSession("2024-01-01", 210, model, model_support_dict)
+    samples = make_samples(300)
+    # Samples from 253 onwards are received after a gap of more than 8 minutes
+    samples.index = samples.index.where(np.arange(300) < 253, samples.index + pd.Timedelta(10, "min"))
+    dropped = [100, 101, 102, 250, 251, 252]
+    expected = samples["param_HR"].fillna(-1)
+    expected.iloc[dropped] = -1
+    for i, (t, row) in enumerate(samples.iterrows()):
+        if i in dropped:
+            continue
+        session.append(t, row.to_dict(), references)
+        if i in [103, 200, 253, 299]:
+            window = expected.iloc[253 if i >= 253 else 0:i + 1].iloc[-192:].tolist()
+            assert session.to_payload()["param_HR"]["values"] == [-1] * (192 - len(window)) + window
+            np.testing.assert_allclose(
+                session.features().values, pipeline(session.to_payload(), model_support_dict).values, rtol=1e-7, atol=1e-9
+            )
+
+    # Infinite values are missing
+    t = session.timestamp + pd.Timedelta(2500, "ms")
+    session.append(t, {**samples.iloc[-1].to_dict(), "param_HR": np.inf}, references)
+    assert session.to_payload()["param_HR"]["values"][-1] == -1
+
+    for refs in [references, None]:
+        with pytest.raises(ValueError, match="increasing"):
+            session.append(session.timestamp, samples.iloc[-1].to_dict(), refs)
+
+
+def test_session_store(monkeypatch):
+    model, model_support_dict = load_model()
+    now = [0.0]
+    monkeypatch.setattr("sleepwellbaby.session.time.monotonic", lambda: now[0])
+    store = SessionStore(maxsize=2, ttl=60)
+    session = store.get("bed_1", "2024-01-01", 210, model, model_support_dict)
+    assert store.get("bed_1", "2024-01-01", 210, model, model_support_dict) is session
+    # Another patient in the same bed
+    assert store.get("bed_1", "2024-01-02", 210, model, model_support_dict) is not session
+
+    now[0] = 30.0
+    store.get("bed_2", "2024-01-01", 210, model, model_support_dict)
+    store.get("bed_3", "2024-01-01", 210, model, model_support_dict)
+    assert "bed_1" not in store and len(store) == 2
+
+    now[0] = 95.0
+    store.get("bed_3", "2024-01-01", 210, model, model_support_dict)
+    assert "bed_2" not in store and len(store) == 1
+    assert store.pop("bed_3") is not None
+    assert store.pop("bed_3") is None
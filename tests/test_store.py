@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sleepwellbaby.data import compute_reference_values, generate_mock_signalbase_data
+from sleepwellbaby.store import (
+    Recording,
+    RecordingWriter,
+    read_recordings,
+    write_recording,
+    write_recordings,
+)
+from sleepwellbaby.utils import compute_swb_predictions
+
+
+@pytest.fixture(scope="module")
+def mock_data():
+    np.random.seed(0)
+    df = generate_mock_signalbase_data(duration=3, freq="2s500ms")
+    df[["HR", "RESP"]] = df[["HR", "RESP"]].round()  # representable as float32
+    df = df.drop(index=np.random.choice(len(df), 50, replace=False))
+    df.loc[df.sample(frac=0.05, random_state=0).index, "HR"] = np.nan
+    return df
+
+
+def test_recording(mock_data, tmp_path):
+    write_recording(str(tmp_path), mock_data, "2s500ms", chunk_size=1000)
+    recording = Recording(str(tmp_path))
+    assert recording.start == mock_data["datetime"].iloc[0]
+    assert recording.end == mock_data["datetime"].iloc[-1]
+    assert recording.present.sum() == len(mock_data)
+
+    df = compute_reference_values(mock_data.set_index("datetime"), freq=0.4, method="streaming")
+    df_store = recording.to_frame()
+    pd.testing.assert_index_equal(df_store.index, df.index, check_names=False)
+    np.testing.assert_allclose(df_store.values, df[df_store.columns].values, rtol=1e-6, equal_nan=True)
+    assert len(recording.to_frame("2000-01-01 01:00", "2000-01-01 01:59:59")) <= 1440
+
+    positions = recording.positions(mock_data["datetime"].iloc[[0, 5]].tolist() + ["1999-12-31", "2000-01-01 00:00:01"])
+    assert positions.tolist() == [0, 5, -1, -1]
+
+
+def test_recording_predict(mock_data, tmp_path):
+    write_recordings(str(tmp_path), mock_data, "2s500ms", birth_date="1999-12-18", gestation_period=210)
+    (patient_id, recording), = read_recordings(str(tmp_path))
+    assert patient_id == "1"
+
+    df = compute_reference_values(mock_data.set_index("datetime"), freq=0.4, method="streaming")
+    expected = compute_swb_predictions(df, recording.default_indices(), "1999-12-18", 210, "2s500ms")
+    df_pred = recording.predict(chunk_size=50)
+    assert (df_pred["prediction"] != "ineligible").any()
+    pd.testing.assert_series_equal(df_pred["prediction"], expected["prediction"])
+    np.testing.assert_allclose(df_pred[["AS", "QS", "W"]].astype(float), expected[["AS", "QS", "W"]].astype(float), atol=1e-5)
+
+    with pytest.raises(ValueError, match="missing"):
+        recording.predict(indices=[recording.start])
+
+
+def test_recording_writer_errors(tmp_path):
+    writer = RecordingWriter(str(tmp_path), "2000-01-01")
+    with pytest.raises(ValueError, match="grid"):
+        writer.append(pd.DatetimeIndex(["2000-01-01 00:00:00.5"]), np.zeros((1, 3)))
+    writer.append(pd.DatetimeIndex(["2000-01-01 00:00:02"]), np.zeros((1, 3)))
+    with pytest.raises(ValueError, match="increasing"):
+        writer.append(pd.DatetimeIndex(["2000-01-01 00:00:01"]), np.zeros((1, 3)))
+    writer.close()
+    recording = Recording(str(tmp_path))
+    assert len(recording) == 3
+    assert recording.present.tolist() == [0, 0, 1]
+    with pytest.raises(ValueError, match="birth_date"):
+        recording.predict()
+
+
+def test_recording_writer_error(mock_data, tmp_path):
+    write_recordings(str(tmp_path), mock_data, "2s500ms")
+    with pytest.raises(ValueError, match="increasing"):
+        with RecordingWriter(str(tmp_path / "1"), "2000-01-01", "2s500ms") as writer:
+            writer.append(pd.DatetimeIndex(["2000-01-01 00:00:05"]), np.zeros((1, 3)))
+            writer.append(pd.DatetimeIndex(["2000-01-01 00:00:02.5"]), np.zeros((1, 3)))
+    assert all(f.closed for f in writer._files.values())
+    # The incomplete recording has no meta information and is not read
+    assert not (tmp_path / "1" / "meta.json").exists()
+    assert list(read_recordings(str(tmp_path))) == []
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sleepwellbaby.data import compute_reference_values, generate_mock_signalbase_data
+from sleepwellbaby.streaming import (
+    StreamingPredictor,
+    read_chunks,
+    stream_predictions,
+    write_predictions,
+)
+from sleepwellbaby.utils import get_swb_predictions_parallel
+
+
+@pytest.fixture(scope="module")
+def export(tmp_path_factory):
+    np.random.seed(0)
+    dfs = []
+    for patient_id in [1, 2]:
+        df = generate_mock_signalbase_data(duration=3, freq="2s500ms")
+        df["ID"] = patient_id
+        dfs.append(df.drop(index=np.random.choice(len(df), 50, replace=False)))
+    path = str(tmp_path_factory.mktemp("export") / "export.csv")
+    pd.concat(dfs).to_csv(path, index=False)
+    return path
+
+
+def expected_predictions(path):
+    df = pd.read_csv(path, parse_dates=["datetime"])
+    dfs = [
+        compute_reference_values(d.set_index("datetime"), freq=0.4, method="streaming") for _, d in df.groupby("ID")
+    ]
+    return get_swb_predictions_parallel(dfs, "1999-12-18", 210, freq="2s500ms", n_jobs=1)
+
+
+def test_stream_predictions(export):
+    chunks = list(read_chunks(export, chunk_size=1000))
+    assert len(chunks) == 9
+    assert pd.api.types.is_datetime64_any_dtype(chunks[0]["datetime"])
+
+    results = list(stream_predictions(export, "1999-12-18", 210, freq="2s500ms", chunk_size=1000))
+    assert len(results) > 1
+    df_pred = pd.concat(results, ignore_index=True)
+    expected = expected_predictions(export)
+    pd.testing.assert_frame_equal(df_pred[["ID", "datetime", "prediction"]], expected[["ID", "datetime", "prediction"]])
+    assert (df_pred["prediction"] != "ineligible").any()
+    np.testing.assert_allclose(
+        df_pred[["AS", "QS", "W"]].astype(float), expected[["AS", "QS", "W"]].astype(float), rtol=1e-9
+    )
+
+
+def test_write_predictions(export, tmp_path):
+    output = str(tmp_path / "predictions.csv")
+    n_rows = write_predictions(export, output, {1: "1999-12-18", 2: "1999-12-18"}, {1: 210, 2: 210}, freq="2s500ms")
+    df_pred = pd.read_csv(output, parse_dates=["datetime"])
+    assert len(df_pred) == n_rows == len(expected_predictions(export))
+    assert list(df_pred.columns) == ["ID", "datetime", "prediction", "AS", "QS", "W"]
+
+    with pytest.raises(FileExistsError):
+        write_predictions(export, output, "1999-12-18", 210, freq="2s500ms")
+    assert write_predictions(export, output, "1999-12-18", 210, freq="2s500ms", overwrite=True) == n_rows
+    assert len(pd.read_csv(output)) == n_rows
+
+
+def test_write_predictions_parquet(export, tmp_path):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "export.parquet")
+    pd.read_csv(export, parse_dates=["datetime"]).to_parquet(path, index=False)
+    output = str(tmp_path / "predictions.parquet")
+    n_rows = write_predictions(path, output, "1999-12-18", 210, freq="2s500ms", chunk_size=1000)
+    df_pred = pd.read_parquet(output)
+    expected = expected_predictions(export)
+    assert len(df_pred) == n_rows == len(expected)
+    pd.testing.assert_frame_equal(df_pred[["ID", "datetime", "prediction"]], expected[["ID", "datetime", "prediction"]])
+    np.testing.assert_allclose(df_pred[["AS", "QS", "W"]], expected[["AS", "QS", "W"]].astype(float), rtol=1e-9)
+
+
+def test_streaming_predictor_order():
+    df = generate_mock_signalbase_data(duration=1).set_index("datetime")
+    predictor = StreamingPredictor("1999-12-18", 210)
+    predictor.update(df.iloc[:100])
+    with pytest.raises(ValueError, match="chronological"):
+        predictor.update(df.iloc[50:150])
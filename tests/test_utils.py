@@ -1,8 +1,13 @@
+import numpy as np
 import pandas as pd
 import pytest
 
 from sleepwellbaby.data import compute_reference_values, generate_mock_signalbase_data
-from sleepwellbaby.utils import get_swb_predictions
+from sleepwellbaby.utils import (
+    compute_swb_predictions,
+    get_swb_predictions,
+    get_swb_predictions_parallel,
+)
 
 
 def test_get_swb_predictions():
@@ -40,3 +45,71 @@ def test_get_swb_predictions():
                 df_pred, columns = get_swb_predictions(df, t_range_swb,birth_date='2000-01-01', gestation_period=210, freq='S', missing_index_threshold=1)
             except ValueError:
                 pytest.fail("ValueError was raised when missing_index_threshold=1")
+
+
+@pytest.mark.parametrize("freq", ['S', '2s500ms'])
+def test_get_swb_predictions_vectorized(freq):
+    np.random.seed(42)
+    df = generate_mock_signalbase_data(duration=3, freq=freq).sort_values(by='datetime').set_index('datetime')
+    # Introduce missing rows and missing values
+    df = df.drop(df.index[np.random.choice(len(df), len(df) // 50, replace=False)])
+    df.loc[df.index[np.random.choice(len(df), len(df) // 20, replace=False)], 'HR'] = np.nan
+    df.loc[df.index[5000:5400], 'RESP'] = np.nan
+    df = compute_reference_values(df, freq=1 if freq == 'S' else 0.4)
+
+    # Windows without reference values are included
+    t_range_swb = pd.date_range(start='2000-01-01 01:00', end='2000-01-01 02:59', freq='1min')
+    t_range_swb = t_range_swb[t_range_swb.isin(df.index)]
+    kwargs = dict(birth_date='2000-01-01', gestation_period=210, freq=freq, missing_index_threshold=0.2)
+
+    df_loop, columns_loop = get_swb_predictions(df.copy(), t_range_swb, vectorized=False, **kwargs)
+    df_vect, columns_vect = get_swb_predictions(df.copy(), t_range_swb, **kwargs)
+
+    assert columns_vect == columns_loop
+    assert (df_loop.loc[t_range_swb, 'prediction'] == 'ineligible').any()
+    assert (df_loop.loc[t_range_swb, 'prediction'] != 'ineligible').any()
+    pd.testing.assert_series_equal(df_vect['prediction'], df_loop['prediction'])
+    np.testing.assert_allclose(
+        df_vect[columns_loop].astype(float).values, df_loop[columns_loop].astype(float).values, rtol=1e-12
+    )
+
+    # Predicting in chunks gives the same predictions
+    df_chunked = compute_swb_predictions(
+        df, t_range_swb, '2000-01-01', 210, freq, missing_index_threshold=0.2, chunk_size=7
+    )
+    pd.testing.assert_frame_equal(df_chunked, compute_swb_predictions(df, t_range_swb, '2000-01-01', 210, freq, 0.2))
+
+
+def test_get_swb_predictions_parallel():
+    np.random.seed(42)
+    dfs = []
+    for patient_id in [3, 1]:
+        df = generate_mock_signalbase_data(duration=2).set_index('datetime')
+        df['ID'] = patient_id
+        dfs.append(compute_reference_values(df))
+    gestation_period = {3: 210, 1: 180}  # patient 1 is ineligible
+
+    df_pred = get_swb_predictions_parallel(
+        pd.concat(dfs).reset_index(), birth_date='2000-01-01', gestation_period=gestation_period,
+        chunk_size=25, n_jobs=2
+    )
+    assert list(df_pred.columns) == ['ID', 'datetime', 'prediction', 'AS', 'QS', 'W']
+    assert list(df_pred['ID'].unique()) == [3, 1]
+    for df in dfs:
+        patient_id = df['ID'].iloc[0]
+        result = df_pred[df_pred['ID'] == patient_id].set_index('datetime')
+        # Every whole minute, starting once a full window is available
+        assert result.index[0] == pd.Timestamp('2000-01-01 00:08')
+        assert result.index[-1] == pd.Timestamp('2000-01-01 01:59')
+        expected = compute_swb_predictions(
+            df, result.index, birth_date='2000-01-01', gestation_period=gestation_period[patient_id]
+        )
+        pd.testing.assert_frame_equal(result.drop(columns='ID'), expected, check_names=False, check_dtype=False)
+    assert (df_pred.loc[df_pred['ID'] == 1, 'prediction'] == 'ineligible').all()
+    assert (df_pred.loc[df_pred['ID'] == 3, 'prediction'] != 'ineligible').any()
+
+    # List of DataFrames, processed in the current process
+    df_pred_list = get_swb_predictions_parallel(
+        dfs, birth_date='2000-01-01', gestation_period=gestation_period, chunk_size=1000, n_jobs=1
+    )
+    pd.testing.assert_frame_equal(df_pred_list, df_pred)
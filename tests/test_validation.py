@@ -0,0 +1,104 @@
+import copy
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from sleepwellbaby.dashboard.app import (
+    app,
+    batch_item_validator,
+    format_checker,
+    model_in_pred,
+    models_resolver,
+    payload_validator,
+)
+from sleepwellbaby.dashboard.validation import is_date, is_valid_payload
+from sleepwellbaby.data import get_example_payload
+
+
+def _mutate(payload, path, value):
+    payload = copy.deepcopy(payload)
+    *keys, last = path
+    target = payload
+    for k in keys:
+        target = target[k]
+    if value is KeyError:
+        del target[last]
+    else:
+        target[last] = value
+    return payload
+
+
+mutations = [
+    (("birth_date",), "2020-13-01"),
+    (("birth_date",), 20200101),
+    (("birth_date",), None),
+    (("observation_date",), None),
+    (("observation_date",), "yesterday"),
+    (("observation_date",), KeyError),
+    (("gestation_period",), 200.5),
+    (("gestation_period",), True),
+    (("gestation_period",), "200"),
+    (("param_HR",), KeyError),
+    (("param_HR",), []),
+    (("param_RR", "ref24h_std"), KeyError),
+    (("param_RR", "ref24h_std"), "1"),
+    (("param_RR", "ref2h_mean"), True),
+    (("param_OS", "values"), list(range(191))),
+    (("param_OS", "values"), list(range(193))),
+    (("param_OS", "values"), [-2] + list(range(191))),
+    (("param_OS", "values"), [None] + list(range(191))),
+    (("param_OS", "values"), [True] + list(range(191))),
+    (("param_OS", "values"), "values"),
+]
+
+
+@pytest.mark.parametrize("path, value", mutations)
+def test_payload_validator_matches_jsonschema(path, value):
+    payload = get_example_payload()
+    payload["observation_date"] = payload["birth_date"]
+    payload = _mutate(payload, path, value)
+
+    # Validation by flask_restx
+    with app.app_context():
+        expected = {}
+        try:
+            model_in_pred.validate(payload, models_resolver, format_checker)
+        except BadRequest as e:
+            expected = e.data["errors"]
+    assert payload_validator.errors(payload) == expected
+    if expected:
+        assert not is_valid_payload(payload)
+
+
+def test_payload_validator_valid():
+    payload = get_example_payload()
+    assert is_valid_payload(payload)  # observation_date is null
+    assert payload_validator.errors(payload) == {}
+
+    payload["observation_date"] = payload["birth_date"]
+    assert payload_validator.errors(payload) == {}
+    assert payload_validator.errors([payload]) != {}
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), float("-inf")])
+def test_payload_validator_non_finite(value):
+    payload = get_example_payload()
+    payload = _mutate(payload, ("param_HR", "values"), [value] + list(range(191)))
+    assert not is_valid_payload(payload)
+    errors = payload_validator.errors(payload)
+    assert "finite" in errors["param_HR.values"]
+    assert set(errors) <= {"param_HR.values", "param_HR.values.0"}  # -inf is also smaller than the minimum
+
+
+def test_batch_item_validator():
+    payload = get_example_payload()
+    assert "id" in batch_item_validator.errors(payload)
+    assert batch_item_validator.errors({**payload, "id": "a"}) == {}
+    assert "id" in batch_item_validator.errors({**payload, "id": 1})
+
+
+def test_is_date():
+    assert is_date("2021-01-01")
+    assert is_date("2021-1-1")
+    assert not is_date("2021-02-30")
+    assert not is_date("01-01-2021")